@@ -0,0 +1,169 @@
+import os
+import json
+import logging
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+CAMPOS = ('GRUPO', 'GUIA', 'BONO', 'MONTO', 'ASISTENTES')
+
+# Una fila reconstruida a partir de las columnas (para CSV y para mostrar)
+Fila = namedtuple('Fila', CAMPOS)
+
+# Bitácora de eventos del modo ligero; la instantánea vive al lado con extensión .snap
+BITACORA_MEMORIA = os.environ.get('BITACORA_MEMORIA', 'congreso_memoria.log')
+
+# Eventos en la bitácora antes de compactarla en una instantánea
+EVENTOS_POR_INSTANTANEA = int(os.environ.get('EVENTOS_POR_INSTANTANEA', '500'))
+
+def _entero(texto):
+    """ASISTENTES como entero, o None si lo capturado no es un número"""
+    try:
+        return int(texto)
+    except (TypeError, ValueError):
+        return None
+
+class AlmacenMemoria:
+    """Registros del modo ligero en memoria, por columnas y con bitácora en disco
+
+    Cada alta o limpieza se agrega como una línea JSON a la bitácora antes de
+    aplicarse. Cada ``cada`` eventos el estado completo se guarda como
+    instantánea (rename atómico) y la bitácora se vacía; al arrancar se carga
+    la instantánea y se reaplican solo los eventos posteriores. Los totales se
+    llevan al día en cada alta, así las estadísticas no recorren los datos.
+    """
+    
+    def __init__(self, ruta=BITACORA_MEMORIA, cada=EVENTOS_POR_INSTANTANEA):
+        self.ruta = ruta
+        self.ruta_instantanea = f'{os.path.splitext(ruta)[0]}.snap'
+        self.cada = cada
+        self._vaciar()
+        self.secuencia = 0
+        self._pendientes = 0
+        
+        self._recuperar()
+        self._bitacora = open(self.ruta, 'a', encoding='utf-8')
+    
+    def _vaciar(self):
+        """Deja las columnas y los totales en cero"""
+        self.columnas = {campo: [] for campo in CAMPOS}
+        self.total_asistentes = 0
+        self.asistentes_invalidos = 0
+    
+    def _aplicar(self, evento):
+        """Aplica un evento al estado en memoria (sin escribir nada)"""
+        if evento['op'] == 'alta':
+            for campo, valor in zip(CAMPOS, evento['fila']):
+                self.columnas[campo].append(valor)
+            asistentes = _entero(evento['fila'][-1])
+            if asistentes is None:
+                self.asistentes_invalidos += 1
+            else:
+                self.total_asistentes += asistentes
+        elif evento['op'] == 'limpiar':
+            self._vaciar()
+        self.secuencia = evento['n']
+    
+    def _recuperar(self):
+        """Carga la última instantánea y reaplica la bitácora que la sigue"""
+        if os.path.exists(self.ruta_instantanea):
+            with open(self.ruta_instantanea, encoding='utf-8') as f:
+                instantanea = json.load(f)
+            self.secuencia = instantanea['n']
+            self.columnas = {campo: instantanea['columnas'][campo] for campo in CAMPOS}
+            self.total_asistentes = instantanea['total_asistentes']
+            self.asistentes_invalidos = instantanea['asistentes_invalidos']
+        
+        if not os.path.exists(self.ruta):
+            return
+        valido = 0
+        with open(self.ruta, 'rb') as f:
+            for numero, linea in enumerate(f, 1):
+                try:
+                    # Sin salto de línea la escritura no terminó, aunque el JSON parezca completo
+                    if not linea.endswith(b'\n'):
+                        raise ValueError('línea sin terminar')
+                    evento = json.loads(linea)
+                except ValueError:
+                    # Una línea a medio escribir al caerse el proceso: lo que sigue no es confiable
+                    logger.warning(f"Bitácora {self.ruta}: línea {numero} incompleta, se ignora desde ahí")
+                    break
+                # Eventos ya incluidos en la instantánea (caída entre instantánea y truncado)
+                if evento['n'] > self.secuencia:
+                    self._aplicar(evento)
+                    self._pendientes += 1
+                valido += len(linea)
+        
+        # Se corta la cola rota: si no, los eventos nuevos quedarían detrás de ella y se perderían al releer
+        if valido < os.path.getsize(self.ruta):
+            with open(self.ruta, 'r+b') as f:
+                f.truncate(valido)
+                f.flush()
+                os.fsync(f.fileno())
+        
+        logger.info(f"Modo memoria: {len(self)} registros recuperados (evento #{self.secuencia})")
+    
+    def _registrar(self, op, **datos):
+        """Escribe el evento en la bitácora, lo aplica y compacta si toca"""
+        evento = {'n': self.secuencia + 1, 'op': op, **datos}
+        self._bitacora.write(json.dumps(evento, ensure_ascii=False) + '\n')
+        self._bitacora.flush()
+        os.fsync(self._bitacora.fileno())
+        self._aplicar(evento)
+        
+        self._pendientes += 1
+        if self._pendientes >= self.cada:
+            self.instantanea()
+    
+    def agregar(self, grupo, guia, bono, monto, asistentes):
+        """Agrega un registro tal como se capturó"""
+        self._registrar('alta', fila=[grupo, guia, bono, monto, asistentes])
+    
+    def limpiar(self):
+        """Elimina todos los registros y devuelve cuántos había"""
+        cantidad = len(self)
+        self._registrar('limpiar')
+        # Tras limpiar, el estado es vacío: compactar deja la bitácora en cero
+        self.instantanea()
+        return cantidad
+    
+    def instantanea(self):
+        """Guarda el estado completo y vacía la bitácora"""
+        temporal = f'{self.ruta_instantanea}.tmp'
+        with open(temporal, 'w', encoding='utf-8') as f:
+            json.dump({
+                'n': self.secuencia,
+                'columnas': self.columnas,
+                'total_asistentes': self.total_asistentes,
+                'asistentes_invalidos': self.asistentes_invalidos,
+            }, f, ensure_ascii=False, separators=(',', ':'))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporal, self.ruta_instantanea)
+        
+        # Si el proceso cae antes de truncar, los eventos repetidos se saltan por número
+        self._bitacora.close()
+        self._bitacora = open(self.ruta, 'w', encoding='utf-8')
+        self._pendientes = 0
+        logger.info(f"Modo memoria: instantánea de {len(self)} registros (evento #{self.secuencia})")
+    
+    def filas(self):
+        """Itera los registros como filas (GRUPO, GUIA, BONO, MONTO, ASISTENTES)"""
+        return map(Fila._make, zip(*(self.columnas[campo] for campo in CAMPOS)))
+    
+    def estadisticas(self):
+        """Totales mantenidos al día; no recorre los registros"""
+        return {
+            'total_registros': len(self),
+            'total_asistentes': self.total_asistentes,
+            'asistentes_invalidos': self.asistentes_invalidos,
+        }
+    
+    def cerrar(self):
+        """Compacta y cierra la bitácora"""
+        if self._pendientes:
+            self.instantanea()
+        self._bitacora.close()
+    
+    def __len__(self):
+        return len(self.columnas['GRUPO'])
@@ -0,0 +1,121 @@
+import logging
+import threading
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Dimensiones por las que /analisis puede agrupar
+DIMENSIONES = ('guia', 'bono', 'grupo', 'dia', 'hora')
+
+class Analitica:
+    """Análisis de registros sobre arreglos columnares de NumPy
+
+    Los registros se cargan una sola vez en arreglos por columna y se reutilizan
+    mientras no cambie la versión de los datos (la última secuencia del historial
+    de cambios), así que cualquier escritura invalida la caché automáticamente.
+    """
+    
+    def __init__(self, db):
+        self.db = db
+        self._lock = threading.Lock()
+        self._version = None
+        self._columnas = None
+    
+    def columnas(self):
+        """Devuelve los arreglos por columna, recargándolos si hubo escrituras"""
+        version = self.db.ultimo_cambio()
+        
+        with self._lock:
+            if self._columnas is None or version != self._version:
+                self._columnas = self._cargar()
+                self._version = version
+            return self._columnas
+    
+    def _cargar(self):
+        """Convierte los registros activos en arreglos por columna"""
+        registros = self.db.obtener_todos_registros()
+        
+        if not registros:
+            return None
+        
+        grupos = [registro.grupo for registro in registros]
+        guias = [registro.guia for registro in registros]
+        bonos = [registro.bono for registro in registros]
+        montos = [registro.centavos for registro in registros]
+        asistentes = [registro.asistentes for registro in registros]
+        dias = [registro.dia for registro in registros]
+        horas = [f'{registro.fecha.hour:02d}' if registro.fecha else '00' for registro in registros]
+        
+        columnas = {
+            'monto': np.array(montos, dtype=np.float64) / 100,
+            'asistentes': np.array(asistentes, dtype=np.int64),
+        }
+        
+        # Cada dimensión se codifica una vez como (etiquetas, códigos) para agrupar con bincount
+        for nombre, valores in (('grupo', grupos), ('guia', guias), ('bono', bonos),
+                                ('dia', dias), ('hora', horas)):
+            etiquetas, codigos = np.unique(np.asarray(valores, dtype=str), return_inverse=True)
+            columnas[nombre] = (etiquetas, codigos)
+        
+        logger.info(f"Analítica: {len(registros)} registros cargados")
+        return columnas
+    
+    def resumen(self):
+        """Totales, promedios y percentiles de monto y asistentes"""
+        columnas = self.columnas()
+        if columnas is None:
+            return None
+        
+        monto = columnas['monto']
+        asistentes = columnas['asistentes']
+        p_monto = np.percentile(monto, [50, 90, 99])
+        p_asistentes = np.percentile(asistentes, [50, 90, 99])
+        
+        return {
+            'registros': int(monto.size),
+            'asistentes': int(asistentes.sum()),
+            'monto': float(monto.sum()),
+            'monto_promedio': float(monto.mean()),
+            'asistentes_promedio': float(asistentes.mean()),
+            'monto_percentiles': dict(zip(('p50', 'p90', 'p99'), p_monto.tolist())),
+            'asistentes_percentiles': dict(zip(('p50', 'p90', 'p99'), p_asistentes.tolist())),
+        }
+    
+    def agrupar(self, dimension, top=None, orden='monto'):
+        """Agrega registros, asistentes y monto por dimensión
+
+        Devuelve una lista de diccionarios ordenada de mayor a menor por ``orden``
+        (o por etiqueta si ``orden`` es None), limitada a ``top`` grupos.
+        """
+        if dimension not in DIMENSIONES:
+            raise ValueError(f'Dimensión no válida: {dimension}')
+        
+        columnas = self.columnas()
+        if columnas is None:
+            return []
+        
+        etiquetas, codigos = columnas[dimension]
+        n = etiquetas.size
+        cantidad = np.bincount(codigos, minlength=n)
+        asistentes = np.bincount(codigos, weights=columnas['asistentes'], minlength=n)
+        monto = np.bincount(codigos, weights=columnas['monto'], minlength=n)
+        
+        if orden is None:
+            indices = np.arange(n)
+        else:
+            clave = {'monto': monto, 'asistentes': asistentes, 'registros': cantidad}[orden]
+            indices = np.argsort(-clave, kind='stable')
+        if top is not None:
+            indices = indices[:top]
+        
+        return [
+            {
+                'etiqueta': str(etiquetas[i]),
+                'registros': int(cantidad[i]),
+                'asistentes': int(asistentes[i]),
+                'monto': float(monto[i]),
+                'monto_promedio': float(monto[i] / cantidad[i]),
+            }
+            for i in indices
+        ]
@@ -0,0 +1,122 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict, deque
+
+from telegram.error import TelegramError
+from telegram.ext import ApplicationHandlerStop
+
+logger = logging.getLogger(__name__)
+
+# Máximo de actualizaciones por usuario dentro de la ventana deslizante
+LIMITE_ACTUALIZACIONES = int(os.environ.get('LIMITE_ACTUALIZACIONES', '20'))
+VENTANA_SEGUNDOS = float(os.environ.get('VENTANA_SEGUNDOS', '10'))
+
+# Segundos en los que dos toques al mismo botón del mismo mensaje cuentan como uno
+VENTANA_DOBLE_TOQUE = float(os.environ.get('VENTANA_DOBLE_TOQUE', '2'))
+
+class ConjuntoAcotado:
+    """Conjunto con vigencia y tamaño máximo; descarta primero lo más antiguo"""
+    
+    def __init__(self, tamano, vigencia=None):
+        self.tamano = tamano
+        self.vigencia = vigencia
+        self._datos = OrderedDict()
+    
+    def agregar(self, clave, ahora):
+        """Agrega la clave y devuelve True si ya estaba (y sigue vigente)"""
+        visto = self._datos.get(clave)
+        if visto is not None and (self.vigencia is None or ahora - visto < self.vigencia):
+            return True
+        
+        self._datos[clave] = ahora
+        self._datos.move_to_end(clave)
+        while len(self._datos) > self.tamano:
+            self._datos.popitem(last=False)
+        return False
+
+class Antiabuso:
+    """Primer filtro de la cadena de handlers: limita la frecuencia por usuario y descarta duplicados
+
+    Se registra con un TypeHandler en el grupo -1; si una actualización se descarta
+    se lanza ApplicationHandlerStop y ningún otro handler (ni la base de datos) la ve.
+    """
+    
+    def __init__(self, limite=LIMITE_ACTUALIZACIONES, ventana=VENTANA_SEGUNDOS,
+                 ventana_doble_toque=VENTANA_DOBLE_TOQUE, max_usuarios=10000, max_vistos=50000):
+        self.limite = limite
+        self.ventana = ventana
+        self.max_usuarios = max_usuarios
+        self._lock = threading.Lock()
+        self._usuarios = OrderedDict()
+        self._avisados = set()
+        self._actualizaciones = ConjuntoAcotado(max_vistos)
+        self._toques = ConjuntoAcotado(max_vistos, ventana_doble_toque)
+        self.descartadas = 0
+    
+    def _es_duplicada(self, update, ahora):
+        """Reintentos de Telegram (mismo update_id / callback) y dobles toques al mismo botón"""
+        if self._actualizaciones.agregar(('update', update.update_id), ahora):
+            return True
+        
+        query = update.callback_query
+        if query is None:
+            return False
+        if self._actualizaciones.agregar(('callback', query.id), ahora):
+            return True
+        
+        mensaje_id = query.message.message_id if query.message else query.inline_message_id
+        return self._toques.agregar((query.from_user.id, mensaje_id, query.data), ahora)
+    
+    def _excede_limite(self, usuario_id, ahora):
+        """Ventana deslizante por usuario; devuelve True si se superó el límite"""
+        marcas = self._usuarios.get(usuario_id)
+        if marcas is None:
+            marcas = self._usuarios[usuario_id] = deque()
+            while len(self._usuarios) > self.max_usuarios:
+                viejo, _ = self._usuarios.popitem(last=False)
+                self._avisados.discard(viejo)
+        self._usuarios.move_to_end(usuario_id)
+        
+        while marcas and ahora - marcas[0] > self.ventana:
+            marcas.popleft()
+        if len(marcas) >= self.limite:
+            return True
+        
+        marcas.append(ahora)
+        self._avisados.discard(usuario_id)
+        return False
+    
+    async def filtrar(self, update, context):
+        """Handler del grupo -1: deja pasar la actualización o detiene su procesamiento"""
+        ahora = time.monotonic()
+        usuario = update.effective_user
+        
+        with self._lock:
+            duplicada = self._es_duplicada(update, ahora)
+            # Las consultas inline llegan con cada tecla y solo leen memoria: no cuentan para el límite
+            limitada = (
+                not duplicada and usuario is not None and update.inline_query is None
+                and self._excede_limite(usuario.id, ahora)
+            )
+            avisar = limitada and usuario.id not in self._avisados
+            if avisar:
+                self._avisados.add(usuario.id)
+        
+        if not duplicada and not limitada:
+            return
+        
+        self.descartadas += 1
+        if update.callback_query:
+            # Responder siempre para que el botón deje de mostrar el reloj de carga
+            try:
+                await update.callback_query.answer('⏳ Espera un momento' if limitada else None)
+            except TelegramError:
+                pass
+        elif avisar and update.effective_message:
+            await update.effective_message.reply_text('⏳ Demasiadas solicitudes. Espera unos segundos.')
+        
+        if limitada:
+            logger.warning(f"Usuario {usuario.id} limitado por exceso de solicitudes")
+        raise ApplicationHandlerStop
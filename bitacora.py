@@ -0,0 +1,158 @@
+import os
+import sys
+import json
+import queue
+import atexit
+import logging
+import threading
+import contextvars
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+# Nivel mínimo y formato de salida ('json' para producción, 'texto' para leer en consola)
+NIVEL_LOG = os.environ.get('NIVEL_LOG', 'INFO').upper()
+FORMATO_LOG = os.environ.get('FORMATO_LOG', 'json').lower()
+
+# De cada lugar del código que escribe en DEBUG se conserva 1 de cada tantos registros
+MUESTREO_DEBUG = max(1, int(os.environ.get('MUESTREO_DEBUG', '100')))
+
+# Campos de contexto de la actualización en curso que se agregan a cada registro
+CAMPOS_CONTEXTO = ('update_id', 'usuario', 'chat', 'handler')
+
+# Atributos propios de LogRecord; lo demás que llegue en ``extra`` se escribe como campo
+_ATRIBUTOS_REGISTRO = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+
+_contexto = contextvars.ContextVar('contexto_log', default=None)
+_oyente = None
+_oyente_lock = threading.Lock()
+
+def iniciar_contexto(update):
+    """Fija el contexto de log de la actualización para la tarea actual; devuelve el token para cerrarlo"""
+    usuario = getattr(update, 'effective_user', None)
+    chat = getattr(update, 'effective_chat', None)
+    return _contexto.set({
+        'update_id': getattr(update, 'update_id', None),
+        'usuario': usuario.id if usuario else None,
+        'chat': chat.id if chat else None,
+    })
+
+def cerrar_contexto(token):
+    """Restaura el contexto anterior a iniciar_contexto"""
+    _contexto.reset(token)
+
+def anotar(**campos):
+    """Agrega campos (p. ej. el handler) al contexto de la actualización en curso"""
+    contexto = _contexto.get()
+    if contexto is not None:
+        contexto.update(campos)
+
+def contexto_actual():
+    """Copia del contexto de la actualización en curso (vacío fuera de una actualización)"""
+    return dict(_contexto.get() or {})
+
+class FiltroContexto(logging.Filter):
+    """Copia en el registro el contexto de la actualización que lo emitió
+
+    Corre en el hilo que escribe el log, antes de encolar: después el
+    registro ya no sabe de qué tarea venía.
+    """
+    
+    def filter(self, registro):
+        for campo, valor in (_contexto.get() or {}).items():
+            if not hasattr(registro, campo):
+                setattr(registro, campo, valor)
+        return True
+
+class FiltroMuestreo(logging.Filter):
+    """Deja pasar 1 de cada ``cada`` registros DEBUG por lugar del código (archivo y línea)
+
+    Los registros de nivel INFO o mayor pasan siempre. Los conservados llevan
+    el campo ``muestreo`` para poder escalar conteos al analizarlos.
+    """
+    
+    def __init__(self, cada=MUESTREO_DEBUG):
+        super().__init__()
+        self.cada = cada
+        self._vistos = {}
+        self._lock = threading.Lock()
+    
+    def filter(self, registro):
+        if registro.levelno > logging.DEBUG or self.cada == 1:
+            return True
+        
+        clave = (registro.pathname, registro.lineno)
+        with self._lock:
+            visto = self._vistos.get(clave, 0)
+            self._vistos[clave] = visto + 1
+        if visto % self.cada:
+            return False
+        registro.muestreo = self.cada
+        return True
+
+class FormatoJSON(logging.Formatter):
+    """Un objeto JSON por línea: fecha, nivel, logger, mensaje, contexto y campos de ``extra``"""
+    
+    def format(self, registro):
+        datos = {
+            'fecha': datetime.fromtimestamp(registro.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'nivel': registro.levelname,
+            'logger': registro.name,
+            'mensaje': registro.getMessage(),
+        }
+        for campo, valor in vars(registro).items():
+            if campo not in _ATRIBUTOS_REGISTRO and valor is not None:
+                datos[campo] = valor
+        if registro.exc_info:
+            datos['error'] = self.formatException(registro.exc_info)
+        elif registro.exc_text:
+            datos['error'] = registro.exc_text
+        return json.dumps(datos, ensure_ascii=False, default=str)
+
+class ColaLogs(QueueHandler):
+    """QueueHandler que deja el registro listo para otro hilo sin perder sus campos
+
+    El de la biblioteca formatea el mensaje con la traza incluida; aquí el
+    mensaje y la traza se guardan por separado para que el JSON los distinga.
+    """
+    
+    def prepare(self, registro):
+        registro = logging.makeLogRecord(vars(registro))
+        registro.msg = registro.getMessage()
+        registro.args = None
+        if registro.exc_info:
+            registro.exc_text = logging.Formatter().formatException(registro.exc_info)
+            registro.exc_info = None
+        return registro
+
+def configurar_logging(nivel=NIVEL_LOG, formato=FORMATO_LOG, muestreo=MUESTREO_DEBUG):
+    """Envía todo el logging a una cola que un hilo aparte escribe en stderr
+
+    Los handlers (y el event loop) solo encolan; el formateo JSON y la
+    escritura ocurren en el hilo del QueueListener. Llamarla otra vez no hace nada.
+    """
+    global _oyente
+    with _oyente_lock:
+        if _oyente is not None:
+            return _oyente
+        
+        salida = logging.StreamHandler(sys.stderr)
+        if formato == 'json':
+            salida.setFormatter(FormatoJSON())
+        else:
+            salida.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+        
+        cola = ColaLogs(queue.SimpleQueue())
+        cola.addFilter(FiltroMuestreo(muestreo))
+        cola.addFilter(FiltroContexto())
+        
+        raiz = logging.getLogger()
+        for handler in list(raiz.handlers):
+            raiz.removeHandler(handler)
+        raiz.addHandler(cola)
+        raiz.setLevel(nivel)
+        
+        _oyente = QueueListener(cola.queue, salida, respect_handler_level=True)
+        _oyente.start()
+        # Al salir se vacía la cola antes de terminar
+        atexit.register(_oyente.stop)
+        return _oyente
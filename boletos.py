@@ -0,0 +1,235 @@
+import io
+import os
+import re
+import hmac
+import time
+import atexit
+import base64
+import asyncio
+import hashlib
+import logging
+import secrets
+import threading
+from datetime import datetime
+
+from procesos import obtener_pool
+
+logger = logging.getLogger(__name__)
+
+# Clave de las firmas; sin ella se usa el token del bot (cambiarlo invalida los boletos emitidos)
+SECRETO_BOLETOS = os.environ.get('SECRETO_BOLETOS') or os.environ.get('BOT_TOKEN', '')
+
+# Los ingresos se escriben en lote cada tantos segundos, o antes si se juntan tantos
+SEGUNDOS_VOLCADO = float(os.environ.get('SEGUNDOS_VOLCADO', '2'))
+LOTE_VOLCADO = int(os.environ.get('LOTE_VOLCADO', '200'))
+
+# Cada cuánto se relee el estado de los boletos (emitidos en otro proceso, registros eliminados)
+SEGUNDOS_RECARGA = int(os.environ.get('SEGUNDOS_RECARGA_BOLETOS', '60'))
+
+# Caracteres base64url de la firma: 16 son 96 bits del HMAC-SHA256
+LARGO_FIRMA = 16
+
+# Código de un boleto: <registro_id>.<nonce>.<firma>, en cualquier parte del texto escaneado
+PATRON_CODIGO = re.compile(rf'\b(\d+)\.([\w-]{{8}})\.([\w-]{{{LARGO_FIRMA}}})(?![\w-])')
+
+# Resultados de validar un código en la puerta
+VALIDO, USADO, OTRO_EVENTO, NO_VIGENTE, INVALIDO = 'valido', 'usado', 'otro_evento', 'no_vigente', 'invalido'
+
+def dibujar_qr(codigo):
+    """PNG con el código QR del boleto
+
+    Se ejecuta en un proceso aparte, así que solo recibe y devuelve datos simples.
+    """
+    import qrcode
+    
+    imagen = qrcode.make(codigo, box_size=8, border=2)
+    buffer = io.BytesIO()
+    imagen.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+def leer_qr(imagen):
+    """Texto del código QR de una foto (bytes JPEG/PNG), o None si no se encuentra
+
+    Se ejecuta en un proceso aparte, así que solo recibe y devuelve datos simples.
+    """
+    import cv2
+    import numpy as np
+    
+    matriz = cv2.imdecode(np.frombuffer(imagen, np.uint8), cv2.IMREAD_GRAYSCALE)
+    if matriz is None:
+        return None
+    texto, _, _ = cv2.QRCodeDetector().detectAndDecode(matriz)
+    return texto or None
+
+async def generar_qr(codigo):
+    """Dibuja el QR en el pool de procesos sin bloquear el event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(obtener_pool(), dibujar_qr, codigo)
+
+async def decodificar_qr(imagen):
+    """Lee el QR de una foto en el pool de procesos sin bloquear el event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(obtener_pool(), leer_qr, imagen)
+
+class Boletos:
+    """Boletos firmados de cada registro y control de ingreso en la puerta
+
+    El código de un boleto lleva el id del registro, un nonce y un HMAC de
+    ambos. Los boletos vigentes y los ingresos ya hechos viven en memoria:
+    validar un escaneo es comprobar la firma y buscar en un diccionario, sin
+    consultas a la base de datos. Los ingresos se acumulan y un hilo los escribe
+    en lote; lo que quede pendiente se escribe al terminar el proceso.
+    """
+    
+    def __init__(self, db, secreto=SECRETO_BOLETOS, intervalo=SEGUNDOS_VOLCADO, lote=LOTE_VOLCADO,
+                 recarga=SEGUNDOS_RECARGA):
+        if not secreto:
+            # Con la clave vacía cualquiera puede calcular la firma y falsificar boletos
+            raise RuntimeError('Define SECRETO_BOLETOS o BOT_TOKEN para firmar los boletos')
+        self.db = db
+        self.intervalo = intervalo
+        self.lote = lote
+        self.recarga = recarga
+        self._clave = hashlib.sha256(b'boletos:' + secreto.encode()).digest()
+        self._lock = threading.Lock()
+        self._despertar = threading.Event()
+        self._boletos = {}
+        self._ingresos = {}
+        self._nuevos = {}
+        self._pendientes = []
+        self._recargado = 0
+        self.recargar()
+    
+    def _firmar(self, registro_id, nonce):
+        """Firma (base64url recortada) del par registro, nonce"""
+        digest = hmac.new(self._clave, f'{registro_id}.{nonce}'.encode(), hashlib.sha256).digest()
+        return base64.urlsafe_b64encode(digest).decode()[:LARGO_FIRMA]
+    
+    def codigo(self, registro_id, nonce):
+        """Texto que va en el QR del boleto"""
+        return f'{registro_id}.{nonce}.{self._firmar(registro_id, nonce)}'
+    
+    def recargar(self):
+        """Vuelve a leer de la base los boletos vigentes y sus ingresos
+
+        Se conservan los ingresos hechos en memoria y los boletos emitidos
+        mientras se leía, aunque la base todavía no los tenga.
+        """
+        with self._lock:
+            self._nuevos = {}
+        
+        boletos = {}
+        ingresos = {}
+        for registro_id, evento_id, nonce, grupo, asistentes, ingreso in self.db.obtener_boletos():
+            boletos[registro_id] = (nonce, evento_id, grupo, asistentes)
+            if ingreso:
+                ingresos[registro_id] = ingreso
+        
+        with self._lock:
+            boletos.update(self._nuevos)
+            for registro_id, ingreso in self._ingresos.items():
+                if registro_id in boletos:
+                    ingresos.setdefault(registro_id, ingreso)
+            self._boletos = boletos
+            self._ingresos = ingresos
+            self._recargado = time.monotonic()
+        
+        logger.info(f"Boletos: {len(boletos)} vigentes, {len(ingresos)} con ingreso")
+    
+    def emitir(self, db_evento, registro_id, grupo, asistentes):
+        """Devuelve el código del boleto de un registro, creándolo la primera vez"""
+        with self._lock:
+            actual = self._boletos.get(registro_id)
+        if actual is not None:
+            return self.codigo(registro_id, actual[0])
+        
+        # Si otro proceso ya lo emitió, la base devuelve su nonce y el código es el mismo
+        nonce = db_evento.emitir_boleto(registro_id, secrets.token_urlsafe(6))
+        entrada = (nonce, db_evento.evento_id, grupo, asistentes)
+        with self._lock:
+            self._boletos[registro_id] = entrada
+            self._nuevos[registro_id] = entrada
+        return self.codigo(registro_id, nonce)
+    
+    def validar(self, texto, evento_id, usuario):
+        """Registra el ingreso del boleto escaneado y devuelve (estado, datos)
+
+        ``datos`` es None si el código no es válido; si no, un diccionario con
+        registro_id, grupo, asistentes e ingreso (la fecha del primer ingreso).
+        """
+        encontrado = PATRON_CODIGO.search(texto or '')
+        if encontrado is None:
+            return INVALIDO, None
+        registro_id, nonce, firma = int(encontrado[1]), encontrado[2], encontrado[3]
+        if not hmac.compare_digest(firma, self._firmar(registro_id, nonce)):
+            return INVALIDO, None
+        
+        # Firmado pero desconocido: puede venir de otro proceso; se relee como mucho cada pocos segundos
+        if registro_id not in self._boletos and time.monotonic() - self._recargado > 5:
+            self.recargar()
+        
+        with self._lock:
+            boleto = self._boletos.get(registro_id)
+            if boleto is None or boleto[0] != nonce:
+                return NO_VIGENTE, None
+            
+            _, evento_boleto, grupo, asistentes = boleto
+            datos = {'registro_id': registro_id, 'grupo': grupo, 'asistentes': asistentes}
+            if evento_boleto != evento_id:
+                return OTRO_EVENTO, datos
+            
+            previo = self._ingresos.get(registro_id)
+            if previo is not None:
+                return USADO, dict(datos, ingreso=previo)
+            
+            ahora = datetime.utcnow().replace(microsecond=0)
+            self._ingresos[registro_id] = ahora
+            self._pendientes.append((registro_id, ahora, usuario))
+            lleno = len(self._pendientes) >= self.lote
+        
+        if lleno:
+            self._despertar.set()
+        return VALIDO, dict(datos, ingreso=ahora)
+    
+    def ingresados(self, evento_id):
+        """(boletos con ingreso, boletos vigentes) del evento"""
+        with self._lock:
+            del_evento = [registro_id for registro_id, boleto in self._boletos.items() if boleto[1] == evento_id]
+            return sum(1 for registro_id in del_evento if registro_id in self._ingresos), len(del_evento)
+    
+    def volcar(self):
+        """Escribe en la base los ingresos pendientes en una sola operación y devuelve cuántos"""
+        with self._lock:
+            pendientes, self._pendientes = self._pendientes, []
+        if not pendientes:
+            return 0
+        
+        try:
+            repetidos = self.db.registrar_ingresos(pendientes)
+        except Exception:
+            # Se reintentan en el siguiente volcado, antes que los nuevos
+            with self._lock:
+                self._pendientes[:0] = pendientes
+            raise
+        
+        if repetidos:
+            logger.warning(f"Boletos con ingreso previo en otro proceso: {', '.join(map(str, repetidos))}")
+        return len(pendientes)
+    
+    def iniciar(self):
+        """Lanza el hilo que escribe los ingresos y relee los boletos periódicamente"""
+        def volcador():
+            while True:
+                self._despertar.wait(self.intervalo)
+                self._despertar.clear()
+                try:
+                    self.volcar()
+                    if time.monotonic() - self._recargado >= self.recarga:
+                        self.recargar()
+                except Exception as e:
+                    logger.error(f"Error escribiendo ingresos: {e}")
+        
+        atexit.register(self.volcar)
+        hilo = threading.Thread(target=volcador, daemon=True)
+        hilo.start()
+        return hilo
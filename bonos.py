@@ -0,0 +1,86 @@
+import re
+import unicodedata
+
+# Sugerencias que se ofrecen como botones cuando lo escrito no está en el catálogo
+MAXIMO_SUGERENCIAS = 3
+
+def clave_bono(texto):
+    """Clave de comparación de un bono: sin mayúsculas, acentos, signos ni espacios de más
+
+    "VIP", "vip " y "V.I.P." dan la misma clave, así que son el mismo bono.
+    """
+    descompuesto = unicodedata.normalize('NFKD', str(texto))
+    sin_acentos = ''.join(c for c in descompuesto if not unicodedata.combining(c))
+    clave = re.sub(r'\s+', ' ', re.sub(r'[^\w\s]', '', sin_acentos.casefold())).strip()
+    # Un bono escrito solo con signos conserva su texto en lugar de quedar vacío
+    return clave or re.sub(r'\s+', ' ', str(texto)).strip().casefold()
+
+def distancia_edicion(a, b, maximo):
+    """Distancia de Levenshtein entre a y b, o maximo + 1 si ya se sabe que la supera
+
+    Solo guarda dos filas y corta en cuanto toda una fila pasa del máximo, así que
+    comparar contra un alias lejano cuesta unas pocas operaciones.
+    """
+    if abs(len(a) - len(b)) > maximo:
+        return maximo + 1
+    if len(a) < len(b):
+        a, b = b, a
+    
+    anterior = list(range(len(b) + 1))
+    for i, letra_a in enumerate(a, 1):
+        actual = [i]
+        for j, letra_b in enumerate(b, 1):
+            actual.append(min(
+                anterior[j] + 1,
+                actual[j - 1] + 1,
+                anterior[j - 1] + (letra_a != letra_b)
+            ))
+        if min(actual) > maximo:
+            return maximo + 1
+        anterior = actual
+    return anterior[-1]
+
+class IndiceBonos:
+    """Índice en memoria del catálogo de bonos para resolver lo que escribe el usuario
+
+    Las claves normalizadas de todos los alias van en un diccionario (búsqueda
+    exacta en O(1)) y, aparte, agrupadas por longitud: la búsqueda aproximada
+    solo compara contra alias cuya longitud puede estar dentro de la tolerancia.
+    """
+    
+    def __init__(self, alias):
+        self._por_clave = {}
+        self._por_longitud = {}
+        for clave, bono_id, nombre in alias:
+            self._por_clave[clave] = (bono_id, nombre)
+            self._por_longitud.setdefault(len(clave), []).append(clave)
+        self.bonos = len({bono_id for bono_id, _ in self._por_clave.values()})
+    
+    def buscar(self, texto):
+        """(id, nombre) del bono cuyo alias coincide exactamente, o None"""
+        return self._por_clave.get(clave_bono(texto))
+    
+    def sugerir(self, texto, limite=MAXIMO_SUGERENCIAS):
+        """Bonos con un alias parecido a lo escrito, del más al menos parecido
+
+        Tolera una edición por cada tres letras (al menos una). Devuelve
+        una lista de (id, nombre) sin bonos repetidos.
+        """
+        clave = clave_bono(texto)
+        maximo = max(1, len(clave) // 3)
+        
+        mejores = {}
+        for longitud in range(len(clave) - maximo, len(clave) + maximo + 1):
+            for alias in self._por_longitud.get(longitud, ()):
+                distancia = distancia_edicion(clave, alias, maximo)
+                if distancia > maximo:
+                    continue
+                bono_id, nombre = self._por_clave[alias]
+                if bono_id not in mejores or distancia < mejores[bono_id][0]:
+                    mejores[bono_id] = (distancia, nombre)
+        
+        ordenados = sorted(mejores.items(), key=lambda item: (item[1][0], item[1][1]))
+        return [(bono_id, nombre) for bono_id, (_, nombre) in ordenados[:limite]]
+    
+    def __len__(self):
+        return self.bonos
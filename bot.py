@@ -1,33 +1,336 @@
 import os
-import csv
 import logging
 import asyncio
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InlineQueryResultArticle, InputTextMessageContent
+from telegram.constants import ParseMode
+from telegram.error import Forbidden, TelegramError
 from telegram.ext import (
     Application, CommandHandler, MessageHandler, ConversationHandler, 
-    ContextTypes, CallbackQueryHandler, filters
+    ContextTypes, CallbackQueryHandler, TypeHandler, InlineQueryHandler, filters
 )
 from flask import Flask
 
 from config import *
-from database import Database
+from database import abrir_base_datos, CupoAgotado, DATABASE_URL, MINUTOS_DESHACER, clave_idempotencia
+from exportar import exportar_delta_csv, exportar_columnar
+from reportes import ESCRITORES, generar_reporte as construir_reporte
+from analisis import Analitica, DIMENSIONES
+from graficas import generar_grafica
+from cache_archivos import CacheArchivos
+from permisos import Permisos, NIVELES
+from antiabuso import Antiabuso
+from replica import Replica
+from respaldos import Respaldos, TAMANO_MAXIMO_ENVIO
+from modelo import formatear_monto, formatear_cupo
+from concurrencia import ProcesadorOrdenado, por_chat
+from mensajes import Plantilla, responder, dividir
+from directorio import Directorio
+from resumenes import Resumenes, FRECUENCIAS, HORA_RESUMEN_DIARIO, segundos_para_la_hora
+from bitacora import configurar_logging
+from boletos import Boletos, generar_qr, decodificar_qr, VALIDO, USADO, OTRO_EVENTO, NO_VIGENTE, INVALIDO
 
-# Configuración de logging
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+# Logging en JSON a través de una cola: los handlers nunca esperan a que se escriba
+configurar_logging()
 logger = logging.getLogger(__name__)
 
+# ================= PLANTILLAS =================
+BIENVENIDA = Plantilla(
+    '🤖 **Bienvenido al Sistema del Congreso 2026**\n\n'
+    '📋 **Comandos disponibles:**\n'
+    '• /nuevo - Agregar nuevo registro\n'
+    '• /reporte - Descargar reporte CSV\n'
+    '• /estadisticas - Ver estadísticas\n'
+    '• /corregir - Corregir tipos de bono\n'
+    '• /eliminar - Eliminar registros\n'
+    '• /buscar - Buscar por grupo\n'
+    '• /ayuda - Mostrar ayuda completa'
+)
+AYUDA = Plantilla(
+    "🤖 **SISTEMA DE GESTIÓN - CONGRESO 2026**\n\n"
+    "🚀 **COMANDOS PRINCIPALES:**\n"
+    "• /start - Mensaje de bienvenida\n"
+    "• /nuevo - Agregar nuevo registro\n"
+    "• /reporte - Descargar reporte completo (CSV)\n"
+    "• /reporte xlsx | pdf | zip - Excel por bono, resumen PDF o ZIP por bono\n"
+    "• /reporte delta - Solo los cambios desde el último delta\n"
+    "• /reporte parquet | arrow - Instantánea columnar\n"
+    "• /estadisticas - Ver estadísticas generales\n"
+    "• /analisis - Análisis por guía, bono, día y hora\n"
+    "• /grafica - Gráfica de registros y monto por bono\n\n"
+    
+    "🔧 **GESTIÓN DE DATOS:**\n"
+    "• /corregir - Corregir nombres de bonos\n"
+    "• /eliminar - Eliminar registros específicos\n"
+    "• /buscar - Buscar registros por grupo\n"
+    "• /limpiar - Limpiar toda la base de datos\n"
+    "• /deshacer - Deshacer tu última eliminación\n"
+    "• /duplicados - Buscar registros duplicados\n"
+    "• /otorgar - Asignar roles (solo administradores)\n"
+    "• /cupo - Ver o fijar los lugares de cada bono\n"
+    "• /checkin - Modo puerta: validar boletos QR\n"
+    "• /suscribir [hora|dia] - Recibir resúmenes programados en este chat\n"
+    "• /desuscribir [hora|dia] - Dejar de recibirlos\n"
+    "• /evento - Ver o cambiar el evento del chat\n"
+    "• /archivar - Archivar un evento terminado\n"
+    "• /respaldo - Respaldo completo de la base de datos\n"
+    "• @bot texto - Autocompletar grupo o guía durante /nuevo\n\n"
+    
+    "💡 **Características:**\n"
+    "✅ Captura de datos completa\n"
+    "✅ Base de datos SQLite\n"
+    "✅ Sistema de corrección de bonos\n"
+    "✅ Eliminación de registros\n"
+    "✅ Reportes en CSV\n"
+    "✅ Estadísticas en tiempo real\n\n"
+    
+    "📝 **Para comenzar usa:** /nuevo"
+)
+NUEVO_REGISTRO = Plantilla(
+    '📝 **NUEVO REGISTRO**\n\n'
+    'Por favor, ingresa el **NOMBRE DEL GRUPO**:'
+)
+CAMPO_GUARDADO = Plantilla('✅ **{campo}** guardado. {indicacion} **{siguiente}**:')
+BONO_SUGERENCIAS = Plantilla(
+    '🤔 El bono **{bono}** no está en el catálogo.\n\n'
+    '¿Quisiste decir alguno de estos?'
+)
+REGISTRO_COMPLETADO = Plantilla(
+    '🎉 **REGISTRO #{registro_id} COMPLETADO!**\n\n'
+    '📋 **Resumen:**\n'
+    '• 🏷️ **Grupo:** {grupo}\n'
+    '• 👤 **Guía:** {guia}\n'
+    '• 🎫 **Bono:** {bono}\n'
+    '• 💰 **Monto:** ${monto:,.2f}\n'
+    '• 👥 **Asistentes:** {asistentes}\n\n'
+    '💾 **Guardado en base de datos**\n\n'
+    'Usa /nuevo para otro registro o /reporte para descargar datos.'
+)
+MENU_ELIMINACION = Plantilla(
+    '🗑️ **SISTEMA DE ELIMINACIÓN**\n\n'
+    'Selecciona el método de eliminación:'
+)
+ELIMINAR_POR_BONO = Plantilla(
+    '🗑️ **ELIMINAR POR TIPO DE BONO**\n\n'
+    'Selecciona el tipo de bono a eliminar:\n\n'
+    '⚠️ **ADVERTENCIA:** Esto eliminará TODOS los registros del bono seleccionado.'
+)
+ELIMINAR_POR_ID = Plantilla(
+    '🔍 **ELIMINAR POR ID**\n\n'
+    'Por favor, ingresa el **ID del registro** que quieres eliminar:\n\n'
+    '💡 **Consejo:** Usa /reporte para ver todos los IDs disponibles.'
+)
+ULTIMOS_REGISTROS = Plantilla('📋 **ÚLTIMOS 10 REGISTROS**\n\n')
+REGISTRO_FILA = Plantilla(
+    '🆔 **#{registro.id}** - {registro.grupo}\n'
+    '   👤 {registro.guia} | 🎫 {registro.bono}\n'
+    '   👥 {registro.asistentes} | 💰 {registro.monto_texto}\n'
+    '   📅 {registro.dia}\n\n'
+)
+CONFIRMAR_ELIMINAR_BONO = Plantilla(
+    '⚠️ **CONFIRMAR ELIMINACIÓN**\n\n'
+    '🎫 **Bono a eliminar:** {bono}\n'
+    '📊 **Registros afectados:** {cantidad}\n'
+    '👥 **Total asistentes:** {asistentes}\n'
+    '💰 **Total monto:** {monto}\n\n'
+    '¿Estás seguro de que quieres eliminar TODOS estos registros?\n\n'
+    '↩️ **Podrás deshacerlo con /deshacer durante {minutos} minutos.**'
+)
+BONO_ELIMINADO = Plantilla(
+    '✅ **ELIMINACIÓN COMPLETADA**\n\n'
+    '• 🎫 **Bono eliminado:** {bono}\n'
+    '• 📊 **Registros eliminados:** {cantidad}\n\n'
+    '↩️ Usa /deshacer en los próximos {minutos} minutos para restaurarlos.'
+)
+REGISTRO_ENCONTRADO = Plantilla(
+    '🔍 **REGISTRO ENCONTRADO**\n\n'
+    '• 🆔 **ID:** {registro.id}\n'
+    '• 🏷️ **Grupo:** {registro.grupo}\n'
+    '• 👤 **Guía:** {registro.guia}\n'
+    '• 🎫 **Bono:** {registro.bono}\n'
+    '• 💰 **Monto:** {registro.monto_texto}\n'
+    '• 👥 **Asistentes:** {registro.asistentes}\n'
+    '• 📅 **Fecha:** {registro.dia}\n\n'
+    '¿Estás seguro de que quieres eliminar este registro?\n\n'
+    '↩️ **Podrás deshacerlo con /deshacer durante {minutos} minutos.**'
+)
+REGISTRO_ELIMINADO = Plantilla(
+    '✅ **REGISTRO ELIMINADO**\n\n'
+    '• 🆔 **ID:** {registro.id}\n'
+    '• 🏷️ **Grupo:** {registro.grupo}\n'
+    '• 🎫 **Bono:** {registro.bono}\n'
+    '• 💰 **Monto:** {registro.monto_texto}\n\n'
+    '↩️ Usa /deshacer en los próximos {minutos} minutos para restaurarlo.'
+)
+ELIMINACION_DESHECHA = Plantilla('↩️ **ELIMINACIÓN DESHECHA**\n\n• 📊 **Registros restaurados:** {cantidad}')
+DUPLICADOS_CABECERA = Plantilla('🔁 **POSIBLES DUPLICADOS: {cantidad} grupos**\n\n')
+DUPLICADOS_GRUPO = Plantilla('🏷️ {primero.grupo} | 👤 {primero.guia} | 🎫 {primero.bono}\n   🆔 {ids}\n\n')
+DUPLICADOS_PIE = Plantilla('💡 Usa /eliminar para borrar los que sobren.')
+OTORGAR_USO = Plantilla(
+    '🔐 **OTORGAR ROL**\n\n'
+    'Uso: /otorgar <id_usuario> <{roles}>\n\n'
+    'Ejemplo: /otorgar 123456789 guia'
+)
+CUPO_USO = Plantilla(
+    '🪑 **CUPOS POR BONO**\n\n'
+    'Uso: /cupo <bono> <capacidad|libre>\n\n'
+    'Ejemplo: /cupo VIP 50'
+)
+CUPOS_CABECERA = Plantilla('🪑 **CUPOS DEL EVENTO**\n\n')
+CUPO_FIJADO = Plantilla('🪑 Cupo de **{bono}**: {estado}.')
+CUPO_QUITADO = Plantilla('🪑 **{bono}** ya no tiene límite de lugares.')
+BONO_AGOTADO = Plantilla('❌ El bono **{bono}** está {estado}. Ingresa otro **BONO**:')
+SIN_CUPO = Plantilla('❌ No hay cupo suficiente en **{bono}**: pides {solicitados} y quedan {disponibles}.')
+SIN_CUPO_REINTENTAR = Plantilla('\n\nIngresa menos **ASISTENTES** o usa /cancel.')
+SIN_CUPO_OTRO_BONO = Plantilla('\n\nUsa /nuevo para elegir otro bono.')
+BOLETO = Plantilla('🎟️ **Boleto del registro #{registro_id}**\n\nMuéstralo en la entrada.\n`{codigo}`')
+BOLETOS_NO_DISPONIBLES = Plantilla('🎟️ Los boletos no están disponibles: falta configurar SECRETO_BOLETOS o BOT_TOKEN.')
+CHECKIN_ACTIVO = Plantilla(
+    '🚪 **MODO PUERTA ACTIVO**\n\n'
+    '📊 **Ingresos:** {ingresados} de {vigentes} boletos\n\n'
+    'Envía la foto del QR o el código de cada boleto.\n'
+    'Usa /checkin otra vez para salir.'
+)
+CHECKIN_TERMINADO = Plantilla('🚪 Modo puerta terminado. **Ingresos:** {ingresados} de {vigentes} boletos.')
+INGRESOS = {
+    VALIDO: Plantilla('✅ **#{d[registro_id]} {d[grupo]}** · 👥 {d[asistentes]}'),
+    USADO: Plantilla('⚠️ **#{d[registro_id]} {d[grupo]}** ya ingresó a las {d[ingreso]:%H:%M} (UTC).'),
+    OTRO_EVENTO: Plantilla('❌ El boleto **#{d[registro_id]}** es de otro evento.'),
+    NO_VIGENTE: Plantilla('❌ Boleto no vigente: el registro se eliminó.'),
+    INVALIDO: Plantilla('❌ Código de boleto no válido.'),
+}
+SIN_QR = Plantilla('❌ No se encontró un código QR en la foto.')
+RESUMENES_USO = Plantilla(
+    '📬 **RESÚMENES PROGRAMADOS**\n\n'
+    'Uso: /suscribir [hora|dia] · /desuscribir [hora|dia]\n\n'
+    '**Este chat recibe:** {actuales}'
+)
+SUSCRITO = Plantilla('📬 Este chat recibirá el resumen {frecuencias}.')
+DESUSCRITO = Plantilla('📭 Este chat ya no recibirá el resumen {frecuencias}.')
+RESUMEN_CABECERA = Plantilla('📬 **RESUMEN {periodo}: {evento}**\n\n')
+RESUMEN_CAMBIOS = Plantilla('🆕 **Desde el resumen anterior:** {registros:+d} registros, {asistentes:+d} asistentes\n\n')
+RESUMEN_TOTALES = Plantilla(
+    '📈 **Total registros:** {stats[total_registros]}\n'
+    '👥 **Total asistentes:** {stats[total_asistentes]}\n\n'
+)
+RESUMEN_INGRESOS = Plantilla('\n🚪 **Ingresos:** {ingresados} de {vigentes} boletos\n')
+EVENTOS_CABECERA = Plantilla('🗓️ **EVENTOS**\n\n')
+EVENTO_FILA = Plantilla('{marca} {nombre}\n')
+EVENTOS_PIE = Plantilla('\nUso: /evento <nombre>')
+EVENTO_ARCHIVADO = Plantilla(
+    '🗄️ **EVENTO ARCHIVADO**\n\n'
+    '🗓️ Evento: {evento}\n'
+    '📦 Registros movidos: {cantidad}\n'
+    '💾 Archivo: {archivo}'
+)
+CAPTION_REPORTE = Plantilla('📊 **Reporte completo del Congreso 2026**\n\nTotal de registros: {filas}')
+CAPTION_DELTA = Plantilla('📊 **Cambios desde el último delta**\n\nRegistros: {filas}')
+CAPTION_COLUMNAR = Plantilla('📊 **Instantánea {modo} del Congreso 2026**\n\nTotal de registros: {filas}')
+ESTADISTICAS_CABECERA = Plantilla(
+    '📊 **ESTADÍSTICAS DEL CONGRESO**\n\n'
+    '📈 **Total registros:** {stats[total_registros]}\n'
+    '👥 **Total asistentes:** {stats[total_asistentes]}\n\n'
+)
+ESTADISTICAS_POR_BONO = Plantilla('🎫 **Por tipo de bono:**\n')
+ESTADISTICAS_BONO = Plantilla('• **{bono}:** {cantidad} reg, {asistentes} asis, ${monto:,.2f}\n')
+ESTADISTICAS_CUPOS = Plantilla('\n🪑 **Cupos:**\n')
+CUPO_FILA = Plantilla('• **{bono}:** {estado}\n')
+LEYENDA = Plantilla('\n{leyenda}')
+ANALISIS_RESUMEN = Plantilla(
+    '🔬 **ANÁLISIS DEL CONGRESO**\n\n'
+    '📈 Registros: {r[registros]} | 👥 Asistentes: {r[asistentes]} | 💰 ${r[monto]:,.2f}\n'
+    '💰 Monto promedio: ${r[monto_promedio]:,.2f} '
+    '(p50 ${m[p50]:,.2f}, p90 ${m[p90]:,.2f}, p99 ${m[p99]:,.2f})\n'
+    '👥 Asistentes promedio: {r[asistentes_promedio]:.1f} '
+    '(p50 {a[p50]:g}, p90 {a[p90]:g}, p99 {a[p99]:g})\n'
+)
+ANALISIS_TITULO = Plantilla('\n**{titulo}:**\n')
+ANALISIS_GRUPO = Plantilla(
+    '• {g[etiqueta]}: {g[registros]} reg, {g[asistentes]} asis, '
+    '${g[monto]:,.2f} (prom ${g[monto_promedio]:,.2f})\n'
+)
+BUSCAR_USO = Plantilla(
+    '🔍 **BUSCAR GRUPO**\n\n'
+    'Uso: /buscar <nombre_del_grupo>\n\n'
+    'Ejemplo: /buscar juvenil'
+)
+RESULTADOS_CABECERA = Plantilla('🔍 **RESULTADOS PARA: "{termino}"**\n\n')
+CONFIRMAR_LIMPIAR = Plantilla(
+    '🚨 **LIMPIAR BASE DE DATOS**\n\n'
+    '📊 **Estadísticas actuales:**\n'
+    '• Registros: {stats[total_registros]}\n'
+    '• Asistentes: {stats[total_asistentes]}\n\n'
+    '⚠️ **¿Estás seguro de que quieres eliminar TODOS los registros?**\n\n'
+    '↩️ **Podrás deshacerlo con /deshacer durante {minutos} minutos.**'
+)
+BASE_LIMPIADA = Plantilla(
+    '🗑️ **BASE DE DATOS LIMPIADA**\n\n'
+    '• 📊 **Registros eliminados:** {cantidad}\n\n'
+    '↩️ Usa /deshacer en los próximos {minutos} minutos para restaurarlos.'
+)
+
 # Inicializar base de datos
-db = Database(DB_NAME)
+db = abrir_base_datos(DB_NAME)
+analiticas = {}
+cache_archivos = CacheArchivos()
+permisos = Permisos(db)
+antiabuso = Antiabuso()
+replica = Replica(db)
+respaldos = Respaldos(db.db_name)
+directorio = Directorio().cargar(db)
+try:
+    boletos = Boletos(db, secreto=os.environ.get('SECRETO_BOLETOS') or BOT_TOKEN)
+except RuntimeError as e:
+    # Sin secreto los boletos serían falsificables: se desactivan y el resto del bot sigue
+    logger.warning(f"Boletos desactivados: {e}")
+    boletos = None
+resumenes = Resumenes(db, replica, boletos)
+
+async def db_del_chat(update):
+    """Base de datos limitada al evento en el que trabaja el chat"""
+    return db.del_evento(await db.asincrona.evento_del_chat(update.effective_chat.id))
+
+def etiqueta_bono(bono, cupos):
+    """Nombre del bono para un botón, con sus lugares libres si tiene cupo"""
+    if bono not in cupos:
+        return bono
+    return f"{bono} · {formatear_cupo(*cupos[bono])}"
+
+async def enviar_boleto(update, db_evento, registro_id, grupo, asistentes):
+    """Emite el boleto del registro y lo envía como QR (solo el código si no se puede dibujar)"""
+    if boletos is None:
+        await responder(update, BOLETOS_NO_DISPONIBLES.render())
+        return
+    
+    try:
+        loop = asyncio.get_running_loop()
+        codigo = await loop.run_in_executor(None, boletos.emitir, db_evento, registro_id, grupo, asistentes)
+        caption = BOLETO.render(registro_id=registro_id, codigo=codigo)
+        try:
+            png = await generar_qr(codigo)
+        except Exception as e:
+            logger.error(f"Error dibujando el QR del registro #{registro_id}: {e}")
+            await responder(update, caption)
+            return
+        await update.message.reply_photo(png, caption=caption, parse_mode=ParseMode.HTML)
+        
+    except Exception as e:
+        logger.error(f"Error emitiendo boleto del registro #{registro_id}: {e}")
+        await update.message.reply_text('❌ No se pudo emitir el boleto. El registro sí quedó guardado.')
+
+def analitica_del_evento(db_evento):
+    """Analítica del evento (cada evento conserva sus propios arreglos en caché)"""
+    analitica = analiticas.get(db_evento.evento_id)
+    if analitica is None:
+        analitica = analiticas[db_evento.evento_id] = Analitica(db_evento)
+    return analitica
 
 # Servidor web simple para mantener el bot activo
 app = Flask(__name__)
 
 @app.route('/')
 def home():
-    stats = db.obtener_estadisticas()
+    stats = replica.lectura(db).obtener_estadisticas()
+    cache = db.cache.estadisticas()
     return f"""
     <html>
         <head><title>🤖 Bot Congreso 2026</title></head>
@@ -37,6 +340,8 @@ def home():
                 <p style="color: green; font-weight: bold;">✅ Sistema con Eliminación de Bonos</p>
                 <p><strong>Total registros:</strong> {stats['total_registros']}</p>
                 <p><strong>Total asistentes:</strong> {stats['total_asistentes']}</p>
+                <p><strong>Caché de lecturas:</strong> {cache['tasa_aciertos']:.0%} aciertos ({cache['entradas']} entradas)</p>
+                <p><strong>Datos:</strong> {replica.leyenda()}</p>
             </div>
         </body>
     </html>
@@ -49,80 +354,105 @@ def health():
 # ================= FUNCIONES PRINCIPALES =================
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Mensaje de bienvenida"""
-    await update.message.reply_text(
-        '🤖 **Bienvenido al Sistema del Congreso 2026**\n\n'
-        '📋 **Comandos disponibles:**\n'
-        '• /nuevo - Agregar nuevo registro\n'
-        '• /reporte - Descargar reporte CSV\n'
-        '• /estadisticas - Ver estadísticas\n'
-        '• /corregir - Corregir tipos de bono\n'
-        '• /eliminar - Eliminar registros\n'
-        '• /buscar - Buscar por grupo\n'
-        '• /ayuda - Mostrar ayuda completa'
-    )
+    await responder(update, BIENVENIDA.render())
 
 async def ayuda(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Muestra ayuda completa"""
-    await update.message.reply_text(
-        "🤖 **SISTEMA DE GESTIÓN - CONGRESO 2026**\n\n"
-        "🚀 **COMANDOS PRINCIPALES:**\n"
-        "• /start - Mensaje de bienvenida\n"
-        "• /nuevo - Agregar nuevo registro\n"
-        "• /reporte - Descargar reporte completo (CSV)\n"
-        "• /estadisticas - Ver estadísticas generales\n\n"
-        
-        "🔧 **GESTIÓN DE DATOS:**\n"
-        "• /corregir - Corregir nombres de bonos\n"
-        "• /eliminar - Eliminar registros específicos\n"
-        "• /buscar - Buscar registros por grupo\n"
-        "• /limpiar - Limpiar toda la base de datos\n\n"
-        
-        "💡 **Características:**\n"
-        "✅ Captura de datos completa\n"
-        "✅ Base de datos SQLite\n"
-        "✅ Sistema de corrección de bonos\n"
-        "✅ Eliminación de registros\n"
-        "✅ Reportes en CSV\n"
-        "✅ Estadísticas en tiempo real\n\n"
-        
-        "📝 **Para comenzar usa:** /nuevo"
-    )
+    await responder(update, AYUDA.render())
 
 # ================= CAPTURA DE DATOS =================
+@permisos.requiere('guia')
 async def iniciar_captura(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Inicia el proceso de captura de datos"""
-    await update.message.reply_text(
-        '📝 **NUEVO REGISTRO**\n\n'
-        'Por favor, ingresa el **NOMBRE DEL GRUPO**:'
-    )
+    context.user_data['campo_directorio'] = 'grupo'
+    await responder(update, NUEVO_REGISTRO.render())
     return GRUPO
 
+@permisos.requiere('guia')
 async def capturar_grupo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Captura el nombre del grupo"""
     context.user_data['grupo'] = update.message.text
-    await update.message.reply_text('✅ **GRUPO** guardado. Ahora ingresa el **GUÍA**:')
+    context.user_data['campo_directorio'] = 'guia'
+    await responder(update, CAMPO_GUARDADO.render(campo='GRUPO', indicacion='Ahora ingresa el', siguiente='GUÍA'))
     return GUIA
 
+@permisos.requiere('guia')
 async def capturar_guia(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Captura el nombre del guía"""
     context.user_data['guia'] = update.message.text
-    await update.message.reply_text('✅ **GUÍA** guardado. Ahora ingresa el **BONO**:')
+    context.user_data.pop('campo_directorio', None)
+    await responder(update, CAMPO_GUARDADO.render(campo='GUÍA', indicacion='Ahora ingresa el', siguiente='BONO'))
     return BONO
 
+@permisos.requiere('guia')
 async def capturar_bono(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """Captura el tipo de bono"""
-    context.user_data['bono'] = update.message.text
-    await update.message.reply_text('✅ **BONO** guardado. Ahora ingresa el **MONTO**:')
+    """Captura el tipo de bono y lo resuelve contra el catálogo"""
+    texto = update.message.text
+    indice = await db.asincrona.obtener_indice_bonos()
+    encontrado = indice.buscar(texto)
+    db_evento = await db_del_chat(update)
+    cupos = await db_evento.asincrona.obtener_cupos()
+    
+    # Lo que no coincide con ningún alias pero se parece a alguno se ofrece como botones
+    if encontrado is None:
+        sugerencias = indice.sugerir(texto)
+        if sugerencias:
+            context.user_data['bono_escrito'] = texto
+            context.user_data['bonos_sugeridos'] = dict(sugerencias)
+            keyboard = [
+                [InlineKeyboardButton(f"🎫 {etiqueta_bono(nombre, cupos)}", callback_data=f"bono_sugerido_{bono_id}")]
+                for bono_id, nombre in sugerencias
+            ]
+            keyboard.append([InlineKeyboardButton(f"➕ Usar \"{texto[:40]}\" como bono nuevo", callback_data="bono_nuevo")])
+            await responder(update, BONO_SUGERENCIAS.render(bono=texto), reply_markup=InlineKeyboardMarkup(keyboard))
+            return BONO
+    
+    # Un bono sin lugares se rechaza aquí; la reserva al guardar es la que decide
+    if encontrado and encontrado[1] in cupos and cupos[encontrado[1]][1] <= 0:
+        await responder(update, BONO_AGOTADO.render(bono=encontrado[1], estado=formatear_cupo(*cupos[encontrado[1]])))
+        return BONO
+    
+    context.user_data['bono'] = encontrado[1] if encontrado else texto
+    await responder(update, CAMPO_GUARDADO.render(campo='BONO', indicacion='Ahora ingresa el', siguiente='MONTO'))
+    return MONTO
+
+@permisos.requiere('guia')
+async def elegir_bono(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Toma el bono elegido entre las sugerencias"""
+    query = update.callback_query
+    await query.answer()
+    
+    texto = context.user_data.pop('bono_escrito', None)
+    sugeridos = context.user_data.pop('bonos_sugeridos', {})
+    bono_id = None if query.data == 'bono_nuevo' else int(query.data.replace('bono_sugerido_', ''))
+    
+    # Botones de una sugerencia anterior a la última respuesta
+    if texto is None or (bono_id is not None and bono_id not in sugeridos):
+        await query.edit_message_text('❌ Esa sugerencia ya no está vigente. Escribe el BONO de nuevo.')
+        return BONO
+    
+    if bono_id is None:
+        context.user_data['bono'] = texto
+    else:
+        # Lo escrito queda como alias del bono elegido: la próxima vez coincide directo
+        await db.asincrona.agregar_alias_bono(texto, bono_id)
+        context.user_data['bono'] = sugeridos[bono_id]
+    
+    await responder(update, CAMPO_GUARDADO.render(campo='BONO', indicacion='Ahora ingresa el', siguiente='MONTO'))
     return MONTO
 
+@permisos.requiere('guia')
 async def capturar_monto(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Captura el monto"""
     context.user_data['monto'] = update.message.text
-    await update.message.reply_text('✅ **MONTO** guardado. Ingresa los **ASISTENTES**:')
+    await responder(update, CAMPO_GUARDADO.render(campo='MONTO', indicacion='Ingresa los', siguiente='ASISTENTES'))
     return ASISTENTES
 
+@permisos.requiere('guia')
+@por_chat
 async def capturar_asistentes(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Captura los asistentes y guarda el registro"""
+    db_evento = await db_del_chat(update)
     try:
         grupo = context.user_data['grupo']
         guia = context.user_data['guia']
@@ -144,20 +474,29 @@ async def capturar_asistentes(update: Update, context: ContextTypes.DEFAULT_TYPE
             await update.message.reply_text('❌ Error: Los asistentes deben ser un número. Usa /nuevo para empezar de nuevo.')
             return ConversationHandler.END
         
-        # Guardar en base de datos
-        registro_id = db.agregar_registro(grupo, guia, bono, monto, asistentes)
-        
-        await update.message.reply_text(
-            f'🎉 **REGISTRO #{registro_id} COMPLETADO!**\n\n'
-            f'📋 **Resumen:**\n'
-            f'• 🏷️ **Grupo:** {grupo}\n'
-            f'• 👤 **Guía:** {guia}\n'
-            f'• 🎫 **Bono:** {bono}\n'
-            f'• 💰 **Monto:** ${monto_float:,.2f}\n'
-            f'• 👥 **Asistentes:** {asistentes_int}\n\n'
-            '💾 **Guardado en base de datos**\n\n'
-            'Usa /nuevo para otro registro o /reporte para descargar datos.'
+        # Guardar en base de datos (un reintento del mismo mensaje devuelve el registro original)
+        clave = clave_idempotencia(
+            update.effective_chat.id, update.message.message_id, grupo, guia, bono, monto, asistentes
         )
+        registro_id, nuevo = await db_evento.asincrona.agregar_registro(
+            grupo, guia, bono, monto, asistentes, usuario=update.effective_user.id, clave=clave
+        )
+        # Un reintento no vuelve a sumar el uso del grupo y el guía en el autocompletado
+        if nuevo:
+            directorio.agregar(grupo, guia)
+        
+        await responder(update, REGISTRO_COMPLETADO.render(
+            registro_id=registro_id, grupo=grupo, guia=guia, bono=bono, monto=monto_float, asistentes=asistentes_int
+        ))
+        await enviar_boleto(update, db_evento, registro_id, grupo, asistentes_int)
+        return ConversationHandler.END
+        
+    except CupoAgotado as e:
+        mensaje = SIN_CUPO.render(bono=e.bono, solicitados=e.solicitados, disponibles=max(e.disponibles, 0))
+        if e.disponibles > 0:
+            await responder(update, [mensaje, SIN_CUPO_REINTENTAR.render()])
+            return ASISTENTES
+        await responder(update, [mensaje, SIN_CUPO_OTRO_BONO.render()])
         return ConversationHandler.END
         
     except Exception as e:
@@ -167,13 +506,37 @@ async def capturar_asistentes(update: Update, context: ContextTypes.DEFAULT_TYPE
 
 async def cancelar(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Cancela la conversación actual"""
+    context.user_data.pop('campo_directorio', None)
     await update.message.reply_text('❌ Operación cancelada.')
     return ConversationHandler.END
 
+# ================= AUTOCOMPLETADO =================
+@permisos.requiere('guia')
+async def autocompletar(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Sugiere grupos o guías ya capturados en modo inline (@bot texto)"""
+    consulta = update.inline_query
+    # El paso de /nuevo en que está el usuario decide qué se sugiere; fuera de la captura, grupos
+    campo = context.user_data.get('campo_directorio', 'grupo')
+    etiqueta = 'Grupo' if campo == 'grupo' else 'Guía'
+    
+    resultados = [
+        InlineQueryResultArticle(
+            id=str(i),
+            title=nombre,
+            description=f'{etiqueta} · {veces} registros',
+            input_message_content=InputTextMessageContent(nombre)
+        )
+        for i, (nombre, veces) in enumerate(directorio.buscar(campo, consulta.query))
+    ]
+    # Sin caché en Telegram: la misma consulta cambia de grupo a guía según el paso
+    await consulta.answer(resultados, cache_time=0, is_personal=True)
+
 # ================= ELIMINACIÓN DE REGISTROS =================
+@permisos.requiere('admin')
 async def eliminar_registro(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Muestra opciones para eliminar registros"""
-    bonos = db.obtener_tipos_bono()
+    db_evento = await db_del_chat(update)
+    bonos = await db_evento.asincrona.obtener_tipos_bono()
     
     if not bonos:
         await update.message.reply_text('📭 No hay registros en la base de datos.')
@@ -189,14 +552,12 @@ async def eliminar_registro(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     reply_markup = InlineKeyboardMarkup(keyboard)
     
-    await update.message.reply_text(
-        '🗑️ **SISTEMA DE ELIMINACIÓN**\n\n'
-        'Selecciona el método de eliminación:',
-        reply_markup=reply_markup
-    )
+    await responder(update, MENU_ELIMINACION.render(), reply_markup=reply_markup)
 
+@permisos.requiere('admin')
 async def handle_eliminar_opcion(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Maneja la selección de opción de eliminación"""
+    db_evento = await db_del_chat(update)
     query = update.callback_query
     await query.answer()
     
@@ -205,51 +566,37 @@ async def handle_eliminar_opcion(update: Update, context: ContextTypes.DEFAULT_T
         return
     
     elif query.data == "eliminar_bono":
-        bonos = db.obtener_tipos_bono()
+        bonos = await db_evento.asincrona.obtener_tipos_bono()
+        cupos = await db_evento.asincrona.obtener_cupos()
         
         keyboard = []
         for bono in bonos:
-            keyboard.append([InlineKeyboardButton(f"🎫 {bono}", callback_data=f"eliminar_bono_{bono}")])
+            keyboard.append([InlineKeyboardButton(f"🎫 {etiqueta_bono(bono, cupos)}", callback_data=f"eliminar_bono_{bono}")])
         
         keyboard.append([InlineKeyboardButton("🔙 Volver", callback_data="volver_eliminar")])
         
         reply_markup = InlineKeyboardMarkup(keyboard)
         
-        await query.edit_message_text(
-            '🗑️ **ELIMINAR POR TIPO DE BONO**\n\n'
-            'Selecciona el tipo de bono a eliminar:\n\n'
-            '⚠️ **ADVERTENCIA:** Esto eliminará TODOS los registros del bono seleccionado.',
-            reply_markup=reply_markup
-        )
+        await responder(update, ELIMINAR_POR_BONO.render(), reply_markup=reply_markup)
     
     elif query.data == "eliminar_id":
-        await query.edit_message_text(
-            '🔍 **ELIMINAR POR ID**\n\n'
-            'Por favor, ingresa el **ID del registro** que quieres eliminar:\n\n'
-            '💡 **Consejo:** Usa /reporte para ver todos los IDs disponibles.'
-        )
+        await responder(update, ELIMINAR_POR_ID.render())
         return ELIMINAR_BONO
     
     elif query.data == "ver_registros":
-        registros = db.obtener_todos_registros()
+        registros = await db_evento.asincrona.obtener_todos_registros()
         
         if not registros:
             await query.edit_message_text('📭 No hay registros en la base de datos.')
             return
         
-        mensaje = '📋 **ÚLTIMOS 10 REGISTROS**\n\n'
-        for registro in registros[:10]:
-            id_reg, grupo, guia, bono, monto, asistentes, fecha = registro
-            fecha_simple = fecha.split()[0] if isinstance(fecha, str) else str(fecha)[:10]
-            mensaje += f"🆔 **#{id_reg}** - {grupo}\n"
-            mensaje += f"   👤 {guia} | 🎫 {bono}\n"
-            mensaje += f"   👥 {asistentes} | 💰 ${float(monto):,.2f}\n"
-            mensaje += f"   📅 {fecha_simple}\n\n"
+        bloques = [ULTIMOS_REGISTROS.render()]
+        bloques.extend(REGISTRO_FILA.lineas('registro', registros[:10]))
         
         keyboard = [[InlineKeyboardButton("🔙 Volver", callback_data="volver_eliminar")]]
         reply_markup = InlineKeyboardMarkup(keyboard)
         
-        await query.edit_message_text(mensaje, reply_markup=reply_markup)
+        await responder(update, bloques, reply_markup=reply_markup)
     
     elif query.data == "volver_eliminar":
         keyboard = [
@@ -261,14 +608,12 @@ async def handle_eliminar_opcion(update: Update, context: ContextTypes.DEFAULT_T
         
         reply_markup = InlineKeyboardMarkup(keyboard)
         
-        await query.edit_message_text(
-            '🗑️ **SISTEMA DE ELIMINACIÓN**\n\n'
-            'Selecciona el método de eliminación:',
-            reply_markup=reply_markup
-        )
+        await responder(update, MENU_ELIMINACION.render(), reply_markup=reply_markup)
 
+@permisos.requiere('admin')
 async def handle_eliminar_bono_especifico(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Maneja la eliminación de un tipo de bono específico"""
+    db_evento = await db_del_chat(update)
     query = update.callback_query
     await query.answer()
     
@@ -276,22 +621,19 @@ async def handle_eliminar_bono_especifico(update: Update, context: ContextTypes.
         bono_a_eliminar = query.data.replace("eliminar_bono_", "")
         
         # Obtener registros con este bono
-        registros = db.obtener_registros_por_bono(bono_a_eliminar)
+        registros = await db_evento.asincrona.obtener_registros_por_bono(bono_a_eliminar)
         
         if not registros:
             await query.edit_message_text(f'❌ No hay registros con bono: {bono_a_eliminar}')
             return
         
-        total_asistentes = sum(registro[5] for registro in registros)
-        total_monto = sum(float(registro[4]) for registro in registros)
-        
-        mensaje = f'⚠️ **CONFIRMAR ELIMINACIÓN**\n\n'
-        mensaje += f'🎫 **Bono a eliminar:** {bono_a_eliminar}\n'
-        mensaje += f'📊 **Registros afectados:** {len(registros)}\n'
-        mensaje += f'👥 **Total asistentes:** {total_asistentes}\n'
-        mensaje += f'💰 **Total monto:** ${total_monto:,.2f}\n\n'
-        mensaje += '¿Estás seguro de que quieres eliminar TODOS estos registros?\n\n'
-        mensaje += '🚨 **Esta acción no se puede deshacer.**'
+        mensaje = CONFIRMAR_ELIMINAR_BONO.render(
+            bono=bono_a_eliminar,
+            cantidad=len(registros),
+            asistentes=sum(registro.asistentes for registro in registros),
+            monto=formatear_monto(sum(registro.centavos for registro in registros)),
+            minutos=MINUTOS_DESHACER
+        )
         
         keyboard = [
             [
@@ -302,10 +644,13 @@ async def handle_eliminar_bono_especifico(update: Update, context: ContextTypes.
         
         reply_markup = InlineKeyboardMarkup(keyboard)
         
-        await query.edit_message_text(mensaje, reply_markup=reply_markup)
+        await responder(update, mensaje, reply_markup=reply_markup)
 
+@permisos.requiere('admin')
+@por_chat
 async def handle_confirmar_eliminar_bono(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Confirma y ejecuta la eliminación de un tipo de bono"""
+    db_evento = await db_del_chat(update)
     query = update.callback_query
     await query.answer()
     
@@ -313,17 +658,16 @@ async def handle_confirmar_eliminar_bono(update: Update, context: ContextTypes.D
         bono_a_eliminar = query.data.replace("confirmar_eliminar_bono_", "")
         
         # Ejecutar eliminación
-        registros_eliminados = db.eliminar_registros_por_bono(bono_a_eliminar)
+        registros_eliminados = await db_evento.asincrona.eliminar_registros_por_bono(bono_a_eliminar, usuario=update.effective_user.id)
         
-        await query.edit_message_text(
-            f'✅ **ELIMINACIÓN COMPLETADA**\n\n'
-            f'• 🎫 **Bono eliminado:** {bono_a_eliminar}\n'
-            f'• 📊 **Registros eliminados:** {registros_eliminados}\n\n'
-            '🗑️ Todos los registros han sido eliminados permanentemente.'
-        )
+        await responder(update, BONO_ELIMINADO.render(
+            bono=bono_a_eliminar, cantidad=registros_eliminados, minutos=MINUTOS_DESHACER
+        ))
 
+@permisos.requiere('admin')
 async def eliminar_por_id(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Elimina un registro por ID específico"""
+    db_evento = await db_del_chat(update)
     try:
         registro_id_text = update.message.text.strip()
         
@@ -332,7 +676,7 @@ async def eliminar_por_id(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return ELIMINAR_BONO
         
         registro_id = int(registro_id_text)
-        registro = db.obtener_registro_por_id(registro_id)
+        registro = await db_evento.asincrona.obtener_registro_por_id(registro_id)
         
         if not registro:
             await update.message.reply_text(
@@ -341,21 +685,6 @@ async def eliminar_por_id(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             return ELIMINAR_BONO
         
-        # Mostrar información del registro
-        id_reg, grupo, guia, bono, monto, asistentes, fecha = registro
-        fecha_simple = fecha.split()[0] if isinstance(fecha, str) else str(fecha)[:10]
-        
-        mensaje = f'🔍 **REGISTRO ENCONTRADO**\n\n'
-        mensaje += f'• 🆔 **ID:** {id_reg}\n'
-        mensaje += f'• 🏷️ **Grupo:** {grupo}\n'
-        mensaje += f'• 👤 **Guía:** {guia}\n'
-        mensaje += f'• 🎫 **Bono:** {bono}\n'
-        mensaje += f'• 💰 **Monto:** ${float(monto):,.2f}\n'
-        mensaje += f'• 👥 **Asistentes:** {asistentes}\n'
-        mensaje += f'• 📅 **Fecha:** {fecha_simple}\n\n'
-        mensaje += '¿Estás seguro de que quieres eliminar este registro?\n\n'
-        mensaje += '🚨 **Esta acción no se puede deshacer.**'
-        
         # Guardar ID en contexto para confirmación
         context.user_data['registro_a_eliminar'] = registro_id
         
@@ -368,7 +697,10 @@ async def eliminar_por_id(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         reply_markup = InlineKeyboardMarkup(keyboard)
         
-        await update.message.reply_text(mensaje, reply_markup=reply_markup)
+        # Mostrar información del registro
+        await responder(
+            update, REGISTRO_ENCONTRADO.render(registro=registro, minutos=MINUTOS_DESHACER), reply_markup=reply_markup
+        )
         return ConversationHandler.END
         
     except Exception as e:
@@ -376,8 +708,11 @@ async def eliminar_por_id(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text('❌ Error al buscar el registro. Intenta nuevamente:')
         return ELIMINAR_BONO
 
+@permisos.requiere('admin')
+@por_chat
 async def handle_confirmar_eliminar_id(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Confirma y ejecuta la eliminación por ID"""
+    db_evento = await db_del_chat(update)
     query = update.callback_query
     await query.answer()
     
@@ -388,120 +723,549 @@ async def handle_confirmar_eliminar_id(update: Update, context: ContextTypes.DEF
         return
     
     # Obtener información del registro antes de eliminar
-    registro = db.obtener_registro_por_id(registro_id)
+    registro = await db_evento.asincrona.obtener_registro_por_id(registro_id)
     
     if not registro:
         await query.edit_message_text('❌ Error: El registro ya no existe')
         return
     
     # Ejecutar eliminación
-    eliminado = db.eliminar_registro(registro_id)
+    eliminado = await db_evento.asincrona.eliminar_registro(registro_id, usuario=update.effective_user.id)
     
     if eliminado:
-        id_reg, grupo, guia, bono, monto, asistentes, fecha = registro
-        await query.edit_message_text(
-            f'✅ **REGISTRO ELIMINADO**\n\n'
-            f'• 🆔 **ID:** {id_reg}\n'
-            f'• 🏷️ **Grupo:** {grupo}\n'
-            f'• 🎫 **Bono:** {bono}\n'
-            f'• 💰 **Monto:** ${float(monto):,.2f}\n\n'
-            '🗑️ El registro ha sido eliminado permanentemente.'
-        )
+        await responder(update, REGISTRO_ELIMINADO.render(registro=registro, minutos=MINUTOS_DESHACER))
     else:
         await query.edit_message_text('❌ Error: No se pudo eliminar el registro')
 
+@permisos.requiere('admin')
+@por_chat
+async def deshacer(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Restaura la última eliminación del usuario dentro de la ventana de deshacer"""
+    db_evento = await db_del_chat(update)
+    registros_restaurados = await db_evento.asincrona.deshacer_eliminacion(usuario=update.effective_user.id)
+    
+    if not registros_restaurados:
+        await update.message.reply_text(
+            f'❌ No tienes eliminaciones de los últimos {MINUTOS_DESHACER} minutos para deshacer.'
+        )
+        return
+    
+    await responder(update, ELIMINACION_DESHECHA.render(cantidad=registros_restaurados))
+
+@permisos.requiere('admin')
+async def ver_duplicados(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Lista registros que probablemente están duplicados (mismo grupo, guía y bono)"""
+    db_evento = await db_del_chat(update)
+    try:
+        duplicados = await db_evento.asincrona.buscar_duplicados()
+        
+        if not duplicados:
+            await update.message.reply_text('✅ No se encontraron registros duplicados.')
+            return
+        
+        bloques = [DUPLICADOS_CABECERA.render(cantidad=len(duplicados))]
+        for registros in duplicados:
+            ids = ', '.join(f'#{registro.id}' for registro in registros)
+            bloques.append(DUPLICADOS_GRUPO.render(primero=registros[0], ids=ids))
+        bloques.append(DUPLICADOS_PIE.render())
+        
+        await responder(update, bloques, archivo='duplicados.txt')
+        
+    except Exception as e:
+        logger.error(f"Error buscando duplicados: {e}")
+        await update.message.reply_text('❌ Error al buscar duplicados.')
+
+@permisos.requiere('admin')
+async def otorgar(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Asigna o quita el rol de un usuario: /otorgar <id_usuario> <admin|guia|viewer|ninguno>"""
+    roles_validos = list(NIVELES) + ['ninguno']
+    
+    if len(context.args) != 2 or not context.args[0].isdigit() or context.args[1].lower() not in roles_validos:
+        await responder(update, OTORGAR_USO.render(roles='|'.join(roles_validos)))
+        return
+    
+    usuario_id = int(context.args[0])
+    rol = context.args[1].lower()
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(
+        None, lambda: permisos.otorgar(usuario_id, None if rol == 'ninguno' else rol, otorgado_por=update.effective_user.id)
+    )
+    
+    if rol == 'ninguno':
+        await update.message.reply_text(f'🔐 Se quitó el rol del usuario {usuario_id}.')
+    else:
+        await update.message.reply_text(f'🔐 Usuario {usuario_id} ahora tiene el rol: {rol}.')
+
+@permisos.requiere('admin')
+@por_chat
+async def cupo(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Muestra los cupos del evento o fija el de un bono: /cupo <bono> <capacidad|libre>"""
+    db_evento = await db_del_chat(update)
+    try:
+        if not context.args:
+            cupos = await db_evento.asincrona.obtener_cupos()
+            if not cupos:
+                await responder(update, CUPO_USO.render())
+                return
+            bloques = [CUPOS_CABECERA.render()]
+            for bono, (capacidad, disponibles) in cupos.items():
+                bloques.append(CUPO_FILA.render(bono=bono, estado=formatear_cupo(capacidad, disponibles)))
+            await responder(update, bloques)
+            return
+        
+        *palabras, valor = context.args
+        if not palabras or not (valor.isdigit() or valor.lower() == 'libre'):
+            await responder(update, CUPO_USO.render())
+            return
+        
+        capacidad = None if valor.lower() == 'libre' else int(valor)
+        bono, disponibles = await db_evento.asincrona.fijar_cupo(' '.join(palabras), capacidad)
+        if capacidad is None:
+            await responder(update, CUPO_QUITADO.render(bono=bono))
+        else:
+            await responder(update, CUPO_FIJADO.render(bono=bono, estado=formatear_cupo(capacidad, disponibles)))
+        
+    except Exception as e:
+        logger.error(f"Error fijando cupo: {e}")
+        await update.message.reply_text('❌ Error al fijar el cupo.')
+
+# ================= INGRESO EN LA PUERTA =================
+@permisos.requiere('guia')
+async def modo_checkin(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Activa o desactiva el modo puerta: cada foto o código que llegue se valida como boleto"""
+    if boletos is None:
+        await responder(update, BOLETOS_NO_DISPONIBLES.render())
+        return
+    
+    evento_id = context.user_data.pop('modo_checkin', None)
+    if evento_id is not None:
+        ingresados, vigentes = boletos.ingresados(evento_id)
+        await responder(update, CHECKIN_TERMINADO.render(ingresados=ingresados, vigentes=vigentes))
+        return
+    
+    # El evento se fija al entrar: validar no vuelve a consultar la base de datos
+    evento_id = context.user_data['modo_checkin'] = await db.asincrona.evento_del_chat(update.effective_chat.id)
+    ingresados, vigentes = boletos.ingresados(evento_id)
+    await responder(update, CHECKIN_ACTIVO.render(ingresados=ingresados, vigentes=vigentes))
+
+async def escanear_boleto(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Valida en memoria la foto del QR o el código de un boleto (solo en modo puerta)"""
+    evento_id = context.user_data.get('modo_checkin')
+    if evento_id is None:
+        return
+    # Sin decorador: fuera del modo puerta los mensajes sueltos no deben contestar "sin permiso"
+    if not permisos.tiene(update.effective_user.id, 'guia'):
+        context.user_data.pop('modo_checkin', None)
+        return
+    
+    try:
+        texto = update.message.text
+        if update.message.photo:
+            # La primera versión de al menos 800 px basta para leer el QR y se descarga antes
+            fotos = update.message.photo
+            foto = next((f for f in fotos if max(f.width, f.height) >= 800), fotos[-1])
+            archivo = await foto.get_file()
+            texto = await decodificar_qr(bytes(await archivo.download_as_bytearray()))
+            if texto is None:
+                await responder(update, SIN_QR.render())
+                return
+        
+        loop = asyncio.get_running_loop()
+        estado, datos = await loop.run_in_executor(None, boletos.validar, texto, evento_id, update.effective_user.id)
+        await responder(update, INGRESOS[estado].render(d=datos))
+        
+    except Exception as e:
+        logger.error(f"Error validando boleto: {e}")
+        await update.message.reply_text('❌ Error al validar el boleto.')
+
+# ================= RESÚMENES PROGRAMADOS =================
+def describir_frecuencias(frecuencias):
+    """'cada hora y al cierre del día (05:00 UTC)' para los mensajes de suscripción"""
+    return ' y '.join(FRECUENCIAS[frecuencia] for frecuencia in frecuencias) or 'ningún resumen'
+
+@permisos.requiere('viewer')
+async def suscribir(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Suscribe el chat a los resúmenes programados: /suscribir [hora|dia] (sin argumento, a ambos)"""
+    chat_id = update.effective_chat.id
+    frecuencias = [arg.lower() for arg in context.args] or list(FRECUENCIAS)
+    try:
+        if any(frecuencia not in FRECUENCIAS for frecuencia in frecuencias):
+            await responder(update, RESUMENES_USO.render(actuales=describir_frecuencias(resumenes.del_chat(chat_id))))
+            return
+        
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, resumenes.suscribir, chat_id, frecuencias, update.effective_user.id)
+        await responder(update, SUSCRITO.render(frecuencias=describir_frecuencias(frecuencias)))
+        
+    except Exception as e:
+        logger.error(f"Error suscribiendo el chat {chat_id}: {e}")
+        await update.message.reply_text('❌ Error al suscribir el chat.')
+
+@permisos.requiere('viewer')
+async def desuscribir(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Da de baja el chat de los resúmenes programados: /desuscribir [hora|dia] (sin argumento, de todos)"""
+    chat_id = update.effective_chat.id
+    frecuencias = [arg.lower() for arg in context.args] or resumenes.del_chat(chat_id)
+    try:
+        if not frecuencias or any(frecuencia not in FRECUENCIAS for frecuencia in frecuencias):
+            await responder(update, RESUMENES_USO.render(actuales=describir_frecuencias(resumenes.del_chat(chat_id))))
+            return
+        
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, resumenes.cancelar, chat_id, frecuencias)
+        await responder(update, DESUSCRITO.render(frecuencias=describir_frecuencias(frecuencias)))
+        
+    except Exception as e:
+        logger.error(f"Error dando de baja el chat {chat_id}: {e}")
+        await update.message.reply_text('❌ Error al dar de baja el chat.')
+
+def bloques_resumen(evento, frecuencia, resumen):
+    """Bloques del mensaje de resumen de un evento, iguales para todos sus suscriptores"""
+    bloques = [RESUMEN_CABECERA.render(periodo='DE LA HORA' if frecuencia == 'hora' else 'DEL DÍA', evento=evento)]
+    if resumen['cambios'] is not None:
+        registros, asistentes = resumen['cambios']
+        bloques.append(RESUMEN_CAMBIOS.render(registros=registros, asistentes=asistentes))
+    bloques.append(RESUMEN_TOTALES.render(stats=resumen['stats']))
+    
+    if resumen['stats']['por_bono']:
+        bloques.append(ESTADISTICAS_POR_BONO.render())
+        for bono, cantidad, asistentes, monto in resumen['stats']['por_bono']:
+            bloques.append(ESTADISTICAS_BONO.render(bono=bono, cantidad=cantidad, asistentes=asistentes, monto=float(monto)))
+    
+    if resumen['cupos']:
+        bloques.append(ESTADISTICAS_CUPOS.render())
+        for bono, (capacidad, disponibles) in resumen['cupos'].items():
+            bloques.append(CUPO_FILA.render(bono=bono, estado=formatear_cupo(capacidad, disponibles)))
+    
+    if resumen['ingresos'] and resumen['ingresos'][1]:
+        ingresados, vigentes = resumen['ingresos']
+        bloques.append(RESUMEN_INGRESOS.render(ingresados=ingresados, vigentes=vigentes))
+    
+    bloques.append(LEYENDA.render(leyenda=replica.leyenda()))
+    return bloques
+
+async def enviar_resumenes(context: ContextTypes.DEFAULT_TYPE):
+    """Job del JobQueue: calcula una vez el resumen de cada evento y lo envía a todos sus chats suscritos"""
+    frecuencia = context.job.data
+    loop = asyncio.get_running_loop()
+    nombres = {evento_id: nombre for evento_id, nombre, _ in await db.asincrona.obtener_eventos(incluir_archivados=True)}
+    
+    por_evento = await loop.run_in_executor(None, resumenes.por_evento, frecuencia)
+    for evento_id, chats in por_evento.items():
+        try:
+            resumen = await loop.run_in_executor(None, resumenes.calcular, evento_id, frecuencia)
+        except Exception as e:
+            logger.error(f"Error calculando el resumen del evento {evento_id}: {e}")
+            continue
+        
+        # Una hora sin registros nuevos ni eliminados no amerita mensaje
+        if frecuencia == 'hora' and resumen['cambios'] == (0, 0):
+            continue
+        
+        mensajes = dividir(bloques_resumen(nombres.get(evento_id, evento_id), frecuencia, resumen))
+        for chat_id in chats:
+            try:
+                for texto in mensajes:
+                    await context.bot.send_message(chat_id, texto, parse_mode=ParseMode.HTML)
+            except Forbidden:
+                # El bot ya no está en el chat: se da de baja para no reintentar cada hora
+                logger.warning(f"Chat {chat_id} dado de baja de los resúmenes: el bot ya no tiene acceso")
+                await loop.run_in_executor(None, resumenes.cancelar, chat_id)
+            except TelegramError as e:
+                logger.error(f"Error enviando resumen al chat {chat_id}: {e}")
+
+def programar_resumenes(application):
+    """Programa en el JobQueue el resumen de cada hora en punto y el de cierre del día"""
+    if application.job_queue is None:
+        logger.warning("Sin JobQueue (falta python-telegram-bot[job-queue]): no habrá resúmenes programados")
+        return
+    
+    application.job_queue.run_repeating(
+        enviar_resumenes, interval=3600, first=segundos_para_la_hora(), data='hora', name='resumen_hora'
+    )
+    application.job_queue.run_daily(enviar_resumenes, HORA_RESUMEN_DIARIO, data='dia', name='resumen_dia')
+
+# ================= EVENTOS =================
+@permisos.requiere('viewer')
+@por_chat
+async def cambiar_evento(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Muestra o cambia el evento del chat: /evento [nombre]; crear uno nuevo requiere admin"""
+    evento_actual = await db.asincrona.evento_del_chat(update.effective_chat.id)
+    
+    if not context.args:
+        bloques = [EVENTOS_CABECERA.render()]
+        for evento_id, nombre, _ in await db.asincrona.obtener_eventos():
+            marca = '👉' if evento_id == evento_actual else '•'
+            bloques.append(EVENTO_FILA.render(marca=marca, nombre=nombre))
+        bloques.append(EVENTOS_PIE.render())
+        await responder(update, bloques)
+        return
+    
+    nombre = ' '.join(context.args)
+    try:
+        evento = await db.asincrona.buscar_evento(nombre)
+        
+        if evento and evento[2]:
+            await update.message.reply_text(f'❌ El evento {evento[1]} está archivado.')
+            return
+        
+        if evento:
+            evento_id, nombre = evento[0], evento[1]
+        elif permisos.tiene(update.effective_user.id, 'admin'):
+            evento_id = await db.asincrona.crear_evento(nombre)
+        else:
+            await update.message.reply_text(f'❌ No existe el evento: {nombre}.')
+            return
+        
+        await db.asincrona.asignar_evento_chat(update.effective_chat.id, evento_id)
+        await update.message.reply_text(f'🗓️ Este chat ahora trabaja en el evento: {nombre}.')
+        
+    except Exception as e:
+        logger.error(f"Error cambiando de evento: {e}")
+        await update.message.reply_text('❌ Error al cambiar de evento.')
+
+@permisos.requiere('admin')
+@por_chat
+async def archivar_evento(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Mueve los registros de un evento terminado a su propio archivo: /archivar <nombre>"""
+    if not context.args:
+        await update.message.reply_text('🗄️ Uso: /archivar <nombre del evento>')
+        return
+    
+    nombre = ' '.join(context.args)
+    try:
+        evento = await db.asincrona.buscar_evento(nombre)
+        
+        if not evento or evento[2]:
+            await update.message.reply_text(f'❌ No hay un evento activo llamado: {nombre}.')
+            return
+        
+        ruta, registros_movidos = await db.asincrona.archivar_evento(evento[0])
+        analiticas.pop(evento[0], None)
+        
+        await responder(update, EVENTO_ARCHIVADO.render(
+            evento=evento[1], cantidad=registros_movidos, archivo=os.path.basename(ruta)
+        ))
+        
+    except ValueError as e:
+        await update.message.reply_text(f'❌ {e}.')
+    except Exception as e:
+        logger.error(f"Error archivando evento: {e}")
+        await update.message.reply_text('❌ Error al archivar el evento.')
+
+# ================= RESPALDOS =================
+@permisos.requiere('admin')
+async def respaldo(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Hace un respaldo completo en el momento y lo envía comprimido al chat"""
+    if DATABASE_URL:
+        await update.message.reply_text('❌ Con PostgreSQL los respaldos se hacen con las herramientas del servidor.')
+        return
+    
+    try:
+        await update.message.reply_text('💾 Generando respaldo...')
+        loop = asyncio.get_running_loop()
+        ruta, tamano, seq = await loop.run_in_executor(None, respaldos.crear_respaldo)
+        caption = f'💾 Respaldo {os.path.basename(ruta)}\n📦 {tamano / 1024:,.0f} KB, hasta el cambio #{seq}'
+        
+        if tamano > TAMANO_MAXIMO_ENVIO:
+            await update.message.reply_text(f'{caption}\n⚠️ Es demasiado grande para Telegram; queda guardado en el servidor.')
+            return
+        
+        with open(ruta, 'rb') as f:
+            await update.message.reply_document(f, filename=os.path.basename(ruta), caption=caption)
+        
+    except Exception as e:
+        logger.error(f"Error generando respaldo: {e}")
+        await update.message.reply_text('❌ Error al generar el respaldo.')
+
 # ================= FUNCIONES ADICIONALES =================
+@permisos.requiere('viewer')
 async def generar_reporte(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Genera y envía un reporte CSV"""
+    """Genera y envía un reporte: CSV, XLSX, PDF, ZIP por bono, incremental (delta) o columnar (parquet/arrow)"""
+    db_evento = await db_del_chat(update)
+    modo = context.args[0].lower() if context.args else 'csv'
+    if modo not in ESCRITORES and modo not in ('delta', 'parquet', 'arrow'):
+        modo = 'csv'
+    
     try:
-        registros = db.obtener_todos_registros()
+        # Los reportes completos salen de la copia de lectura y se reenvían por file_id mientras no cambie
+        lectura = db_evento if modo == 'delta' else replica.lectura(db_evento)
+        leyenda = '' if modo == 'delta' else LEYENDA.render(leyenda=replica.leyenda())
+        version = await lectura.asincrona.ultimo_cambio()
+        if modo != 'delta':
+            file_id, caption = cache_archivos.obtener(f'reporte_{db_evento.evento_id}_{modo}', version)
+            if file_id:
+                await update.message.reply_document(file_id, caption=caption + leyenda, parse_mode=ParseMode.HTML)
+                return
         
-        if not registros:
+        if modo in ESCRITORES:
+            # CSV/XLSX/PDF/ZIP: se construyen en memoria, los pesados en otro proceso
+            contenido, filas, filename = await construir_reporte(lectura, modo, version)
+            caption = CAPTION_REPORTE.render(filas=filas)
+        else:
+            # Se escribe fuera del event loop y con nombre propio de la actualización,
+            # así dos reportes simultáneos no se pisan el archivo
+            loop = asyncio.get_running_loop()
+            ruta_temporal = f'reporte_{update.update_id}.tmp'
+            if modo == 'delta':
+                filename = 'reporte_congreso_2026_delta.csv'
+                filas = await loop.run_in_executor(
+                    None, exportar_delta_csv, db_evento, ruta_temporal, f'chat_{update.effective_chat.id}_evento_{db_evento.evento_id}'
+                )
+                caption = CAPTION_DELTA.render(filas=filas)
+            else:
+                filename = f'reporte_congreso_2026.{modo}'
+                filas = await loop.run_in_executor(None, exportar_columnar, lectura, ruta_temporal, modo)
+                caption = CAPTION_COLUMNAR.render(modo=modo.capitalize(), filas=filas)
+            
+            with open(ruta_temporal, 'rb') as f:
+                contenido = f.read()
+            os.remove(ruta_temporal)
+        
+        if not filas and modo != 'delta':
             await update.message.reply_text('📭 No hay datos en la base de datos.')
             return
         
-        filename = 'reporte_congreso_2026.csv'
-        with open(filename, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            writer.writerow(['ID', 'GRUPO', 'GUIA', 'BONO', 'MONTO', 'ASISTENTES', 'FECHA'])
-            
-            for registro in registros:
-                writer.writerow(registro)
-        
-        with open(filename, 'rb') as f:
-            await update.message.reply_document(
-                f, 
-                filename=filename,
-                caption='📊 **Reporte completo del Congreso 2026**\n\n'
-                       f'Total de registros: {len(registros)}'
-            )
+        mensaje = await update.message.reply_document(
+            contenido, 
+            filename=filename,
+            caption=caption + leyenda,
+            parse_mode=ParseMode.HTML
+        )
         
-        # Limpiar archivo temporal
-        os.remove(filename)
+        if modo != 'delta':
+            cache_archivos.guardar(f'reporte_{db_evento.evento_id}_{modo}', version, mensaje.document.file_id, caption)
             
     except Exception as e:
         logger.error(f"Error generando reporte: {e}")
         await update.message.reply_text('❌ Error al generar el reporte.')
 
+@permisos.requiere('viewer')
 async def ver_estadisticas(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Muestra estadísticas generales"""
+    db_evento = await db_del_chat(update)
     try:
-        stats = db.obtener_estadisticas()
+        stats = await replica.lectura(db_evento).asincrona.obtener_estadisticas()
         
-        mensaje = "📊 **ESTADÍSTICAS DEL CONGRESO**\n\n"
-        mensaje += f"📈 **Total registros:** {stats['total_registros']}\n"
-        mensaje += f"👥 **Total asistentes:** {stats['total_asistentes']}\n\n"
+        bloques = [ESTADISTICAS_CABECERA.render(stats=stats)]
         
         if stats['por_bono']:
-            mensaje += "🎫 **Por tipo de bono:**\n"
+            bloques.append(ESTADISTICAS_POR_BONO.render())
             for bono, cantidad, asistentes, monto in stats['por_bono']:
-                mensaje += f"• **{bono}:** {cantidad} reg, {asistentes} asis, ${float(monto):,.2f}\n"
+                bloques.append(ESTADISTICAS_BONO.render(bono=bono, cantidad=cantidad, asistentes=asistentes, monto=float(monto)))
+        
+        cupos = await replica.lectura(db_evento).asincrona.obtener_cupos()
+        if cupos:
+            bloques.append(ESTADISTICAS_CUPOS.render())
+            for bono, (capacidad, disponibles) in cupos.items():
+                bloques.append(CUPO_FILA.render(bono=bono, estado=formatear_cupo(capacidad, disponibles)))
         
-        await update.message.reply_text(mensaje)
+        bloques.append(LEYENDA.render(leyenda=replica.leyenda()))
+        
+        await responder(update, bloques, archivo='estadisticas.txt')
         
     except Exception as e:
         logger.error(f"Error obteniendo estadísticas: {e}")
         await update.message.reply_text('❌ Error al obtener estadísticas.')
 
+@permisos.requiere('viewer')
+async def ver_grafica(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Envía la gráfica de registros por día y monto por bono"""
+    db_evento = await db_del_chat(update)
+    try:
+        # Si los datos no cambiaron, se reenvía la imagen ya subida a Telegram
+        version = await db_evento.asincrona.ultimo_cambio()
+        file_id, _ = cache_archivos.obtener(f'grafica_{db_evento.evento_id}', version)
+        
+        if file_id:
+            await update.message.reply_photo(file_id, caption='📊 Registros por día y monto por bono')
+            return
+        
+        png = await generar_grafica(db_evento)
+        
+        if png is None:
+            await update.message.reply_text('📭 No hay datos en la base de datos.')
+            return
+        
+        mensaje = await update.message.reply_photo(png, caption='📊 Registros por día y monto por bono')
+        cache_archivos.guardar(f'grafica_{db_evento.evento_id}', version, mensaje.photo[-1].file_id)
+        
+    except Exception as e:
+        logger.error(f"Error generando gráfica: {e}")
+        await update.message.reply_text('❌ Error al generar la gráfica.')
+
+@permisos.requiere('viewer')
+async def ver_analisis(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Muestra promedios, percentiles y los principales grupos por guía, bono, día u hora"""
+    db_evento = await db_del_chat(update)
+    analitica = analitica_del_evento(db_evento)
+    try:
+        # Leer y agrupar consulta la base: se hace fuera del event loop
+        loop = asyncio.get_running_loop()
+        resumen = await loop.run_in_executor(None, analitica.resumen)
+        
+        if not resumen:
+            await update.message.reply_text('📭 No hay datos en la base de datos.')
+            return
+        
+        dimensiones = [context.args[0].lower()] if context.args else ['guia', 'bono', 'dia', 'hora']
+        if dimensiones[0] not in DIMENSIONES:
+            await update.message.reply_text(f'❌ Usa /analisis [{" | ".join(DIMENSIONES)}]')
+            return
+        
+        bloques = [ANALISIS_RESUMEN.render(
+            r=resumen, m=resumen['monto_percentiles'], a=resumen['asistentes_percentiles']
+        )]
+        
+        titulos = {'guia': '👤 Por guía', 'bono': '🎫 Por bono', 'grupo': '🏷️ Por grupo',
+                   'dia': '📅 Por día', 'hora': '🕐 Por hora'}
+        for dimension in dimensiones:
+            # Días y horas se listan en orden cronológico; el resto, los 5 con más monto
+            if dimension in ('dia', 'hora'):
+                grupos = await loop.run_in_executor(None, lambda: analitica.agrupar(dimension, orden=None))
+            else:
+                grupos = await loop.run_in_executor(
+                    None, lambda: analitica.agrupar(dimension, top=5 if len(dimensiones) > 1 else 15)
+                )
+            bloques.append(ANALISIS_TITULO.render(titulo=titulos[dimension]))
+            bloques.extend(ANALISIS_GRUPO.lineas('g', grupos))
+        
+        await responder(update, bloques, archivo='analisis.txt')
+        
+    except Exception as e:
+        logger.error(f"Error en análisis: {e}")
+        await update.message.reply_text('❌ Error al calcular el análisis.')
+
+@permisos.requiere('viewer')
 async def buscar_grupo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Busca registros por nombre de grupo"""
+    db_evento = await db_del_chat(update)
     try:
         if not context.args:
-            await update.message.reply_text(
-                '🔍 **BUSCAR GRUPO**\n\n'
-                'Uso: /buscar <nombre_del_grupo>\n\n'
-                'Ejemplo: /buscar juvenil'
-            )
+            await responder(update, BUSCAR_USO.render())
             return
         
         termino_busqueda = ' '.join(context.args)
-        registros = db.buscar_registros_por_grupo(termino_busqueda)
+        registros = await db_evento.asincrona.buscar_registros_por_grupo(termino_busqueda)
         
         if not registros:
             await update.message.reply_text(f'🔍 No se encontraron registros para: "{termino_busqueda}"')
             return
         
-        mensaje = f'🔍 **RESULTADOS PARA: "{termino_busqueda}"**\n\n'
-        for registro in registros[:15]:  # Limitar a 15 resultados
-            id_reg, grupo, guia, bono, monto, asistentes, fecha = registro
-            fecha_simple = fecha.split()[0] if isinstance(fecha, str) else str(fecha)[:10]
-            mensaje += f"🆔 **#{id_reg}** - {grupo}\n"
-            mensaje += f"   👤 {guia} | 🎫 {bono}\n"
-            mensaje += f"   👥 {asistentes} | 💰 ${float(monto):,.2f}\n"
-            mensaje += f"   📅 {fecha_simple}\n\n"
+        # Todos los resultados; si no caben en unos pocos mensajes se envían como archivo
+        bloques = [RESULTADOS_CABECERA.render(termino=termino_busqueda)]
+        bloques.extend(REGISTRO_FILA.lineas('registro', registros))
         
-        if len(registros) > 15:
-            mensaje += f"📝 ... y {len(registros) - 15} registros más.\n"
-            mensaje += "💡 Usa /reporte para ver todos los registros."
-        
-        await update.message.reply_text(mensaje)
+        await responder(update, bloques, archivo='busqueda.txt')
         
     except Exception as e:
         logger.error(f"Error en búsqueda: {e}")
         await update.message.reply_text('❌ Error en la búsqueda.')
 
+@permisos.requiere('admin')
 async def limpiar_base_datos(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Limpia toda la base de datos (solo para administradores)"""
+    db_evento = await db_del_chat(update)
     keyboard = [
         [
             InlineKeyboardButton("✅ Sí, limpiar TODO", callback_data="confirmar_limpiar"),
@@ -511,31 +1275,22 @@ async def limpiar_base_datos(update: Update, context: ContextTypes.DEFAULT_TYPE)
     
     reply_markup = InlineKeyboardMarkup(keyboard)
     
-    stats = db.obtener_estadisticas()
+    stats = await db_evento.asincrona.obtener_estadisticas()
     
-    await update.message.reply_text(
-        f'🚨 **LIMPIAR BASE DE DATOS**\n\n'
-        f'📊 **Estadísticas actuales:**\n'
-        f'• Registros: {stats["total_registros"]}\n'
-        f'• Asistentes: {stats["total_asistentes"]}\n\n'
-        '⚠️ **¿Estás seguro de que quieres eliminar TODOS los registros?**\n\n'
-        '🚫 **Esta acción es IRREVERSIBLE y eliminará toda la información.**',
-        reply_markup=reply_markup
-    )
+    await responder(update, CONFIRMAR_LIMPIAR.render(stats=stats, minutos=MINUTOS_DESHACER), reply_markup=reply_markup)
 
+@permisos.requiere('admin')
+@por_chat
 async def handle_limpiar_base_datos(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Maneja la confirmación de limpieza de base de datos"""
+    db_evento = await db_del_chat(update)
     query = update.callback_query
     await query.answer()
     
     if query.data == "confirmar_limpiar":
-        registros_eliminados = db.limpiar_registros()
+        registros_eliminados = await db_evento.asincrona.limpiar_registros(usuario=update.effective_user.id)
         
-        await query.edit_message_text(
-            f'🗑️ **BASE DE DATOS LIMPIADA**\n\n'
-            f'• 📊 **Registros eliminados:** {registros_eliminados}\n\n'
-            '✅ La base de datos ha sido reiniciada completamente.'
-        )
+        await responder(update, BASE_LIMPIADA.render(cantidad=registros_eliminados, minutos=MINUTOS_DESHACER))
     
     elif query.data == "cancelar_limpiar":
         await query.edit_message_text('❌ Limpieza cancelada. La base de datos permanece intacta.')
@@ -550,11 +1305,19 @@ def setup_handlers(application):
         states={
             GRUPO: [MessageHandler(filters.TEXT & ~filters.COMMAND, capturar_grupo)],
             GUIA: [MessageHandler(filters.TEXT & ~filters.COMMAND, capturar_guia)],
-            BONO: [MessageHandler(filters.TEXT & ~filters.COMMAND, capturar_bono)],
+            BONO: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, capturar_bono),
+                CallbackQueryHandler(elegir_bono, pattern=r'^bono_(sugerido_\d+|nuevo)$'),
+            ],
             MONTO: [MessageHandler(filters.TEXT & ~filters.COMMAND, capturar_monto)],
             ASISTENTES: [MessageHandler(filters.TEXT & ~filters.COMMAND, capturar_asistentes)],
         },
         fallbacks=[CommandHandler('cancel', cancelar)],
+        # Estado por (chat, usuario); el orden de sus pasos lo garantiza ProcesadorOrdenado
+        per_chat=True,
+        per_user=True,
+        per_message=False,
+        block=True,
     )
     
     # Handler para eliminación por ID
@@ -564,18 +1327,40 @@ def setup_handlers(application):
             ELIMINAR_BONO: [MessageHandler(filters.TEXT & ~filters.COMMAND, eliminar_por_id)],
         },
         fallbacks=[CommandHandler('cancel', cancelar)],
+        # Estado por (chat, usuario); el orden de sus pasos lo garantiza ProcesadorOrdenado
+        per_chat=True,
+        per_user=True,
+        per_message=False,
+        block=True,
     )
     
+    # Antes que cualquier otro handler: límite por usuario y descarte de duplicados
+    application.add_handler(TypeHandler(Update, antiabuso.filtrar), group=-1)
+    
     # Handlers principales
     application.add_handler(conv_captura)
     application.add_handler(conv_eliminacion)
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("ayuda", ayuda))
+    application.add_handler(InlineQueryHandler(autocompletar))
     application.add_handler(CommandHandler("reporte", generar_reporte))
     application.add_handler(CommandHandler("estadisticas", ver_estadisticas))
+    application.add_handler(CommandHandler("analisis", ver_analisis))
+    application.add_handler(CommandHandler("grafica", ver_grafica))
     application.add_handler(CommandHandler("buscar", buscar_grupo))
     application.add_handler(CommandHandler("limpiar", limpiar_base_datos))
     application.add_handler(CommandHandler("eliminar", eliminar_registro))
+    application.add_handler(CommandHandler("deshacer", deshacer))
+    application.add_handler(CommandHandler("otorgar", otorgar))
+    application.add_handler(CommandHandler("cupo", cupo))
+    application.add_handler(CommandHandler("evento", cambiar_evento))
+    application.add_handler(CommandHandler("archivar", archivar_evento))
+    application.add_handler(CommandHandler("respaldo", respaldo))
+    application.add_handler(CommandHandler("duplicados", ver_duplicados))
+    application.add_handler(CommandHandler("checkin", modo_checkin))
+    application.add_handler(CommandHandler("suscribir", suscribir))
+    application.add_handler(CommandHandler("desuscribir", desuscribir))
+    application.add_handler(MessageHandler((filters.PHOTO | filters.TEXT) & ~filters.COMMAND, escanear_boleto))
     
     # Handlers para callbacks
     application.add_handler(CallbackQueryHandler(handle_eliminar_opcion, pattern='^(eliminar_bono|eliminar_id|ver_registros|volver_eliminar)$'))
@@ -589,28 +1374,26 @@ def setup_handlers(application):
 def run_bot():
     """Función principal para ejecutar el bot"""
     if BOT_TOKEN == 'TU_TOKEN_AQUI':
-        print("❌ ERROR: Configura tu BOT_TOKEN en config.py")
-        print("💡 Obtén tu token de @BotFather en Telegram")
+        logger.error("Configura tu BOT_TOKEN en config.py (obtén uno de @BotFather en Telegram)")
         return
     
     try:
-        # Crear aplicación de Telegram
-        application = Application.builder().token(BOT_TOKEN).build()
+        # Crear aplicación de Telegram: usuarios en paralelo, cada uno en orden
+        application = Application.builder().token(BOT_TOKEN).concurrent_updates(ProcesadorOrdenado()).build()
         
         # Configurar handlers
         setup_handlers(application)
         
-        print("🤖 Bot del Congreso 2026 iniciado correctamente!")
-        print("✅ Sistema con eliminación de registros")
-        print("📊 Base de datos SQLite integrada")
-        print("🌐 Servidor web activo en puerto 8080")
-        print("💬 Envía /start a tu bot en Telegram")
+        # Resúmenes de cada hora y de cierre del día para los chats suscritos
+        programar_resumenes(application)
+        
+        logger.info("Bot del Congreso 2026 iniciado", extra={'backend': 'postgresql' if DATABASE_URL else 'sqlite', 'puerto_web': 8080})
         
         # Iniciar el bot
         application.run_polling()
         
     except Exception as e:
-        print(f"❌ Error al iniciar el bot: {e}")
+        logger.error(f"Error al iniciar el bot: {e}", exc_info=True)
 
 def run_web_server():
     """Ejecuta el servidor web en un hilo separado"""
@@ -619,13 +1402,18 @@ def run_web_server():
 if __name__ == '__main__':
     import threading
     
-    print("🚀 Iniciando Sistema del Congreso 2026...")
-    print("📁 Ruta:", os.getcwd())
-    print("🗄️ Base de datos: congreso_2026.db")
+    logger.info("Iniciando Sistema del Congreso 2026", extra={'ruta': os.getcwd(), 'base_datos': db.descripcion()})
     
     # Iniciar servidor web en hilo separado
     web_thread = threading.Thread(target=run_web_server, daemon=True)
     web_thread.start()
     
+    # Compactar eliminaciones vencidas en horas de baja actividad
+    db.iniciar_compactador()
+    replica.iniciar()
+    respaldos.iniciar()
+    if boletos is not None:
+        boletos.iniciar()
+    
     # Iniciar bot (bloqueante)
     run_bot()
@@ -0,0 +1,32 @@
+import threading
+
+class CacheArchivos:
+    """Recuerda el file_id de Telegram de cada archivo generado por versión de datos
+
+    Telegram permite reenviar un archivo ya subido usando solo su file_id, así que
+    mientras la versión de los datos no cambie no hace falta volver a subir bytes.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._archivos = {}
+        self.aciertos = 0
+        self.fallos = 0
+    
+    def obtener(self, clave, version):
+        """Devuelve (file_id, caption) de la clave si corresponde a la versión actual
+
+        Si no hay archivo para esa versión devuelve (None, None).
+        """
+        with self._lock:
+            guardado = self._archivos.get(clave)
+            if guardado and guardado[0] == version:
+                self.aciertos += 1
+                return guardado[1], guardado[2]
+            self.fallos += 1
+            return None, None
+    
+    def guardar(self, clave, version, file_id, caption=None):
+        """Guarda el file_id (y su caption) de la clave para la versión indicada"""
+        with self._lock:
+            self._archivos[clave] = (version, file_id, caption)
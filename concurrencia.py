@@ -0,0 +1,152 @@
+import os
+import time
+import asyncio
+import logging
+from functools import wraps
+from contextlib import asynccontextmanager
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from bitacora import iniciar_contexto, cerrar_contexto
+
+logger = logging.getLogger(__name__)
+
+# Handlers ejecutándose a la vez, entre todos los usuarios
+TRABAJADORES = int(os.environ.get('TRABAJADORES', '16'))
+
+# Actualizaciones admitidas a la vez (en ejecución o esperando su turno); más allá se encolan en PTB
+ACTUALIZACIONES_EN_VUELO = int(os.environ.get('ACTUALIZACIONES_EN_VUELO', '256'))
+
+# Actualizaciones de un mismo usuario en cola (incluida la que se ejecuta); las que pasen se descartan
+EN_COLA_POR_USUARIO = int(os.environ.get('EN_COLA_POR_USUARIO', '20'))
+
+# Milisegundos de handler a partir de los cuales una actualización se registra como lenta
+UMBRAL_LENTO_MS = float(os.environ.get('UMBRAL_LENTO_MS', '1000'))
+
+class Candados:
+    """Un asyncio.Lock por clave, que se descarta cuando ya nadie lo usa o lo espera
+
+    asyncio.Lock despierta a quienes esperan en orden de llegada, así que las
+    actualizaciones de una misma clave se atienden en el orden en que llegaron.
+    """
+    
+    def __init__(self):
+        self._candados = {}
+    
+    @asynccontextmanager
+    async def de(self, clave):
+        """Contexto que retiene el candado de la clave"""
+        entrada = self._candados.get(clave)
+        if entrada is None:
+            entrada = self._candados[clave] = [asyncio.Lock(), 0]
+        entrada[1] += 1
+        try:
+            async with entrada[0]:
+                yield
+        finally:
+            entrada[1] -= 1
+            if not entrada[1]:
+                del self._candados[clave]
+    
+    def en_uso(self, clave):
+        """Cuántos retienen o esperan el candado de la clave"""
+        entrada = self._candados.get(clave)
+        return entrada[1] if entrada else 0
+    
+    def __len__(self):
+        return len(self._candados)
+
+def clave_usuario(update):
+    """Clave de orden de una actualización: el usuario, o el chat si no hay usuario"""
+    if not isinstance(update, Update):
+        return None
+    if update.effective_user:
+        return ('usuario', update.effective_user.id)
+    if update.effective_chat:
+        return ('chat', update.effective_chat.id)
+    return None
+
+class ProcesadorOrdenado(BaseUpdateProcessor):
+    """Procesa actualizaciones en paralelo con tope de trabajadores y orden estricto por usuario
+
+    Usuarios distintos avanzan a la vez (un /reporte lento ya no frena a nadie más),
+    pero las actualizaciones de un mismo usuario se ejecutan una tras otra y en orden,
+    así un ConversationHandler nunca ve el paso 3 antes que el 2. Las que esperan su
+    turno no ocupan trabajador: primero se toma el candado del usuario y después el cupo.
+    
+    Sí ocupan uno de los lugares en vuelo, así que cada usuario puede tener como
+    mucho ``por_usuario`` en cola: la ráfaga de uno solo no deja sin lugar a los demás.
+    """
+    
+    def __init__(self, trabajadores=TRABAJADORES, en_vuelo=ACTUALIZACIONES_EN_VUELO, por_usuario=EN_COLA_POR_USUARIO):
+        super().__init__(max(en_vuelo, trabajadores))
+        self.trabajadores = trabajadores
+        self.por_usuario = por_usuario
+        self.descartadas = 0
+        self.candados = Candados()
+        self._cupos = asyncio.BoundedSemaphore(trabajadores)
+    
+    async def do_process_update(self, update, coroutine):
+        # Cada actualización corre en su propia tarea: el contexto de log no se mezcla entre usuarios
+        token = iniciar_contexto(update)
+        llegada = time.perf_counter()
+        try:
+            clave = clave_usuario(update)
+            if clave is None:
+                async with self._cupos:
+                    await self._medir(coroutine, llegada)
+                return
+            
+            if self.candados.en_uso(clave) >= self.por_usuario:
+                coroutine.close()
+                self.descartadas += 1
+                logger.warning("Actualización descartada: el usuario ya tiene demasiadas en cola",
+                               extra={'en_cola': self.por_usuario})
+                return
+            
+            async with self.candados.de(clave):
+                async with self._cupos:
+                    await self._medir(coroutine, llegada)
+        finally:
+            cerrar_contexto(token)
+    
+    async def _medir(self, coroutine, llegada):
+        """Ejecuta el handler y registra su duración y la espera por su turno
+
+        Cada actualización queda en DEBUG (muestreado); las lentas, siempre en WARNING.
+        """
+        inicio = time.perf_counter()
+        try:
+            await coroutine
+        finally:
+            duracion = (time.perf_counter() - inicio) * 1000
+            lenta = duracion >= UMBRAL_LENTO_MS
+            logger.log(
+                logging.WARNING if lenta else logging.DEBUG,
+                'Actualización lenta' if lenta else 'Actualización procesada',
+                extra={'duracion_ms': round(duracion, 1), 'espera_ms': round((inicio - llegada) * 1000, 1)}
+            )
+    
+    async def initialize(self):
+        logger.info(f"Procesando actualizaciones en paralelo: {self.trabajadores} trabajadores")
+    
+    async def shutdown(self):
+        pass
+
+# Candados por chat para los pasos de flujos de varios mensajes que modifican datos del chat
+candados_chat = Candados()
+
+def por_chat(handler):
+    """Decorador de handlers: un solo flujo de confirmación/modificación por chat a la vez
+
+    El orden por usuario ya lo garantiza ProcesadorOrdenado; esto evita que dos
+    usuarios del mismo grupo confirmen a la vez operaciones sobre el mismo evento.
+    """
+    @wraps(handler)
+    async def envoltura(update, context):
+        if update.effective_chat is None:
+            return await handler(update, context)
+        async with candados_chat.de(update.effective_chat.id):
+            return await handler(update, context)
+    return envoltura
@@ -5,89 +5,112 @@ from telegram import Update
 from telegram.ext import Application, CommandHandler, MessageHandler, ConversationHandler, ContextTypes
 from telegram.ext import filters
 
+from mensajes import Plantilla, responder
+from almacen_memoria import AlmacenMemoria, CAMPOS
+from bitacora import configurar_logging
+
 # Configuración de estados para la conversación
 GRUPO, GUIA, BONO, MONTO, ASISTENTES = range(5)
 
-# Estructura para almacenar los datos (en memoria)
-datos = []
+# Estructura para almacenar los datos (en memoria, con bitácora e instantáneas en disco)
+datos = AlmacenMemoria()
 
-# Configurar logging
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+# Logging en JSON a través de una cola: los handlers nunca esperan a que se escriba
+configurar_logging()
 logger = logging.getLogger(__name__)
 
+# Plantillas de mensajes (se compilan una vez; los valores se escapan al renderizar)
+INICIO = Plantilla(
+    '¡Hola {nombre}! 🤖\n'
+    'Vamos a capturar datos para el Congreso 2026.\n\n'
+    'Por favor, ingresa el **NOMBRE DEL GRUPO**:\n'
+    '(Envía /cancel en cualquier momento para cancelar)'
+)
+CAMPO_GUARDADO = Plantilla('✅ **{campo}** guardado.\n\n{indicacion} **{siguiente}**:')
+REGISTRO_COMPLETADO = Plantilla(
+    '🎉 **REGISTRO COMPLETADO!** ✅\n\n'
+    '¿Qué deseas hacer ahora?\n\n'
+    '📝 /nuevo - Agregar otro registro\n'
+    '📊 /reporte - Generar reporte CSV\n'
+    '👀 /ver - Ver datos capturados\n'
+    '📈 /estadisticas - Ver estadísticas\n'
+    '🗑️ /limpiar - Limpiar todos los datos\n'
+    '❌ /cancel - Salir'
+)
+CAPTION_REPORTE = Plantilla('📊 **Reporte del Congreso 2026**\nFormato CSV listo para descargar')
+DATOS_CABECERA = Plantilla('📋 **DATOS CAPTURADOS:**\n\n')
+DATOS_REGISTRO = Plantilla(
+    '**Registro {i}:**\n'
+    '• 🏷️ **GRUPO:** {registro.GRUPO}\n'
+    '• 👤 **GUÍA:** {registro.GUIA}\n'
+    '• 🎫 **BONO:** {registro.BONO}\n'
+    '• 💰 **MONTO:** {registro.MONTO}\n'
+    '• 👥 **ASISTENTES:** {registro.ASISTENTES}\n\n'
+)
+ESTADISTICAS = Plantilla(
+    '📈 **ESTADÍSTICAS**\n\n'
+    '📊 **Total de registros:** {total_registros}\n'
+    '👥 **Total de asistentes:** {total_asistentes}\n'
+    '📅 **Última actualización:** Ahora'
+)
+DATOS_LIMPIADOS = Plantilla('🗑️ **{cantidad} registros** han sido eliminados.')
+AYUDA = Plantilla(
+    '🤖 **BOT DEL CONGRESO 2026**\n\n'
+    '**Comandos disponibles:**\n\n'
+    '🚀 /start o /nuevo - Iniciar captura de datos\n'
+    '📊 /reporte - Generar reporte CSV\n'
+    '👀 /ver - Ver datos capturados\n'
+    '📈 /estadisticas - Ver estadísticas\n'
+    '🗑️ /limpiar - Limpiar todos los datos\n'
+    'ℹ️ /ayuda - Mostrar esta ayuda\n'
+    '❌ /cancel - Cancelar operación actual\n\n'
+    '**Formato CSV:** GRUPO, GUIA, BONO, MONTO, ASISTENTES'
+)
+
 # Comando de inicio
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     user = update.message.from_user
-    await update.message.reply_text(
-        f'¡Hola {user.first_name}! 🤖\n'
-        'Vamos a capturar datos para el Congreso 2026.\n\n'
-        'Por favor, ingresa el **NOMBRE DEL GRUPO**:\n'
-        '_(Envía /cancel en cualquier momento para cancelar)_'
-    )
+    await responder(update, INICIO.render(nombre=user.first_name))
     return GRUPO
 
 # Captura del GRUPO
 async def capturar_grupo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     context.user_data['grupo'] = update.message.text
-    await update.message.reply_text(
-        '✅ **GRUPO** guardado.\n\n'
-        'Ahora ingresa el **NOMBRE DEL GUÍA**:'
-    )
+    await responder(update, CAMPO_GUARDADO.render(campo='GRUPO', indicacion='Ahora ingresa el', siguiente='NOMBRE DEL GUÍA'))
     return GUIA
 
 # Captura del GUÍA
 async def capturar_guia(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     context.user_data['guia'] = update.message.text
-    await update.message.reply_text(
-        '✅ **GUÍA** guardado.\n\n'
-        'Ahora ingresa el **TIPO DE BONO**:'
-    )
+    await responder(update, CAMPO_GUARDADO.render(campo='GUÍA', indicacion='Ahora ingresa el', siguiente='TIPO DE BONO'))
     return BONO
 
 # Captura del BONO
 async def capturar_bono(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     context.user_data['bono'] = update.message.text
-    await update.message.reply_text(
-        '✅ **BONO** guardado.\n\n'
-        'Ahora ingresa el **MONTO**:'
-    )
+    await responder(update, CAMPO_GUARDADO.render(campo='BONO', indicacion='Ahora ingresa el', siguiente='MONTO'))
     return MONTO
 
 # Captura del MONTO
 async def capturar_monto(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     context.user_data['monto'] = update.message.text
-    await update.message.reply_text(
-        '✅ **MONTO** guardado.\n\n'
-        'Último paso! Ingresa el **NÚMERO DE ASISTENTES**:'
-    )
+    await responder(update, CAMPO_GUARDADO.render(campo='MONTO', indicacion='Último paso! Ingresa el', siguiente='NÚMERO DE ASISTENTES'))
     return ASISTENTES
 
 # Captura de ASISTENTES y almacenamiento
 async def capturar_asistentes(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     context.user_data['asistentes'] = update.message.text
     
-    # Guardar en la estructura de datos
-    datos.append({
-        'GRUPO': context.user_data['grupo'],
-        'GUIA': context.user_data['guia'],
-        'BONO': context.user_data['bono'],
-        'MONTO': context.user_data['monto'],
-        'ASISTENTES': context.user_data['asistentes']
-    })
-    
-    await update.message.reply_text(
-        '🎉 **REGISTRO COMPLETADO!** ✅\n\n'
-        '¿Qué deseas hacer ahora?\n\n'
-        '📝 /nuevo - Agregar otro registro\n'
-        '📊 /reporte - Generar reporte CSV\n'
-        '👀 /ver - Ver datos capturados\n'
-        '📈 /estadisticas - Ver estadísticas\n'
-        '🗑️ /limpiar - Limpiar todos los datos\n'
-        '❌ /cancel - Salir'
+    # Guardar en la estructura de datos (queda en la bitácora antes de confirmar)
+    datos.agregar(
+        context.user_data['grupo'],
+        context.user_data['guia'],
+        context.user_data['bono'],
+        context.user_data['monto'],
+        context.user_data['asistentes']
     )
+    
+    await responder(update, REGISTRO_COMPLETADO.render())
     return ConversationHandler.END
 
 # Generar reporte CSV
@@ -99,19 +122,17 @@ async def generar_reporte(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     filename = 'reporte_congreso_2026.csv'
     try:
         with open(filename, 'w', newline='', encoding='utf-8') as csvfile:
-            fieldnames = ['GRUPO', 'GUIA', 'BONO', 'MONTO', 'ASISTENTES']
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+            writer = csv.writer(csvfile)
             
-            writer.writeheader()
-            for registro in datos:
-                writer.writerow(registro)
+            writer.writerow(CAMPOS)
+            writer.writerows(datos.filas())
         
         with open(filename, 'rb') as csvfile:
             await update.message.reply_document(
                 document=csvfile,
                 filename=filename,
-                caption='📊 **Reporte del Congreso 2026**\n'
-                       'Formato CSV listo para descargar'
+                caption=CAPTION_REPORTE.render(),
+                parse_mode=CAPTION_REPORTE.parse_mode
             )
     except Exception as e:
         await update.message.reply_text(f'❌ Error al generar el reporte: {str(e)}')
@@ -122,16 +143,11 @@ async def ver_datos(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         await update.message.reply_text('📭 No hay datos registrados aún.')
         return
     
-    mensaje = "📋 **DATOS CAPTURADOS:**\n\n"
-    for i, registro in enumerate(datos, 1):
-        mensaje += f"**Registro {i}:**\n"
-        mensaje += f"• 🏷️ **GRUPO:** {registro['GRUPO']}\n"
-        mensaje += f"• 👤 **GUÍA:** {registro['GUIA']}\n"
-        mensaje += f"• 🎫 **BONO:** {registro['BONO']}\n"
-        mensaje += f"• 💰 **MONTO:** {registro['MONTO']}\n"
-        mensaje += f"• 👥 **ASISTENTES:** {registro['ASISTENTES']}\n\n"
+    # Un bloque por registro; responder los reparte en mensajes de hasta 4096 caracteres
+    bloques = [DATOS_CABECERA.render()]
+    bloques.extend(DATOS_REGISTRO.render(i=i, registro=registro) for i, registro in enumerate(datos.filas(), 1))
     
-    await update.message.reply_text(mensaje)
+    await responder(update, bloques, archivo='datos_capturados.txt')
 
 # Estadísticas
 async def estadisticas(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -139,27 +155,22 @@ async def estadisticas(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         await update.message.reply_text('📭 No hay datos registrados aún.')
         return
     
-    try:
-        total_asistentes = sum(int(registro['ASISTENTES']) for registro in datos)
-        total_registros = len(datos)
-        
-        mensaje = (
-            "📈 **ESTADÍSTICAS**\n\n"
-            f"📊 **Total de registros:** {total_registros}\n"
-            f"👥 **Total de asistentes:** {total_asistentes}\n"
-            f"📅 **Última actualización:** Ahora"
+    # Totales llevados al día en cada alta; no se recorren los registros
+    stats = datos.estadisticas()
+    if stats['asistentes_invalidos']:
+        await update.message.reply_text(
+            f"❌ Error al calcular estadísticas: {stats['asistentes_invalidos']} registros tienen ASISTENTES no numérico"
         )
-        
-        await update.message.reply_text(mensaje)
-    except Exception as e:
-        await update.message.reply_text(f'❌ Error al calcular estadísticas: {str(e)}')
+        return
+    
+    await responder(update, ESTADISTICAS.render(
+        total_registros=stats['total_registros'], total_asistentes=stats['total_asistentes']
+    ))
 
 # Limpiar datos
 async def limpiar_datos(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    global datos
-    datos_count = len(datos)
-    datos = []
-    await update.message.reply_text(f'🗑️ **{datos_count} registros** han sido eliminados.')
+    datos_count = datos.limpiar()
+    await responder(update, DATOS_LIMPIADOS.render(cantidad=datos_count))
 
 # Cancelar proceso
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -172,19 +183,7 @@ async def nuevo_registro(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
 # Comando de ayuda
 async def ayuda(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    mensaje = (
-        "🤖 **BOT DEL CONGRESO 2026**\n\n"
-        "**Comandos disponibles:**\n\n"
-        "🚀 /start o /nuevo - Iniciar captura de datos\n"
-        "📊 /reporte - Generar reporte CSV\n"
-        "👀 /ver - Ver datos capturados\n"
-        "📈 /estadisticas - Ver estadísticas\n"
-        "🗑️ /limpiar - Limpiar todos los datos\n"
-        "ℹ️ /ayuda - Mostrar esta ayuda\n"
-        "❌ /cancel - Cancelar operación actual\n\n"
-        "**Formato CSV:** GRUPO, GUIA, BONO, MONTO, ASISTENTES"
-    )
-    await update.message.reply_text(mensaje)
+    await responder(update, AYUDA.render())
 
 # Manejo de errores
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -194,9 +193,7 @@ def main() -> None:
     # Obtener token desde variable de entorno
     TOKEN = os.getenv('BOT_TOKEN')
     if not TOKEN:
-        logger.error("❌ No se encontró BOT_TOKEN en las variables de entorno")
-        print("❌ ERROR: No se configuró BOT_TOKEN")
-        print("💡 Configura la variable de entorno BOT_TOKEN en Railway")
+        logger.error("No se encontró BOT_TOKEN: configura la variable de entorno en Railway")
         return
     
     # Crear application
@@ -231,9 +228,11 @@ def main() -> None:
     application.add_error_handler(error_handler)
 
     # Iniciar el bot
-    logger.info("🤖 Bot del Congreso 2026 iniciado correctamente")
-    print("🚀 Bot iniciado - Esperando mensajes...")
+    logger.info("Bot del Congreso 2026 iniciado, esperando mensajes")
     application.run_polling()
+    
+    # Compactar la bitácora al salir para que el próximo arranque solo lea la instantánea
+    datos.cerrar()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -1,78 +1,611 @@
+import os
+import re
+import json
+import asyncio
+import time
+import copy
+import hashlib
 import sqlite3
 import logging
+import threading
+import functools
 from datetime import datetime
+from collections import OrderedDict
+from urllib.request import pathname2url
+
+from modelo import Registro
+from bonos import clave_bono, IndiceBonos
 
 logger = logging.getLogger(__name__)
 
+# Minutos durante los que /deshacer puede restaurar una eliminación
+MINUTOS_DESHACER = int(os.environ.get('MINUTOS_DESHACER', '10'))
+
+# Horas (UTC) consideradas de baja actividad para compactar la base de datos
+HORAS_COMPACTACION = [int(h) for h in os.environ.get('HORAS_COMPACTACION', '3,4,5').split(',')]
+
+# Evento al que pertenecen los registros creados antes de existir los eventos
+EVENTO_POR_DEFECTO = 1
+
+# Columnas de un registro tal como se devuelven y se guardan en el historial
+COLUMNAS_REGISTRO = ('id', 'grupo', 'guia', 'bono', 'monto', 'asistentes', 'fecha_creacion')
+
+# Clave de caché del índice del catálogo de bonos (común a todos los eventos)
+CLAVE_INDICE_BONOS = ('indice_bonos',)
+
+# DSN de PostgreSQL; si está definido se usa en lugar del archivo SQLite
+DATABASE_URL = os.environ.get('DATABASE_URL', '')
+
+# Tamaño y vigencia (segundos) de la caché de lecturas de Database
+CACHE_TAMANO = int(os.environ.get('CACHE_TAMANO', '1024'))
+CACHE_TTL = int(os.environ.get('CACHE_TTL', '300'))
+
+def normalizar_texto(texto):
+    """Normaliza texto libre para comparar: sin mayúsculas ni espacios sobrantes"""
+    return re.sub(r'\s+', ' ', str(texto)).strip().casefold()
+
+def clave_idempotencia(chat_id, message_id, grupo, guia, bono, monto, asistentes):
+    """Clave que identifica un mismo registro enviado desde el mismo mensaje
+
+    Si el handler se ejecuta dos veces para el mismo mensaje y los mismos datos,
+    la clave es la misma y la base de datos no inserta un segundo registro.
+    """
+    datos = '|'.join([
+        str(chat_id), str(message_id),
+        normalizar_texto(grupo), normalizar_texto(guia), normalizar_texto(bono),
+        f'{float(monto):.2f}', str(int(asistentes))
+    ])
+    return hashlib.sha256(datos.encode('utf-8')).hexdigest()
+
+class CupoAgotado(Exception):
+    """No quedan lugares suficientes en el bono para los asistentes del registro"""
+    
+    def __init__(self, bono, solicitados, disponibles):
+        super().__init__(f'Sin cupo en {bono}: se piden {solicitados} y quedan {max(disponibles, 0)}')
+        self.bono = bono
+        self.solicitados = solicitados
+        self.disponibles = disponibles
+
+class CacheLRU:
+    """Caché LRU con vigencia, segura para usarse desde varios hilos
+
+    Cada invalidación incrementa una generación; un valor leído de la base de
+    datos solo se guarda si no hubo invalidaciones mientras se leía, así una
+    lectura lenta nunca deja en la caché un dato anterior a una escritura.
+    """
+    
+    def __init__(self, tamano=CACHE_TAMANO, ttl=CACHE_TTL):
+        self.tamano = tamano
+        self.ttl = ttl
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+        self.generacion = 0
+        self.aciertos = 0
+        self.fallos = 0
+    
+    def obtener(self, clave):
+        """Devuelve (encontrado, valor)"""
+        with self._lock:
+            entrada = self._datos.get(clave)
+            if entrada is not None and entrada[0] > time.monotonic():
+                self._datos.move_to_end(clave)
+                self.aciertos += 1
+                return True, entrada[1]
+            if entrada is not None:
+                del self._datos[clave]
+            self.fallos += 1
+            return False, None
+    
+    def guardar(self, clave, valor, generacion):
+        """Guarda el valor si no hubo invalidaciones desde la generación indicada"""
+        with self._lock:
+            if generacion != self.generacion:
+                return
+            self._datos[clave] = (time.monotonic() + self.ttl, valor)
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.tamano:
+                self._datos.popitem(last=False)
+    
+    def invalidar(self, claves=None):
+        """Elimina las claves indicadas, o toda la caché si claves es None"""
+        with self._lock:
+            self.generacion += 1
+            if claves is None:
+                self._datos.clear()
+                return
+            for clave in claves:
+                self._datos.pop(clave, None)
+    
+    def estadisticas(self):
+        """Aciertos, fallos, tasa de aciertos y entradas actuales"""
+        with self._lock:
+            consultas = self.aciertos + self.fallos
+            return {
+                'aciertos': self.aciertos,
+                'fallos': self.fallos,
+                'tasa_aciertos': self.aciertos / consultas if consultas else 0.0,
+                'entradas': len(self._datos)
+            }
+
+class Asincrona:
+    """Los métodos de una Database como corrutinas que corren en el pool de hilos del event loop
+
+    Los handlers esperan a la base a través de esta vista: mientras una consulta
+    está en curso el event loop sigue atendiendo a los demás usuarios, y con
+    PostgreSQL varias consultas usan a la vez conexiones distintas del pool.
+    """
+    
+    __slots__ = ('_db',)
+    
+    def __init__(self, db):
+        self._db = db
+    
+    def __getattr__(self, nombre):
+        metodo = getattr(self._db, nombre)
+        
+        async def llamar(*args, **kwargs):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None, functools.partial(metodo, *args, **kwargs))
+        return llamar
+
 class Database:
-    def __init__(self, db_name="congreso_2026.db"):
+    def __init__(self, db_name="congreso_2026.db", evento_id=EVENTO_POR_DEFECTO):
         self.db_name = db_name
+        self.evento_id = evento_id
+        self.cache = CacheLRU()
+        self._eventos_chat = {}
         self.init_db()
     
+    def del_evento(self, evento_id):
+        """Devuelve una vista de la base de datos limitada a un evento
+
+        La vista comparte archivo, caché y estado con esta instancia; solo cambia
+        el evento sobre el que trabajan consultas, estadísticas y escrituras.
+        """
+        if evento_id == self.evento_id:
+            return self
+        vista = copy.copy(self)
+        vista.evento_id = evento_id
+        return vista
+    
+    def descripcion(self):
+        """Qué base se usa, para los logs"""
+        return f'sqlite:{self.db_name}'
+    
+    def _conectar(self):
+        """Abre una conexión al archivo de la base"""
+        return sqlite3.connect(self.db_name)
+    
+    @property
+    def asincrona(self):
+        """Vista awaitable de esta base, para llamarla desde handlers sin bloquear el event loop"""
+        return Asincrona(self)
+    
     def init_db(self):
         """Inicializa la base de datos y crea la tabla si no existe"""
-        conn = sqlite3.connect(self.db_name)
+        conn = self._conectar()
         cursor = conn.cursor()
         
+        # Catálogo de bonos: un nombre canónico y todas las formas de escribirlo (clave normalizada)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS bonos (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                nombre TEXT NOT NULL,
+                fecha_creacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS bonos_alias (
+                alias TEXT PRIMARY KEY,
+                bono_id INTEGER NOT NULL REFERENCES bonos(id)
+            )
+        ''')
+        
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS registros (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 grupo TEXT NOT NULL,
                 guia TEXT NOT NULL,
-                bono TEXT NOT NULL,
+                bono_id INTEGER NOT NULL REFERENCES bonos(id),
                 monto REAL NOT NULL,
                 asistentes INTEGER NOT NULL,
                 fecha_creacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
         ''')
         
+        # Columnas de borrado lógico (bases creadas antes de existir)
+        columnas = [row[1] for row in cursor.execute('PRAGMA table_info(registros)')]
+        if 'eliminado_en' not in columnas:
+            cursor.execute('ALTER TABLE registros ADD COLUMN eliminado_en TIMESTAMP')
+        if 'lote_eliminacion' not in columnas:
+            cursor.execute('ALTER TABLE registros ADD COLUMN lote_eliminacion INTEGER')
+        if 'eliminado_por' not in columnas:
+            cursor.execute('ALTER TABLE registros ADD COLUMN eliminado_por INTEGER')
+        if 'clave_idempotencia' not in columnas:
+            cursor.execute('ALTER TABLE registros ADD COLUMN clave_idempotencia TEXT')
+        if 'evento_id' not in columnas:
+            cursor.execute(f'ALTER TABLE registros ADD COLUMN evento_id INTEGER NOT NULL DEFAULT {EVENTO_POR_DEFECTO}')
+        if 'bono' in columnas:
+            self._migrar_bonos(cursor)
+        
+        # Los registros con el nombre de su bono, para todas las lecturas
+        cursor.execute('''
+            CREATE VIEW IF NOT EXISTS registros_bono AS
+            SELECT r.id, r.evento_id, r.grupo, r.guia, r.bono_id, b.nombre AS bono, r.monto, r.asistentes,
+                   r.fecha_creacion, r.eliminado_en, r.lote_eliminacion, r.clave_idempotencia
+            FROM registros r JOIN bonos b ON b.id = r.bono_id
+        ''')
+        
+        # Cupo de cada bono en cada evento; ``disponibles`` se descuenta al capturar
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS cupos (
+                evento_id INTEGER NOT NULL,
+                bono_id INTEGER NOT NULL REFERENCES bonos(id),
+                capacidad INTEGER NOT NULL,
+                disponibles INTEGER NOT NULL,
+                PRIMARY KEY (evento_id, bono_id)
+            )
+        ''')
+        
+        # Boleto de cada registro (el código se firma con el nonce) y su ingreso en la puerta
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS boletos (
+                registro_id INTEGER PRIMARY KEY,
+                nonce TEXT NOT NULL,
+                emitido_en TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                ingreso_en TIMESTAMP,
+                ingreso_por INTEGER
+            )
+        ''')
+        
+        # Eventos (congresos regionales) y evento actual de cada chat
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS eventos (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                nombre TEXT NOT NULL UNIQUE,
+                archivo TEXT,
+                fecha_creacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cursor.execute(
+            'INSERT OR IGNORE INTO eventos (id, nombre) VALUES (?, ?)',
+            (EVENTO_POR_DEFECTO, 'Congreso 2026')
+        )
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS chats_evento (
+                chat_id INTEGER PRIMARY KEY,
+                evento_id INTEGER NOT NULL
+            )
+        ''')
+        
+        # Una misma captura repetida no puede generar dos registros
+        cursor.execute('''
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_registros_idempotencia
+            ON registros (clave_idempotencia) WHERE clave_idempotencia IS NOT NULL
+        ''')
+        
+        # Índices parciales por evento: las lecturas solo recorren registros activos del evento
+        cursor.execute('DROP INDEX IF EXISTS idx_registros_activos_fecha')
+        cursor.execute('DROP INDEX IF EXISTS idx_registros_activos_bono')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_registros_evento_fecha
+            ON registros (evento_id, fecha_creacion) WHERE eliminado_en IS NULL
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_registros_evento_bono_id
+            ON registros (evento_id, bono_id, fecha_creacion) WHERE eliminado_en IS NULL
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_registros_eliminados
+            ON registros (eliminado_en) WHERE eliminado_en IS NOT NULL
+        ''')
+        
+        # Historial de cambios: solo se insertan filas, nunca se modifican
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS cambios (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                fecha TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                usuario TEXT,
+                operacion TEXT NOT NULL,
+                registro_id INTEGER NOT NULL,
+                antes TEXT,
+                despues TEXT
+            )
+        ''')
+        columnas_cambios = [row[1] for row in cursor.execute('PRAGMA table_info(cambios)')]
+        if 'evento_id' not in columnas_cambios:
+            cursor.execute(f'ALTER TABLE cambios ADD COLUMN evento_id INTEGER NOT NULL DEFAULT {EVENTO_POR_DEFECTO}')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS cambios_sin_update
+            BEFORE UPDATE ON cambios
+            BEGIN SELECT RAISE(ABORT, 'El historial de cambios es de solo inserción'); END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS cambios_sin_delete
+            BEFORE DELETE ON cambios
+            BEGIN SELECT RAISE(ABORT, 'El historial de cambios es de solo inserción'); END
+        ''')
+        
+        # Marcas de agua de las exportaciones incrementales
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS exportaciones (
+                nombre TEXT PRIMARY KEY,
+                ultimo_seq INTEGER NOT NULL,
+                fecha TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        conn.commit()
+        
+        # Roles de acceso (admin, guia, viewer) por usuario de Telegram
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS roles (
+                usuario_id INTEGER PRIMARY KEY,
+                rol TEXT NOT NULL,
+                otorgado_por INTEGER,
+                fecha TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        # Chats suscritos a los resúmenes programados ('hora' o 'dia')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS suscripciones (
+                chat_id INTEGER NOT NULL,
+                frecuencia TEXT NOT NULL,
+                usuario_id INTEGER,
+                fecha TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (chat_id, frecuencia)
+            )
+        ''')
         conn.commit()
+        
+        # Vacuum incremental para que la compactación libere páginas sin bloquear
+        auto_vacuum = cursor.execute('PRAGMA auto_vacuum').fetchone()[0]
+        if auto_vacuum != 2:
+            cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            cursor.execute('VACUUM')
+        
         conn.close()
-        print("✅ Base de datos inicializada")
+        logger.info("Base de datos SQLite inicializada", extra={'base_datos': self.db_name})
     
-    def agregar_registro(self, grupo, guia, bono, monto, asistentes):
-        """Agrega un nuevo registro a la base de datos"""
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
+    def _migrar_bonos(self, cursor):
+        """Pasa la columna de texto ``bono`` al catálogo y deja en registros solo ``bono_id``
+
+        La forma más usada de cada bono queda como nombre canónico; las demás
+        formas con la misma clave normalizada se unen a él.
+        """
+        cursor.execute('ALTER TABLE registros ADD COLUMN bono_id INTEGER REFERENCES bonos(id)')
+        cursor.execute('SELECT bono FROM registros GROUP BY bono ORDER BY COUNT(*) DESC, bono')
+        for (nombre,) in cursor.fetchall():
+            bono_id, _, _ = self._id_bono(cursor, nombre)
+            cursor.execute('UPDATE registros SET bono_id = ? WHERE bono = ?', (bono_id, nombre))
         
+        cursor.execute('DROP INDEX IF EXISTS idx_registros_activos_bono')
+        cursor.execute('DROP INDEX IF EXISTS idx_registros_evento_bono')
+        cursor.execute('ALTER TABLE registros DROP COLUMN bono')
+        cursor.execute('SELECT COUNT(*) FROM bonos')
+        logger.info(f"Bonos migrados al catálogo: {cursor.fetchone()[0]} bonos canónicos")
+    
+    def _id_bono(self, cursor, nombre):
+        """Devuelve (id, nombre canónico, creado) del bono; lo agrega al catálogo si no existe"""
+        clave = clave_bono(nombre)
         cursor.execute('''
-            INSERT INTO registros (grupo, guia, bono, monto, asistentes)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (grupo, guia, bono, float(monto), int(asistentes)))
+            SELECT b.id, b.nombre FROM bonos_alias a JOIN bonos b ON b.id = a.bono_id WHERE a.alias = ?
+        ''', (clave,))
+        fila = cursor.fetchone()
+        if fila:
+            return fila[0], fila[1], False
+        
+        nombre = re.sub(r'\s+', ' ', str(nombre)).strip()
+        cursor.execute('INSERT INTO bonos (nombre) VALUES (?)', (nombre,))
+        bono_id = cursor.lastrowid
+        cursor.execute('INSERT INTO bonos_alias (alias, bono_id) VALUES (?, ?)', (clave, bono_id))
+        return bono_id, nombre, True
+    
+    def obtener_indice_bonos(self):
+        """Índice del catálogo para resolver y sugerir bonos (con caché)"""
+        return self._leer_con_cache(CLAVE_INDICE_BONOS, self._consultar_indice_bonos)
+    
+    def _consultar_indice_bonos(self):
+        """Lee todos los alias del catálogo y arma el índice"""
+        conn = self._conectar()
+        cursor = conn.cursor()
+        
+        cursor.execute('SELECT a.alias, b.id, b.nombre FROM bonos_alias a JOIN bonos b ON b.id = a.bono_id')
+        indice = IndiceBonos(cursor.fetchall())
+        
+        conn.close()
+        return indice
+    
+    def agregar_alias_bono(self, texto, bono_id):
+        """Registra ``texto`` como otra forma de escribir el bono (p. ej. al elegir una sugerencia)"""
+        conn = self._conectar()
+        cursor = conn.cursor()
+        
+        cursor.execute('INSERT OR IGNORE INTO bonos_alias (alias, bono_id) VALUES (?, ?)', (clave_bono(texto), bono_id))
         
         conn.commit()
+        conn.close()
+        self.cache.invalidar([CLAVE_INDICE_BONOS])
+    
+    def _leer_filas(self, cursor, condicion, parametros=()):
+        """Lee registros como diccionarios para guardarlos en el historial"""
+        cursor.execute(f'''
+            SELECT {', '.join(COLUMNAS_REGISTRO)}
+            FROM registros_bono
+            WHERE {condicion}
+        ''', parametros)
+        return [dict(zip(COLUMNAS_REGISTRO, fila)) for fila in cursor.fetchall()]
+    
+    def _registrar_cambio(self, cursor, operacion, registro_id, antes, despues, usuario):
+        """Anota una mutación en el historial dentro de la transacción en curso"""
+        cursor.execute('''
+            INSERT INTO cambios (evento_id, usuario, operacion, registro_id, antes, despues)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (
+            self.evento_id,
+            None if usuario is None else str(usuario),
+            operacion,
+            registro_id,
+            None if antes is None else json.dumps(antes, ensure_ascii=False),
+            None if despues is None else json.dumps(despues, ensure_ascii=False)
+        ))
+    
+    def _leer_con_cache(self, clave, leer):
+        """Devuelve el valor de la caché o lo lee de la base de datos y lo guarda"""
+        encontrado, valor = self.cache.obtener(clave)
+        if encontrado:
+            return valor
+        
+        generacion = self.cache.generacion
+        valor = leer()
+        self.cache.guardar(clave, valor, generacion)
+        return valor
+    
+    def _invalidar_filas(self, filas, *bonos):
+        """Invalida la caché de los registros modificados y de sus bonos"""
+        claves = {('bonos', self.evento_id), ('cupos', self.evento_id)}
+        for fila in filas:
+            claves.add(('registro', self.evento_id, fila['id']))
+            claves.add(('bono', self.evento_id, fila['bono']))
+        for bono in bonos:
+            claves.add(('bono', self.evento_id, bono))
+        self.cache.invalidar(claves)
+    
+    def _reservar_cupo(self, cursor, bono_id, bono, asistentes):
+        """Descuenta los asistentes del cupo del bono, o lanza CupoAgotado si no alcanzan
+
+        El descuento es un UPDATE condicional: comprobar y reservar son un solo paso.
+        Un bono sin fila en ``cupos`` no tiene límite.
+        """
+        cursor.execute('''
+            UPDATE cupos SET disponibles = disponibles - ?
+            WHERE evento_id = ? AND bono_id = ? AND disponibles >= ?
+        ''', (asistentes, self.evento_id, bono_id, asistentes))
+        if cursor.rowcount:
+            return
+        
+        cursor.execute('SELECT disponibles FROM cupos WHERE evento_id = ? AND bono_id = ?', (self.evento_id, bono_id))
+        fila = cursor.fetchone()
+        if fila is not None:
+            raise CupoAgotado(bono, asistentes, fila[0])
+    
+    def _recalcular_cupos(self, cursor):
+        """Vuelve a calcular los lugares disponibles del evento a partir de sus registros activos
+
+        Se usa tras eliminar, restaurar o cambiar de bono, dentro de la misma transacción.
+        """
+        cursor.execute('''
+            UPDATE cupos SET disponibles = capacidad - COALESCE((
+                SELECT SUM(asistentes) FROM registros r
+                WHERE r.evento_id = cupos.evento_id AND r.bono_id = cupos.bono_id AND r.eliminado_en IS NULL
+            ), 0)
+            WHERE evento_id = ?
+        ''', (self.evento_id,))
+    
+    def agregar_registro(self, grupo, guia, bono, monto, asistentes, usuario=None, clave=None):
+        """Agrega un nuevo registro a la base de datos
+
+        Devuelve (id, nuevo). Si se indica una clave de idempotencia que ya existe,
+        no inserta nada y devuelve el ID del registro original con nuevo=False. Si el bono tiene cupo y no alcanza
+        para los asistentes, no inserta nada y lanza CupoAgotado.
+        """
+        conn = self._conectar()
+        cursor = conn.cursor()
+        # Toma el candado de escritura desde el principio: la reserva de cupo y el alta van juntas
+        cursor.execute('BEGIN IMMEDIATE')
+        bono_id, bono, bono_nuevo = self._id_bono(cursor, bono)
+        
+        try:
+            cursor.execute('''
+                INSERT INTO registros (evento_id, grupo, guia, bono_id, monto, asistentes, clave_idempotencia)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (self.evento_id, grupo, guia, bono_id, float(monto), int(asistentes), clave))
+            self._reservar_cupo(cursor, bono_id, bono, int(asistentes))
+        except CupoAgotado:
+            conn.rollback()
+            conn.close()
+            raise
+        except sqlite3.IntegrityError:
+            cursor.execute('SELECT id FROM registros WHERE clave_idempotencia = ?', (clave,))
+            fila = cursor.fetchone()
+            conn.close()
+            if fila is None:
+                raise
+            logger.info(f"Registro repetido (clave {clave[:12]}), se devuelve el #{fila[0]}")
+            return fila[0], False
         registro_id = cursor.lastrowid
+        
+        despues = self._leer_filas(cursor, 'id = ?', (registro_id,))[0]
+        self._registrar_cambio(cursor, 'insertar', registro_id, None, despues, usuario)
+        
+        conn.commit()
         conn.close()
+        self._invalidar_filas([despues])
+        if bono_nuevo:
+            self.cache.invalidar([CLAVE_INDICE_BONOS])
         
-        return registro_id
+        return registro_id, True
     
     def obtener_todos_registros(self):
         """Obtiene todos los registros de la base de datos"""
-        conn = sqlite3.connect(self.db_name)
+        conn = self._conectar()
         cursor = conn.cursor()
+        cursor.row_factory = Registro.desde_fila
         
         cursor.execute('''
             SELECT id, grupo, guia, bono, monto, asistentes, fecha_creacion 
-            FROM registros 
+            FROM registros_bono 
+            WHERE evento_id = ? AND eliminado_en IS NULL
             ORDER BY fecha_creacion DESC
-        ''')
+        ''', (self.evento_id,))
         
         registros = cursor.fetchall()
         conn.close()
         
         return registros
     
+    def iterar_registros(self, por_bono=False, lote=500):
+        """Recorre los registros activos en bloques desde el cursor, sin cargarlos todos
+
+        Con por_bono=True vienen agrupados por bono; si no, del más reciente al más antiguo.
+        """
+        orden = 'bono, fecha_creacion' if por_bono else 'fecha_creacion DESC'
+        conn = self._conectar()
+        cursor = conn.cursor()
+        cursor.row_factory = Registro.desde_fila
+        
+        try:
+            cursor.execute(f'''
+                SELECT id, grupo, guia, bono, monto, asistentes, fecha_creacion 
+                FROM registros_bono 
+                WHERE evento_id = ? AND eliminado_en IS NULL
+                ORDER BY {orden}
+            ''', (self.evento_id,))
+            
+            while True:
+                registros = cursor.fetchmany(lote)
+                if not registros:
+                    break
+                yield from registros
+        finally:
+            conn.close()
+    
     def obtener_registros_por_bono(self, bono):
-        """Obtiene registros por tipo de bono"""
-        conn = sqlite3.connect(self.db_name)
+        """Obtiene registros por tipo de bono (con caché)"""
+        return list(self._leer_con_cache(('bono', self.evento_id, bono), lambda: self._consultar_registros_por_bono(bono)))
+    
+    def _consultar_registros_por_bono(self, bono):
+        """Consulta en la base de datos los registros de un tipo de bono"""
+        conn = self._conectar()
         cursor = conn.cursor()
+        cursor.row_factory = Registro.desde_fila
         
         cursor.execute('''
             SELECT id, grupo, guia, bono, monto, asistentes, fecha_creacion 
-            FROM registros 
-            WHERE bono = ?
+            FROM registros_bono 
+            WHERE evento_id = ? AND bono = ? AND eliminado_en IS NULL
             ORDER BY fecha_creacion DESC
-        ''', (bono,))
+        ''', (self.evento_id, bono))
         
         registros = cursor.fetchall()
         conn.close()
@@ -80,88 +613,196 @@ class Database:
         return registros
     
     def obtener_tipos_bono(self):
-        """Obtiene todos los tipos de bono únicos"""
-        conn = sqlite3.connect(self.db_name)
+        """Obtiene todos los tipos de bono únicos (con caché)"""
+        return list(self._leer_con_cache(('bonos', self.evento_id), self._consultar_tipos_bono))
+    
+    def _consultar_tipos_bono(self):
+        """Consulta en la base de datos los tipos de bono únicos"""
+        conn = self._conectar()
         cursor = conn.cursor()
         
-        cursor.execute('SELECT DISTINCT bono FROM registros ORDER BY bono')
+        cursor.execute(
+            'SELECT DISTINCT bono FROM registros_bono WHERE evento_id = ? AND eliminado_en IS NULL ORDER BY bono',
+            (self.evento_id,)
+        )
         bonos = [row[0] for row in cursor.fetchall()]
         
         conn.close()
         return bonos
     
     def obtener_registro_por_id(self, registro_id):
-        """Obtiene un registro específico por ID"""
-        conn = sqlite3.connect(self.db_name)
+        """Obtiene un registro específico por ID (con caché)"""
+        return self._leer_con_cache(('registro', self.evento_id, registro_id), lambda: self._consultar_registro_por_id(registro_id))
+    
+    def _consultar_registro_por_id(self, registro_id):
+        """Consulta en la base de datos un registro por ID"""
+        conn = self._conectar()
         cursor = conn.cursor()
+        cursor.row_factory = Registro.desde_fila
         
         cursor.execute('''
             SELECT id, grupo, guia, bono, monto, asistentes, fecha_creacion 
-            FROM registros 
-            WHERE id = ?
-        ''', (registro_id,))
+            FROM registros_bono 
+            WHERE id = ? AND evento_id = ? AND eliminado_en IS NULL
+        ''', (registro_id, self.evento_id))
         
         registro = cursor.fetchone()
         conn.close()
         
         return registro
     
-    def actualizar_bono(self, registro_id, nuevo_bono):
+    def actualizar_bono(self, registro_id, nuevo_bono, usuario=None):
         """Actualiza el tipo de bono de un registro"""
-        conn = sqlite3.connect(self.db_name)
+        conn = self._conectar()
         cursor = conn.cursor()
         
-        cursor.execute('''
+        condicion = 'id = ? AND evento_id = ? AND eliminado_en IS NULL'
+        antes = self._leer_filas(cursor, condicion, (registro_id, self.evento_id))
+        bono_id, nuevo_bono, _ = self._id_bono(cursor, nuevo_bono)
+        
+        cursor.execute(f'''
             UPDATE registros 
-            SET bono = ? 
-            WHERE id = ?
-        ''', (nuevo_bono, registro_id))
+            SET bono_id = ? 
+            WHERE {condicion}
+        ''', (bono_id, registro_id, self.evento_id))
+        filas_afectadas = cursor.rowcount
+        self._recalcular_cupos(cursor)
+        
+        for fila in antes:
+            self._registrar_cambio(cursor, 'actualizar', fila['id'], fila, dict(fila, bono=nuevo_bono), usuario)
         
         conn.commit()
-        filas_afectadas = cursor.rowcount
         conn.close()
+        self._invalidar_filas(antes, nuevo_bono)
+        self.cache.invalidar([CLAVE_INDICE_BONOS])
         
         return filas_afectadas > 0
     
-    def eliminar_registro(self, registro_id):
-        """Elimina un registro por ID"""
-        conn = sqlite3.connect(self.db_name)
+    def renombrar_bono(self, bono_actual, nuevo_bono, usuario=None):
+        """Pasa todos los registros del evento de un bono a otro en una sola transacción
+
+        Si el bono anterior se queda sin registros ni cupos en ningún evento, se une
+        al nuevo: sus alias pasan a él y desde entonces se resuelven al bono correcto.
+        Si el nuevo nombre lleva al mismo bono ('vip' → 'VIP'), solo se corrige cómo se escribe.
+        """
+        conn = self._conectar()
         cursor = conn.cursor()
         
-        cursor.execute('DELETE FROM registros WHERE id = ?', (registro_id,))
+        cursor.execute('SELECT id FROM bonos WHERE nombre = ?', (bono_actual,))
+        anterior = cursor.fetchone()
+        if anterior is None:
+            conn.close()
+            return 0
+        bono_id, canonico, _ = self._id_bono(cursor, nuevo_bono)
+        mismo = bono_id == anterior[0]
+        nuevo_bono = re.sub(r'\s+', ' ', str(nuevo_bono)).strip() if mismo else canonico
         
-        conn.commit()
+        condicion = 'evento_id = ? AND bono_id = ? AND eliminado_en IS NULL'
+        antes = self._leer_filas(cursor, condicion, (self.evento_id, anterior[0]))
+        if mismo:
+            cursor.execute('UPDATE bonos SET nombre = ? WHERE id = ?', (nuevo_bono, bono_id))
+        
+        cursor.execute(f'''
+            UPDATE registros 
+            SET bono_id = ? 
+            WHERE {condicion}
+        ''', (bono_id, self.evento_id, anterior[0]))
         filas_afectadas = cursor.rowcount
+        self._recalcular_cupos(cursor)
+        
+        for fila in antes:
+            self._registrar_cambio(cursor, 'actualizar', fila['id'], fila, dict(fila, bono=nuevo_bono), usuario)
+        
+        # Un bono con cupo en algún evento se conserva aunque se quede sin registros
+        cursor.execute('''
+            SELECT 1 FROM registros WHERE bono_id = ?
+            UNION ALL SELECT 1 FROM cupos WHERE bono_id = ?
+            LIMIT 1
+        ''', (anterior[0], anterior[0]))
+        if anterior[0] != bono_id and cursor.fetchone() is None:
+            cursor.execute('UPDATE bonos_alias SET bono_id = ? WHERE bono_id = ?', (bono_id, anterior[0]))
+            cursor.execute('DELETE FROM bonos WHERE id = ?', (anterior[0],))
+        
+        conn.commit()
         conn.close()
+        if mismo:
+            # El nombre es del catálogo: cambia en todos los eventos y en todo lo guardado en caché
+            self.cache.invalidar()
+        else:
+            self._invalidar_filas(antes, nuevo_bono)
+            self.cache.invalidar([CLAVE_INDICE_BONOS])
         
-        return filas_afectadas > 0
+        return filas_afectadas
+    
+    def _siguiente_lote(self, cursor):
+        """Devuelve el número de lote para una nueva eliminación"""
+        cursor.execute('SELECT COALESCE(MAX(lote_eliminacion), 0) + 1 FROM registros')
+        return cursor.fetchone()[0]
+    
+    def _eliminar_donde(self, cursor, condicion, parametros, usuario):
+        """Marca como eliminados los registros activos que cumplen la condición
+
+        Devuelve las filas eliminadas tal como estaban antes de eliminarlas.
+        """
+        condicion = f'evento_id = ? AND {condicion} AND eliminado_en IS NULL'
+        parametros = (self.evento_id,) + tuple(parametros)
+        antes = self._leer_filas(cursor, condicion, parametros)
+        
+        cursor.execute(f'''
+            UPDATE registros
+            SET eliminado_en = CURRENT_TIMESTAMP, lote_eliminacion = ?, eliminado_por = ?
+            WHERE {condicion}
+        ''', (self._siguiente_lote(cursor), usuario) + parametros)
+        self._recalcular_cupos(cursor)
+        
+        for fila in antes:
+            self._registrar_cambio(cursor, 'eliminar', fila['id'], fila, None, usuario)
+        
+        return antes
     
-    def eliminar_registros_por_bono(self, bono):
-        """Elimina todos los registros de un tipo de bono"""
-        conn = sqlite3.connect(self.db_name)
+    def eliminar_registro(self, registro_id, usuario=None):
+        """Marca un registro como eliminado (se puede deshacer)"""
+        conn = self._conectar()
         cursor = conn.cursor()
         
-        cursor.execute('DELETE FROM registros WHERE bono = ?', (bono,))
+        eliminados = self._eliminar_donde(cursor, 'id = ?', (registro_id,), usuario)
         
         conn.commit()
-        filas_afectadas = cursor.rowcount
         conn.close()
+        self._invalidar_filas(eliminados)
         
-        return filas_afectadas
+        return len(eliminados) > 0
+    
+    def eliminar_registros_por_bono(self, bono, usuario=None):
+        """Marca como eliminados todos los registros de un tipo de bono"""
+        conn = self._conectar()
+        cursor = conn.cursor()
+        
+        eliminados = self._eliminar_donde(cursor, 'bono_id IN (SELECT id FROM bonos WHERE nombre = ?)', (bono,), usuario)
+        
+        conn.commit()
+        conn.close()
+        self._invalidar_filas(eliminados, bono)
+        
+        return len(eliminados)
     
     def obtener_estadisticas(self):
         """Obtiene estadísticas de los registros"""
-        conn = sqlite3.connect(self.db_name)
+        conn = self._conectar()
         cursor = conn.cursor()
         
-        cursor.execute('SELECT COUNT(*), SUM(asistentes) FROM registros')
+        cursor.execute(
+            'SELECT COUNT(*), SUM(asistentes) FROM registros WHERE evento_id = ? AND eliminado_en IS NULL',
+            (self.evento_id,)
+        )
         total_registros, total_asistentes = cursor.fetchone()
         
         cursor.execute('''
             SELECT bono, COUNT(*), SUM(asistentes), SUM(monto)
-            FROM registros 
-            GROUP BY bono
-        ''')
+            FROM registros_bono 
+            WHERE evento_id = ? AND eliminado_en IS NULL
+            GROUP BY bono_id
+        ''', (self.evento_id,))
         
         estadisticas_bono = cursor.fetchall()
         conn.close()
@@ -172,32 +813,541 @@ class Database:
             'por_bono': estadisticas_bono
         }
     
-    def limpiar_registros(self):
-        """Elimina todos los registros"""
-        conn = sqlite3.connect(self.db_name)
+    def obtener_registros_por_dia(self):
+        """Obtiene registros, asistentes y monto agrupados por día de creación"""
+        conn = self._conectar()
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            SELECT date(fecha_creacion), COUNT(*), SUM(asistentes), SUM(monto)
+            FROM registros 
+            WHERE evento_id = ? AND eliminado_en IS NULL
+            GROUP BY date(fecha_creacion)
+            ORDER BY date(fecha_creacion)
+        ''', (self.evento_id,))
+        
+        por_dia = cursor.fetchall()
+        conn.close()
+        
+        return por_dia
+    
+    def obtener_nombres_capturados(self):
+        """Obtiene cada par (grupo, guía) activo con cuántos registros lo usan, en todos los eventos"""
+        conn = self._conectar()
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            SELECT grupo, guia, COUNT(*)
+            FROM registros
+            WHERE eliminado_en IS NULL
+            GROUP BY grupo, guia
+        ''')
+        
+        nombres = cursor.fetchall()
+        conn.close()
+        
+        return nombres
+    
+    def obtener_cupos(self):
+        """Obtiene {bono: (capacidad, disponibles)} de los bonos con cupo del evento (con caché)"""
+        return dict(self._leer_con_cache(('cupos', self.evento_id), self._consultar_cupos))
+    
+    def _consultar_cupos(self):
+        """Consulta en la base de datos los cupos del evento"""
+        conn = self._conectar()
         cursor = conn.cursor()
         
-        cursor.execute('DELETE FROM registros')
-        registros_eliminados = cursor.rowcount
+        cursor.execute('''
+            SELECT b.nombre, c.capacidad, c.disponibles
+            FROM cupos c JOIN bonos b ON b.id = c.bono_id
+            WHERE c.evento_id = ?
+            ORDER BY b.nombre
+        ''', (self.evento_id,))
+        cupos = {nombre: (capacidad, disponibles) for nombre, capacidad, disponibles in cursor.fetchall()}
+        
+        conn.close()
+        return cupos
+    
+    def fijar_cupo(self, bono, capacidad):
+        """Fija la capacidad de un bono en el evento (None la quita) y devuelve (bono, disponibles)
+
+        Los lugares disponibles parten de la capacidad menos los asistentes ya capturados.
+        """
+        conn = self._conectar()
+        cursor = conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        bono_id, bono, bono_nuevo = self._id_bono(cursor, bono)
+        
+        disponibles = None
+        if capacidad is None:
+            cursor.execute('DELETE FROM cupos WHERE evento_id = ? AND bono_id = ?', (self.evento_id, bono_id))
+        else:
+            cursor.execute('''
+                INSERT INTO cupos (evento_id, bono_id, capacidad, disponibles) VALUES (?, ?, ?, ?)
+                ON CONFLICT (evento_id, bono_id) DO UPDATE SET capacidad = excluded.capacidad
+            ''', (self.evento_id, bono_id, int(capacidad), int(capacidad)))
+            self._recalcular_cupos(cursor)
+            cursor.execute('SELECT disponibles FROM cupos WHERE evento_id = ? AND bono_id = ?', (self.evento_id, bono_id))
+            disponibles = cursor.fetchone()[0]
         
         conn.commit()
         conn.close()
+        self.cache.invalidar([('cupos', self.evento_id)] + ([CLAVE_INDICE_BONOS] if bono_nuevo else []))
         
-        return registros_eliminados
+        return bono, disponibles
+    
+    def limpiar_registros(self, usuario=None):
+        """Marca como eliminados todos los registros"""
+        conn = self._conectar()
+        cursor = conn.cursor()
+        
+        eliminados = self._eliminar_donde(cursor, '1 = 1', (), usuario)
+        
+        conn.commit()
+        conn.close()
+        self._invalidar_filas(eliminados)
+        
+        return len(eliminados)
     
     def buscar_registros_por_grupo(self, grupo):
         """Busca registros por nombre de grupo"""
-        conn = sqlite3.connect(self.db_name)
+        conn = self._conectar()
         cursor = conn.cursor()
+        cursor.row_factory = Registro.desde_fila
         
         cursor.execute('''
             SELECT id, grupo, guia, bono, monto, asistentes, fecha_creacion 
-            FROM registros 
-            WHERE grupo LIKE ? 
+            FROM registros_bono 
+            WHERE evento_id = ? AND grupo LIKE ? AND eliminado_en IS NULL
             ORDER BY fecha_creacion DESC
-        ''', (f'%{grupo}%',))
+        ''', (self.evento_id, f'%{grupo}%'))
         
         registros = cursor.fetchall()
         conn.close()
         
         return registros
+    
+    def deshacer_eliminacion(self, minutos=MINUTOS_DESHACER, usuario=None):
+        """Restaura la última eliminación del usuario si sigue dentro de la ventana de deshacer
+
+        Solo se consideran los lotes que eliminó ese mismo usuario: deshacer
+        nunca revive lo que otro administrador eliminó a propósito.
+        """
+        conn = self._conectar()
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            SELECT MAX(lote_eliminacion)
+            FROM registros
+            WHERE evento_id = ? AND eliminado_en IS NOT NULL AND eliminado_en >= datetime('now', ?)
+                AND eliminado_por IS ?
+        ''', (self.evento_id, f'-{int(minutos)} minutes', usuario))
+        lote = cursor.fetchone()[0]
+        
+        if lote is None:
+            conn.close()
+            return 0
+        
+        condicion = 'lote_eliminacion = ? AND eliminado_en IS NOT NULL'
+        restaurados = self._leer_filas(cursor, condicion, (lote,))
+        
+        cursor.execute(f'''
+            UPDATE registros
+            SET eliminado_en = NULL, lote_eliminacion = NULL, eliminado_por = NULL
+            WHERE {condicion}
+        ''', (lote,))
+        registros_restaurados = cursor.rowcount
+        self._recalcular_cupos(cursor)
+        
+        for fila in restaurados:
+            self._registrar_cambio(cursor, 'restaurar', fila['id'], None, fila, usuario)
+        
+        conn.commit()
+        conn.close()
+        self._invalidar_filas(restaurados)
+        
+        return registros_restaurados
+    
+    def compactar(self, minutos=MINUTOS_DESHACER):
+        """Purga las eliminaciones fuera de la ventana de deshacer y libera espacio"""
+        conn = self._conectar()
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            DELETE FROM registros
+            WHERE eliminado_en IS NOT NULL AND eliminado_en < datetime('now', ?)
+        ''', (f'-{int(minutos)} minutes',))
+        registros_purgados = cursor.rowcount
+        conn.commit()
+        
+        cursor.execute('PRAGMA incremental_vacuum')
+        cursor.fetchall()
+        conn.close()
+        
+        return registros_purgados
+    
+    def iniciar_compactador(self, intervalo=900, horas=HORAS_COMPACTACION):
+        """Lanza un hilo que compacta la base de datos en las horas de baja actividad"""
+        def compactador():
+            while True:
+                time.sleep(intervalo)
+                if datetime.utcnow().hour not in horas:
+                    continue
+                try:
+                    purgados = self.compactar()
+                    if purgados:
+                        logger.info(f"Compactación: {purgados} registros purgados")
+                except Exception as e:
+                    logger.error(f"Error compactando base de datos: {e}")
+        
+        hilo = threading.Thread(target=compactador, daemon=True)
+        hilo.start()
+        return hilo
+    
+    def ultimo_cambio(self):
+        """Devuelve el número de secuencia del último cambio registrado"""
+        conn = self._conectar()
+        cursor = conn.cursor()
+        
+        cursor.execute('SELECT COALESCE(MAX(seq), 0) FROM cambios')
+        seq = cursor.fetchone()[0]
+        
+        conn.close()
+        return seq
+    
+    def cambios_desde(self, seq=0, lote=500):
+        """Itera en orden los cambios del evento posteriores a la secuencia indicada"""
+        conn = self._conectar()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute('''
+                SELECT seq, fecha, usuario, operacion, registro_id, antes, despues
+                FROM cambios
+                WHERE evento_id = ? AND seq > ?
+                ORDER BY seq
+            ''', (self.evento_id, seq))
+            
+            while True:
+                filas = cursor.fetchmany(lote)
+                if not filas:
+                    break
+                for seq_cambio, fecha, usuario, operacion, registro_id, antes, despues in filas:
+                    yield {
+                        'seq': seq_cambio,
+                        'fecha': fecha,
+                        'usuario': usuario,
+                        'operacion': operacion,
+                        'registro_id': registro_id,
+                        'antes': json.loads(antes) if antes else None,
+                        'despues': json.loads(despues) if despues else None
+                    }
+        finally:
+            conn.close()
+    
+    # ================= BOLETOS =================
+    def emitir_boleto(self, registro_id, nonce):
+        """Guarda el boleto de un registro y devuelve su nonce (el ya guardado si existía)"""
+        conn = self._conectar()
+        cursor = conn.cursor()
+        
+        cursor.execute(
+            'INSERT INTO boletos (registro_id, nonce) VALUES (?, ?) ON CONFLICT(registro_id) DO NOTHING',
+            (registro_id, nonce)
+        )
+        cursor.execute('SELECT nonce FROM boletos WHERE registro_id = ?', (registro_id,))
+        nonce = cursor.fetchone()[0]
+        
+        conn.commit()
+        conn.close()
+        return nonce
+    
+    def obtener_boletos(self):
+        """Boletos de registros activos de todos los eventos
+
+        Lista de (registro_id, evento_id, nonce, grupo, asistentes, ingreso_en).
+        """
+        conn = self._conectar()
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            SELECT b.registro_id, r.evento_id, b.nonce, r.grupo, r.asistentes, b.ingreso_en
+            FROM boletos b JOIN registros r ON r.id = b.registro_id
+            WHERE r.eliminado_en IS NULL
+        ''')
+        boletos = [
+            (registro_id, evento_id, nonce, grupo, asistentes, datetime.fromisoformat(ingreso) if ingreso else None)
+            for registro_id, evento_id, nonce, grupo, asistentes, ingreso in cursor.fetchall()
+        ]
+        
+        conn.close()
+        return boletos
+    
+    def registrar_ingresos(self, ingresos):
+        """Anota en una sola transacción una lista de (registro_id, fecha, usuario)
+
+        Devuelve los registro_id que ya tenían ingreso (se conserva el primero).
+        """
+        conn = self._conectar()
+        cursor = conn.cursor()
+        
+        repetidos = []
+        for registro_id, fecha, usuario in ingresos:
+            cursor.execute(
+                'UPDATE boletos SET ingreso_en = ?, ingreso_por = ? WHERE registro_id = ? AND ingreso_en IS NULL',
+                (fecha.strftime('%Y-%m-%d %H:%M:%S'), usuario, registro_id)
+            )
+            if not cursor.rowcount:
+                repetidos.append(registro_id)
+        
+        conn.commit()
+        conn.close()
+        return repetidos
+    
+    # ================= EVENTOS =================
+    def obtener_eventos(self, incluir_archivados=False):
+        """Devuelve los eventos como lista de (id, nombre, archivo)"""
+        conn = self._conectar()
+        cursor = conn.cursor()
+        
+        condicion = '' if incluir_archivados else 'WHERE archivo IS NULL'
+        cursor.execute(f'SELECT id, nombre, archivo FROM eventos {condicion} ORDER BY id')
+        eventos = cursor.fetchall()
+        
+        conn.close()
+        return eventos
+    
+    def buscar_evento(self, nombre):
+        """Devuelve (id, nombre, archivo) del evento con ese nombre, sin distinguir mayúsculas"""
+        conn = self._conectar()
+        cursor = conn.cursor()
+        
+        cursor.execute('SELECT id, nombre, archivo FROM eventos WHERE nombre = ? COLLATE NOCASE', (nombre.strip(),))
+        evento = cursor.fetchone()
+        
+        conn.close()
+        return evento
+    
+    def crear_evento(self, nombre):
+        """Crea un evento y devuelve su id"""
+        conn = self._conectar()
+        cursor = conn.cursor()
+        
+        cursor.execute('INSERT INTO eventos (nombre) VALUES (?)', (nombre.strip(),))
+        evento_id = cursor.lastrowid
+        
+        conn.commit()
+        conn.close()
+        return evento_id
+    
+    def evento_del_chat(self, chat_id):
+        """Devuelve el evento activo de un chat (memorizado; el por defecto si no eligió)"""
+        evento_id = self._eventos_chat.get(chat_id)
+        if evento_id is not None:
+            return evento_id
+        
+        conn = self._conectar()
+        cursor = conn.cursor()
+        
+        cursor.execute('SELECT evento_id FROM chats_evento WHERE chat_id = ?', (chat_id,))
+        fila = cursor.fetchone()
+        
+        conn.close()
+        evento_id = fila[0] if fila else EVENTO_POR_DEFECTO
+        self._eventos_chat[chat_id] = evento_id
+        return evento_id
+    
+    def asignar_evento_chat(self, chat_id, evento_id):
+        """Cambia el evento sobre el que trabaja un chat"""
+        conn = self._conectar()
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            INSERT INTO chats_evento (chat_id, evento_id) VALUES (?, ?)
+            ON CONFLICT(chat_id) DO UPDATE SET evento_id = excluded.evento_id
+        ''', (chat_id, evento_id))
+        
+        conn.commit()
+        conn.close()
+        self._eventos_chat[chat_id] = evento_id
+    
+    def archivar_evento(self, evento_id):
+        """Mueve los registros de un evento a su propio archivo SQLite y los quita de la base activa
+
+        El archivo queda junto a la base (``<base>_evento_<id>.db``) con una tabla
+        ``registros`` que incluye el nombre de cada bono; los chats que trabajaban en ese evento vuelven al evento por defecto.
+        Devuelve (ruta_del_archivo, registros_movidos).
+        """
+        if evento_id == EVENTO_POR_DEFECTO:
+            raise ValueError('El evento por defecto no se puede archivar')
+        
+        base, _ = os.path.splitext(self.db_name)
+        ruta = f'{base}_evento_{evento_id}.db'
+        
+        conn = self._conectar()
+        cursor = conn.cursor()
+        
+        cursor.execute('ATTACH DATABASE ? AS archivo', (ruta,))
+        try:
+            cursor.execute('BEGIN')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS archivo.registros AS
+                SELECT * FROM main.registros_bono WHERE 0
+            ''')
+            cursor.execute('''
+                INSERT INTO archivo.registros
+                SELECT * FROM main.registros_bono WHERE evento_id = ?
+            ''', (evento_id,))
+            cursor.execute('DELETE FROM main.registros WHERE evento_id = ?', (evento_id,))
+            registros_movidos = cursor.rowcount
+            cursor.execute('UPDATE eventos SET archivo = ? WHERE id = ?', (ruta, evento_id))
+            cursor.execute('DELETE FROM chats_evento WHERE evento_id = ?', (evento_id,))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.execute('DETACH DATABASE archivo')
+        
+        cursor.execute('PRAGMA incremental_vacuum')
+        cursor.fetchall()
+        conn.close()
+        
+        for chat_id in [c for c, evento in self._eventos_chat.items() if evento == evento_id]:
+            del self._eventos_chat[chat_id]
+        self.cache.invalidar()
+        return ruta, registros_movidos
+    
+    def obtener_marca_exportacion(self, nombre):
+        """Devuelve la última secuencia exportada para una exportación, o None"""
+        conn = self._conectar()
+        cursor = conn.cursor()
+        
+        cursor.execute('SELECT ultimo_seq FROM exportaciones WHERE nombre = ?', (nombre,))
+        fila = cursor.fetchone()
+        
+        conn.close()
+        return fila[0] if fila else None
+    
+    def guardar_marca_exportacion(self, nombre, seq):
+        """Guarda la última secuencia exportada para una exportación"""
+        conn = self._conectar()
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            INSERT INTO exportaciones (nombre, ultimo_seq, fecha)
+            VALUES (?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT(nombre) DO UPDATE SET ultimo_seq = excluded.ultimo_seq, fecha = excluded.fecha
+        ''', (nombre, seq))
+        
+        conn.commit()
+        conn.close()
+    
+    def obtener_roles(self):
+        """Devuelve un diccionario usuario_id -> rol"""
+        conn = self._conectar()
+        cursor = conn.cursor()
+        
+        cursor.execute('SELECT usuario_id, rol FROM roles')
+        roles = dict(cursor.fetchall())
+        
+        conn.close()
+        return roles
+    
+    def guardar_rol(self, usuario_id, rol, otorgado_por=None):
+        """Asigna un rol a un usuario, o se lo quita si rol es None"""
+        conn = self._conectar()
+        cursor = conn.cursor()
+        
+        if rol is None:
+            cursor.execute('DELETE FROM roles WHERE usuario_id = ?', (usuario_id,))
+        else:
+            cursor.execute('''
+                INSERT INTO roles (usuario_id, rol, otorgado_por, fecha)
+                VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT(usuario_id) DO UPDATE SET
+                    rol = excluded.rol, otorgado_por = excluded.otorgado_por, fecha = excluded.fecha
+            ''', (usuario_id, rol, otorgado_por))
+        
+        conn.commit()
+        conn.close()
+    
+    def obtener_suscripciones(self):
+        """Devuelve las suscripciones a resúmenes como lista de (chat_id, frecuencia)"""
+        conn = self._conectar()
+        cursor = conn.cursor()
+        
+        cursor.execute('SELECT chat_id, frecuencia FROM suscripciones')
+        suscripciones = cursor.fetchall()
+        
+        conn.close()
+        return suscripciones
+    
+    def guardar_suscripcion(self, chat_id, frecuencia, activa, usuario_id=None):
+        """Suscribe un chat a un resumen, o lo da de baja si activa es False"""
+        conn = self._conectar()
+        cursor = conn.cursor()
+        
+        if not activa:
+            cursor.execute('DELETE FROM suscripciones WHERE chat_id = ? AND frecuencia = ?', (chat_id, frecuencia))
+        else:
+            cursor.execute('''
+                INSERT INTO suscripciones (chat_id, frecuencia, usuario_id, fecha)
+                VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT(chat_id, frecuencia) DO UPDATE SET usuario_id = excluded.usuario_id, fecha = excluded.fecha
+            ''', (chat_id, frecuencia, usuario_id))
+        
+        conn.commit()
+        conn.close()
+    
+    def buscar_duplicados(self):
+        """Agrupa registros activos con el mismo grupo, guía y bono (normalizados)
+
+        Un solo recorrido con un diccionario por clave: O(n). Devuelve solo los
+        grupos con más de un registro, de mayor a menor.
+        """
+        por_clave = {}
+        for registro in self.iterar_registros():
+            clave = (normalizar_texto(registro.grupo), normalizar_texto(registro.guia), normalizar_texto(registro.bono))
+            por_clave.setdefault(clave, []).append(registro)
+        
+        duplicados = [registros for registros in por_clave.values() if len(registros) > 1]
+        duplicados.sort(key=len, reverse=True)
+        return duplicados
+
+class DatabaseLectura(Database):
+    """Database de solo lectura sobre un archivo SQLite que ya tiene el esquema
+
+    Para la réplica y los reportes: no ejecuta init_db (ni DDL ni VACUUM) y cada
+    conexión se abre con mode=ro, así ninguna lectura puede modificar la copia.
+    """
+    
+    def __init__(self, db_name, evento_id=EVENTO_POR_DEFECTO):
+        self.db_name = db_name
+        self.evento_id = evento_id
+        self.cache = CacheLRU()
+        self._eventos_chat = {}
+    
+    def _conectar(self):
+        return sqlite3.connect(f'file:{pathname2url(os.path.abspath(self.db_name))}?mode=ro', uri=True)
+
+_postgres = None
+
+def abrir_base_datos(db_name, evento_id=EVENTO_POR_DEFECTO):
+    """Devuelve el almacenamiento configurado: PostgreSQL si hay DATABASE_URL, si no SQLite
+
+    Con PostgreSQL cada proceso abre un solo pool y lo reutiliza en cada llamada.
+    """
+    global _postgres
+    if DATABASE_URL:
+        if _postgres is None:
+            from database_pg import DatabasePostgres
+            _postgres = DatabasePostgres(DATABASE_URL)
+        return _postgres.del_evento(evento_id)
+    return Database(db_name, evento_id)
+
+def abrir_lectura(db_name, evento_id=EVENTO_POR_DEFECTO):
+    """Como abrir_base_datos, pero con SQLite abre el archivo en solo lectura y sin inicializar el esquema"""
+    if DATABASE_URL:
+        return abrir_base_datos(db_name, evento_id)
+    return DatabaseLectura(db_name, evento_id)
@@ -0,0 +1,852 @@
+import os
+import json
+import asyncio
+import logging
+import threading
+from urllib.parse import urlsplit
+
+import asyncpg
+
+from database import Database, CupoAgotado, COLUMNAS_REGISTRO, EVENTO_POR_DEFECTO, MINUTOS_DESHACER, CLAVE_INDICE_BONOS
+from bonos import clave_bono, IndiceBonos
+from modelo import Registro
+
+logger = logging.getLogger(__name__)
+
+# Conexiones abiertas por cada proceso del bot
+POOL_MIN = int(os.environ.get('PG_POOL_MIN', '1'))
+POOL_MAX = int(os.environ.get('PG_POOL_MAX', '10'))
+
+# Las fechas se guardan en UTC sin zona, igual que CURRENT_TIMESTAMP en SQLite
+AHORA = "(CURRENT_TIMESTAMP AT TIME ZONE 'UTC')"
+
+# Columnas de un registro; la fecha como texto para devolver lo mismo que SQLite
+SELECCION_REGISTRO = "id, grupo, guia, bono, monto, asistentes, to_char(fecha_creacion, 'YYYY-MM-DD HH24:MI:SS')"
+
+# Columnas físicas de registros, en el orden en que se copian a registros_archivo
+COLUMNAS_TABLA = 'id, evento_id, grupo, guia, bono_id, monto, asistentes, fecha_creacion, eliminado_en, lote_eliminacion, clave_idempotencia'
+
+# Canal por el que cada proceso se entera de las escrituras de los demás
+CANAL_CAMBIOS = 'congreso_cambios'
+
+ESQUEMA = f'''
+    CREATE TABLE IF NOT EXISTS eventos (
+        id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        nombre TEXT NOT NULL UNIQUE,
+        archivo TEXT,
+        fecha_creacion TIMESTAMP DEFAULT {AHORA}
+    );
+    INSERT INTO eventos (id, nombre) VALUES ({EVENTO_POR_DEFECTO}, 'Congreso 2026') ON CONFLICT DO NOTHING;
+    SELECT setval(pg_get_serial_sequence('eventos', 'id'), GREATEST(MAX(id), 1)) FROM eventos;
+    
+    CREATE TABLE IF NOT EXISTS chats_evento (
+        chat_id BIGINT PRIMARY KEY,
+        evento_id BIGINT NOT NULL
+    );
+    
+    CREATE TABLE IF NOT EXISTS bonos (
+        id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        nombre TEXT NOT NULL,
+        fecha_creacion TIMESTAMP DEFAULT {AHORA}
+    );
+    CREATE TABLE IF NOT EXISTS bonos_alias (
+        alias TEXT PRIMARY KEY,
+        bono_id BIGINT NOT NULL REFERENCES bonos(id)
+    );
+    
+    CREATE TABLE IF NOT EXISTS registros (
+        id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        evento_id BIGINT NOT NULL DEFAULT {EVENTO_POR_DEFECTO},
+        grupo TEXT NOT NULL,
+        guia TEXT NOT NULL,
+        bono_id BIGINT NOT NULL REFERENCES bonos(id),
+        monto DOUBLE PRECISION NOT NULL,
+        asistentes INTEGER NOT NULL,
+        fecha_creacion TIMESTAMP DEFAULT {AHORA},
+        eliminado_en TIMESTAMP,
+        lote_eliminacion BIGINT,
+        clave_idempotencia TEXT
+    );
+    ALTER TABLE registros ADD COLUMN IF NOT EXISTS eliminado_por BIGINT;
+    CREATE SEQUENCE IF NOT EXISTS lotes_eliminacion;
+    CREATE TABLE IF NOT EXISTS cupos (
+        evento_id BIGINT NOT NULL,
+        bono_id BIGINT NOT NULL REFERENCES bonos(id),
+        capacidad INTEGER NOT NULL,
+        disponibles INTEGER NOT NULL,
+        PRIMARY KEY (evento_id, bono_id)
+    );
+    CREATE TABLE IF NOT EXISTS boletos (
+        registro_id BIGINT PRIMARY KEY,
+        nonce TEXT NOT NULL,
+        emitido_en TIMESTAMP DEFAULT {AHORA},
+        ingreso_en TIMESTAMP,
+        ingreso_por BIGINT
+    );
+    CREATE TABLE IF NOT EXISTS registros_archivo (LIKE registros);
+    ALTER TABLE registros ADD COLUMN IF NOT EXISTS bono_id BIGINT REFERENCES bonos(id);
+    ALTER TABLE registros_archivo ADD COLUMN IF NOT EXISTS bono_id BIGINT;
+    
+    CREATE OR REPLACE VIEW registros_bono AS
+        SELECT r.id, r.evento_id, r.grupo, r.guia, r.bono_id, b.nombre AS bono, r.monto, r.asistentes,
+               r.fecha_creacion, r.eliminado_en, r.lote_eliminacion, r.clave_idempotencia
+        FROM registros r JOIN bonos b ON b.id = r.bono_id;
+    
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_registros_idempotencia
+        ON registros (clave_idempotencia) WHERE clave_idempotencia IS NOT NULL;
+    CREATE INDEX IF NOT EXISTS idx_registros_evento_fecha
+        ON registros (evento_id, fecha_creacion) WHERE eliminado_en IS NULL;
+    CREATE INDEX IF NOT EXISTS idx_registros_evento_bono_id
+        ON registros (evento_id, bono_id, fecha_creacion) WHERE eliminado_en IS NULL;
+    CREATE INDEX IF NOT EXISTS idx_registros_eliminados
+        ON registros (eliminado_en) WHERE eliminado_en IS NOT NULL;
+    
+    CREATE TABLE IF NOT EXISTS cambios (
+        seq BIGINT GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+        evento_id BIGINT NOT NULL DEFAULT {EVENTO_POR_DEFECTO},
+        fecha TIMESTAMP DEFAULT {AHORA},
+        usuario TEXT,
+        operacion TEXT NOT NULL,
+        registro_id BIGINT NOT NULL,
+        antes JSONB,
+        despues JSONB
+    );
+    CREATE INDEX IF NOT EXISTS idx_cambios_evento ON cambios (evento_id, seq);
+    
+    CREATE OR REPLACE FUNCTION cambios_solo_insercion() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        RAISE EXCEPTION 'El historial de cambios es de solo inserción';
+    END $$;
+    DROP TRIGGER IF EXISTS cambios_sin_modificar ON cambios;
+    CREATE TRIGGER cambios_sin_modificar BEFORE UPDATE OR DELETE ON cambios
+        FOR EACH ROW EXECUTE FUNCTION cambios_solo_insercion();
+    
+    CREATE OR REPLACE FUNCTION cambios_notificar() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        PERFORM pg_notify('{CANAL_CAMBIOS}', '');
+        RETURN NULL;
+    END $$;
+    DROP TRIGGER IF EXISTS cambios_notificacion ON cambios;
+    CREATE TRIGGER cambios_notificacion AFTER INSERT ON cambios
+        FOR EACH STATEMENT EXECUTE FUNCTION cambios_notificar();
+    
+    CREATE TABLE IF NOT EXISTS exportaciones (
+        nombre TEXT PRIMARY KEY,
+        ultimo_seq BIGINT NOT NULL,
+        fecha TIMESTAMP DEFAULT {AHORA}
+    );
+    
+    CREATE TABLE IF NOT EXISTS roles (
+        usuario_id BIGINT PRIMARY KEY,
+        rol TEXT NOT NULL,
+        otorgado_por BIGINT,
+        fecha TIMESTAMP DEFAULT {AHORA}
+    );
+    
+    CREATE TABLE IF NOT EXISTS suscripciones (
+        chat_id BIGINT NOT NULL,
+        frecuencia TEXT NOT NULL,
+        usuario_id BIGINT,
+        fecha TIMESTAMP DEFAULT {AHORA},
+        PRIMARY KEY (chat_id, frecuencia)
+    );
+'''
+
+_bucle = None
+_bucle_lock = threading.Lock()
+
+class _Repetido(Exception):
+    """Alta con una clave de idempotencia que ya existe: se deshace la transacción"""
+    
+    def __init__(self, registro_id):
+        super().__init__(registro_id)
+        self.registro_id = registro_id
+
+def _obtener_bucle():
+    """Event loop propio del backend, en un hilo aparte y compartido por todo el proceso"""
+    global _bucle
+    with _bucle_lock:
+        if _bucle is None:
+            _bucle = asyncio.new_event_loop()
+            threading.Thread(target=_bucle.run_forever, name='postgres', daemon=True).start()
+        return _bucle
+
+class DatabasePostgres(Database):
+    """Misma interfaz que Database, sobre PostgreSQL con un pool de asyncpg
+
+    Las consultas corren en un event loop propio (en otro hilo) y cada método
+    espera su resultado, así el resto del bot sigue usando la interfaz síncrona.
+    Esa espera bloquea el hilo que llama: los handlers deben usar ``asincrona``
+    para que ocurra en el pool de hilos y no en el event loop del bot.
+    Varios procesos del bot pueden escribir a la vez: cada escritura avisa por
+    NOTIFY y todos los procesos vacían su caché de lecturas.
+    """
+    
+    def __init__(self, dsn, evento_id=EVENTO_POR_DEFECTO):
+        self.dsn = dsn
+        self._bucle = _obtener_bucle()
+        
+        async def crear_pool():
+            return await asyncpg.create_pool(dsn, min_size=POOL_MIN, max_size=POOL_MAX)
+        self.pool = self._ejecutar(crear_pool())
+        self._oyente = None
+        super().__init__(dsn, evento_id)
+    
+    def descripcion(self):
+        """El DSN sin la contraseña, para los logs"""
+        partes = urlsplit(self.dsn)
+        servidor = partes.netloc.rpartition('@')[2]
+        if partes.username:
+            servidor = f'{partes.username}@{servidor}'
+        # La consulta también puede llevar la contraseña (?password=...)
+        return f'{partes.scheme}://{servidor}{partes.path}'
+    
+    def _ejecutar(self, esperable):
+        """Espera en el event loop del backend y devuelve el resultado
+
+        Los objetos de asyncpg que se atan a un loop (pool, conexiones) deben
+        crearse dentro de una corrutina que ya corra en ese loop.
+        """
+        async def esperar():
+            return await esperable
+        return asyncio.run_coroutine_threadsafe(esperar(), self._bucle).result()
+    
+    def _consultar(self, metodo, sql, *args):
+        """fetch/fetchrow/fetchval/execute con una conexión del pool"""
+        async def consultar():
+            async with self.pool.acquire() as conn:
+                return await getattr(conn, metodo)(sql, *args)
+        return self._ejecutar(consultar())
+    
+    def _en_transaccion(self, operacion):
+        """Ejecuta operacion(conn) dentro de una transacción y devuelve su resultado"""
+        async def ejecutar():
+            async with self.pool.acquire() as conn:
+                async with conn.transaction():
+                    return await operacion(conn)
+        return self._ejecutar(ejecutar())
+    
+    def _iterar(self, sql, args, lote):
+        """Recorre una consulta con un cursor del servidor, trayendo ``lote`` filas por viaje"""
+        conn = self._ejecutar(self.pool.acquire())
+        transaccion = conn.transaction(readonly=True)
+        iniciada = False
+        try:
+            self._ejecutar(transaccion.start())
+            iniciada = True
+            cursor = self._ejecutar(conn.cursor(sql, *args))
+            
+            while True:
+                filas = self._ejecutar(cursor.fetch(lote))
+                if not filas:
+                    break
+                yield from filas
+        finally:
+            if iniciada:
+                self._ejecutar(transaccion.rollback())
+            self._ejecutar(self.pool.release(conn))
+    
+    def init_db(self):
+        """Crea el esquema (una sola vez aunque arranquen varios procesos) y escucha cambios"""
+        async def crear(conn):
+            await conn.execute('SELECT pg_advisory_xact_lock(2026)')
+            await conn.execute(ESQUEMA)
+            columna_texto = await conn.fetchval('''
+                SELECT 1 FROM information_schema.columns WHERE table_name = 'registros' AND column_name = 'bono'
+            ''')
+            if columna_texto:
+                await self._migrar_bonos_pg(conn)
+        self._en_transaccion(crear)
+        
+        async def escuchar():
+            conn = await asyncpg.connect(self.dsn)
+            await conn.add_listener(CANAL_CAMBIOS, lambda *_: self.cache.invalidar())
+            return conn
+        self._oyente = self._ejecutar(escuchar())
+        
+        logger.info("Base de datos PostgreSQL inicializada")
+    
+    def cerrar(self):
+        """Cierra el pool y la conexión que escucha los cambios de otros procesos"""
+        if self._oyente is not None:
+            self._ejecutar(self._oyente.close())
+            self._oyente = None
+        self._ejecutar(self.pool.close())
+    
+    async def _migrar_bonos_pg(self, conn):
+        """Pasa la columna de texto ``bono`` (activos y archivados) al catálogo y la elimina"""
+        filas = await conn.fetch('''
+            SELECT bono FROM (SELECT bono FROM registros UNION ALL SELECT bono FROM registros_archivo) todos
+            GROUP BY bono ORDER BY COUNT(*) DESC, bono
+        ''')
+        for fila in filas:
+            bono_id, _, _ = await self._id_bono_pg(conn, fila['bono'])
+            await conn.execute('UPDATE registros SET bono_id = $1 WHERE bono = $2', bono_id, fila['bono'])
+            await conn.execute('UPDATE registros_archivo SET bono_id = $1 WHERE bono = $2', bono_id, fila['bono'])
+        
+        await conn.execute('''
+            ALTER TABLE registros DROP COLUMN bono;
+            ALTER TABLE registros ALTER COLUMN bono_id SET NOT NULL;
+            ALTER TABLE registros_archivo DROP COLUMN IF EXISTS bono;
+        ''')
+        logger.info(f"Bonos migrados al catálogo: {len(filas)} formas escritas")
+    
+    async def _id_bono_pg(self, conn, nombre):
+        """Devuelve (id, nombre canónico, creado) del bono; lo agrega al catálogo si no existe
+
+        Si otro proceso crea el mismo bono a la vez, el alias choca, se descarta
+        el bono recién insertado y se usa el del otro proceso.
+        """
+        clave = clave_bono(nombre)
+        fila = await conn.fetchrow('''
+            SELECT b.id, b.nombre FROM bonos_alias a JOIN bonos b ON b.id = a.bono_id WHERE a.alias = $1
+        ''', clave)
+        if fila:
+            return fila[0], fila[1], False
+        
+        nombre = ' '.join(str(nombre).split())
+        bono_id = await conn.fetchval('INSERT INTO bonos (nombre) VALUES ($1) RETURNING id', nombre)
+        agregado = await conn.fetchval('''
+            INSERT INTO bonos_alias (alias, bono_id) VALUES ($1, $2) ON CONFLICT DO NOTHING RETURNING bono_id
+        ''', clave, bono_id)
+        if agregado is None:
+            await conn.execute('DELETE FROM bonos WHERE id = $1', bono_id)
+            return await self._id_bono_pg(conn, nombre)
+        return bono_id, nombre, True
+    
+    def _consultar_indice_bonos(self):
+        """Lee todos los alias del catálogo y arma el índice"""
+        filas = self._consultar('fetch', 'SELECT a.alias, b.id, b.nombre FROM bonos_alias a JOIN bonos b ON b.id = a.bono_id')
+        return IndiceBonos([tuple(fila) for fila in filas])
+    
+    def agregar_alias_bono(self, texto, bono_id):
+        """Registra ``texto`` como otra forma de escribir el bono"""
+        self._consultar(
+            'execute', 'INSERT INTO bonos_alias (alias, bono_id) VALUES ($1, $2) ON CONFLICT DO NOTHING',
+            clave_bono(texto), bono_id
+        )
+        self.cache.invalidar([CLAVE_INDICE_BONOS])
+    
+    async def _reservar_cupo_pg(self, conn, bono_id, bono, asistentes):
+        """Descuenta los asistentes del cupo del bono, o lanza CupoAgotado si no alcanzan
+
+        El UPDATE condicional bloquea la fila del cupo: las reservas concurrentes
+        del mismo bono esperan su turno y ninguna ve lugares ya tomados.
+        """
+        disponibles = await conn.fetchval('''
+            UPDATE cupos SET disponibles = disponibles - $3
+            WHERE evento_id = $1 AND bono_id = $2 AND disponibles >= $3
+            RETURNING disponibles
+        ''', self.evento_id, bono_id, asistentes)
+        if disponibles is not None:
+            return
+        
+        disponibles = await conn.fetchval(
+            'SELECT disponibles FROM cupos WHERE evento_id = $1 AND bono_id = $2', self.evento_id, bono_id
+        )
+        if disponibles is not None:
+            raise CupoAgotado(bono, asistentes, disponibles)
+    
+    async def _bloquear_cupos_pg(self, conn):
+        """Bloquea los cupos del evento antes de eliminar, restaurar o cambiar de bono
+
+        Así ninguna reserva concurrente queda fuera del recálculo posterior: la
+        instantánea del recálculo se toma cuando ya no puede haber reservas en curso.
+        """
+        await conn.execute('SELECT 1 FROM cupos WHERE evento_id = $1 FOR UPDATE', self.evento_id)
+    
+    async def _recalcular_cupos_pg(self, conn):
+        """Vuelve a calcular los lugares disponibles del evento a partir de sus registros activos"""
+        await conn.execute('''
+            UPDATE cupos SET disponibles = capacidad - COALESCE((
+                SELECT SUM(asistentes) FROM registros r
+                WHERE r.evento_id = cupos.evento_id AND r.bono_id = cupos.bono_id AND r.eliminado_en IS NULL
+            ), 0)
+            WHERE evento_id = $1
+        ''', self.evento_id)
+    
+    async def _leer_filas_pg(self, conn, condicion, *args):
+        """Lee registros como diccionarios para guardarlos en el historial
+
+        La condición (con su FOR UPDATE, si lo lleva) se aplica a la tabla registros,
+        así el bloqueo no alcanza a la fila del bono que comparten muchos registros.
+        """
+        filas = await conn.fetch(f'''
+            SELECT {SELECCION_REGISTRO} FROM registros_bono
+            WHERE id IN (SELECT id FROM registros WHERE {condicion})
+        ''', *args)
+        return [dict(zip(COLUMNAS_REGISTRO, fila)) for fila in filas]
+    
+    async def _registrar_cambio_pg(self, conn, operacion, filas, usuario, antes=True, despues=True):
+        """Anota en el historial una mutación por fila, en un solo viaje"""
+        await conn.executemany('''
+            INSERT INTO cambios (evento_id, usuario, operacion, registro_id, antes, despues)
+            VALUES ($1, $2, $3, $4, $5, $6)
+        ''', [
+            (
+                self.evento_id,
+                None if usuario is None else str(usuario),
+                operacion,
+                fila_despues['id'] if fila_despues else fila_antes['id'],
+                None if fila_antes is None else json.dumps(fila_antes, ensure_ascii=False),
+                None if fila_despues is None else json.dumps(fila_despues, ensure_ascii=False)
+            )
+            for fila_antes, fila_despues in filas
+        ])
+    
+    def agregar_registro(self, grupo, guia, bono, monto, asistentes, usuario=None, clave=None):
+        """Agrega un nuevo registro y devuelve (id, nuevo); con una clave de idempotencia repetida, (original, False)"""
+        async def insertar(conn):
+            bono_id, nombre, bono_nuevo = await self._id_bono_pg(conn, bono)
+            registro_id = await conn.fetchval('''
+                INSERT INTO registros (evento_id, grupo, guia, bono_id, monto, asistentes, clave_idempotencia)
+                VALUES ($1, $2, $3, $4, $5, $6, $7)
+                ON CONFLICT (clave_idempotencia) WHERE clave_idempotencia IS NOT NULL DO NOTHING
+                RETURNING id
+            ''', self.evento_id, grupo, guia, bono_id, float(monto), int(asistentes), clave)
+            
+            if registro_id is None:
+                # El bono que se acaba de crear para este alta tampoco debe quedar
+                raise _Repetido(await conn.fetchval('SELECT id FROM registros WHERE clave_idempotencia = $1', clave))
+            
+            await self._reservar_cupo_pg(conn, bono_id, nombre, int(asistentes))
+            despues = (await self._leer_filas_pg(conn, 'id = $1', registro_id))[0]
+            await self._registrar_cambio_pg(conn, 'insertar', [(None, despues)], usuario)
+            return registro_id, despues, bono_nuevo
+        
+        try:
+            registro_id, despues, bono_nuevo = self._en_transaccion(insertar)
+        except _Repetido as repetido:
+            logger.info(f"Registro repetido (clave {clave[:12]}), se devuelve el #{repetido.registro_id}")
+            return repetido.registro_id, False
+        
+        self._invalidar_filas([despues])
+        if bono_nuevo:
+            self.cache.invalidar([CLAVE_INDICE_BONOS])
+        return registro_id, True
+    
+    def obtener_todos_registros(self):
+        """Obtiene todos los registros del evento"""
+        filas = self._consultar('fetch', f'''
+            SELECT {SELECCION_REGISTRO}
+            FROM registros_bono
+            WHERE evento_id = $1 AND eliminado_en IS NULL
+            ORDER BY fecha_creacion DESC
+        ''', self.evento_id)
+        return [Registro.desde_fila(None, fila) for fila in filas]
+    
+    def iterar_registros(self, por_bono=False, lote=500):
+        """Recorre los registros activos con un cursor del servidor, sin cargarlos todos"""
+        orden = 'bono, fecha_creacion' if por_bono else 'fecha_creacion DESC'
+        for fila in self._iterar(f'''
+            SELECT {SELECCION_REGISTRO}
+            FROM registros_bono
+            WHERE evento_id = $1 AND eliminado_en IS NULL
+            ORDER BY {orden}
+        ''', (self.evento_id,), lote):
+            yield Registro.desde_fila(None, fila)
+    
+    def _consultar_registros_por_bono(self, bono):
+        """Consulta los registros de un tipo de bono"""
+        filas = self._consultar('fetch', f'''
+            SELECT {SELECCION_REGISTRO}
+            FROM registros_bono
+            WHERE evento_id = $1 AND bono = $2 AND eliminado_en IS NULL
+            ORDER BY fecha_creacion DESC
+        ''', self.evento_id, bono)
+        return [Registro.desde_fila(None, fila) for fila in filas]
+    
+    def _consultar_tipos_bono(self):
+        """Consulta los tipos de bono únicos"""
+        filas = self._consultar(
+            'fetch',
+            'SELECT DISTINCT bono FROM registros_bono WHERE evento_id = $1 AND eliminado_en IS NULL ORDER BY bono',
+            self.evento_id
+        )
+        return [fila[0] for fila in filas]
+    
+    def _consultar_registro_por_id(self, registro_id):
+        """Consulta un registro por ID"""
+        fila = self._consultar('fetchrow', f'''
+            SELECT {SELECCION_REGISTRO}
+            FROM registros_bono
+            WHERE id = $1 AND evento_id = $2 AND eliminado_en IS NULL
+        ''', registro_id, self.evento_id)
+        return Registro.desde_fila(None, fila) if fila else None
+    
+    def _cambiar_bono(self, condicion, args, nuevo_bono, usuario, anterior=None):
+        """Cambia el bono de los registros activos que cumplen la condición y lo anota
+
+        Con ``anterior``, si ese bono se queda sin registros ni cupos se une al nuevo;
+        si el nuevo nombre lleva al mismo bono ('vip' → 'VIP'), solo se corrige cómo se escribe.
+        """
+        async def cambiar(conn):
+            await self._bloquear_cupos_pg(conn)
+            bono_id, nombre, _ = await self._id_bono_pg(conn, nuevo_bono)
+            mismo = anterior is not None and nombre == anterior
+            if mismo:
+                nombre = ' '.join(str(nuevo_bono).split())
+            antes = await self._leer_filas_pg(conn, f'{condicion} FOR UPDATE', *args)
+            await conn.execute(f'UPDATE registros SET bono_id = ${len(args) + 1} WHERE {condicion}', *args, bono_id)
+            if mismo:
+                await conn.execute('UPDATE bonos SET nombre = $1 WHERE id = $2', nombre, bono_id)
+            await self._recalcular_cupos_pg(conn)
+            await self._registrar_cambio_pg(
+                conn, 'actualizar', [(fila, dict(fila, bono=nombre)) for fila in antes], usuario
+            )
+            
+            if anterior is not None:
+                await conn.execute('''
+                    WITH viejo AS (
+                        SELECT id FROM bonos WHERE nombre = $1 AND id <> $2
+                            AND NOT EXISTS (SELECT 1 FROM registros WHERE bono_id = bonos.id)
+                            AND NOT EXISTS (SELECT 1 FROM registros_archivo WHERE bono_id = bonos.id)
+                            AND NOT EXISTS (SELECT 1 FROM cupos WHERE bono_id = bonos.id)
+                    ), movidos AS (
+                        UPDATE bonos_alias SET bono_id = $2 WHERE bono_id IN (SELECT id FROM viejo)
+                    )
+                    DELETE FROM bonos WHERE id IN (SELECT id FROM viejo)
+                ''', anterior, bono_id)
+            return antes, nombre, mismo
+        
+        antes, nombre, mismo = self._en_transaccion(cambiar)
+        if mismo:
+            # El nombre es del catálogo: cambia en todos los eventos y en todo lo guardado en caché
+            self.cache.invalidar()
+        else:
+            self._invalidar_filas(antes, nombre)
+            self.cache.invalidar([CLAVE_INDICE_BONOS])
+        return len(antes)
+    
+    def actualizar_bono(self, registro_id, nuevo_bono, usuario=None):
+        """Actualiza el tipo de bono de un registro"""
+        condicion = 'id = $1 AND evento_id = $2 AND eliminado_en IS NULL'
+        return self._cambiar_bono(condicion, (registro_id, self.evento_id), nuevo_bono, usuario) > 0
+    
+    def renombrar_bono(self, bono_actual, nuevo_bono, usuario=None):
+        """Cambia el nombre de un bono en todos sus registros en una sola transacción"""
+        condicion = 'evento_id = $1 AND bono_id IN (SELECT id FROM bonos WHERE nombre = $2) AND eliminado_en IS NULL'
+        return self._cambiar_bono(condicion, (self.evento_id, bono_actual), nuevo_bono, usuario, anterior=bono_actual)
+    
+    def _eliminar_pg(self, condicion, args, usuario):
+        """Marca como eliminados los registros activos que cumplen la condición
+
+        El número de lote sale de una secuencia, así dos procesos que eliminan a
+        la vez nunca comparten lote.
+        """
+        condicion = f'evento_id = $1 AND {condicion} AND eliminado_en IS NULL'
+        args = (self.evento_id,) + tuple(args)
+        
+        async def eliminar(conn):
+            await self._bloquear_cupos_pg(conn)
+            antes = await self._leer_filas_pg(conn, f'{condicion} FOR UPDATE', *args)
+            lote = await conn.fetchval("SELECT nextval('lotes_eliminacion')")
+            await conn.execute(f'''
+                UPDATE registros
+                SET eliminado_en = {AHORA}, lote_eliminacion = ${len(args) + 1}, eliminado_por = ${len(args) + 2}
+                WHERE {condicion}
+            ''', *args, lote, usuario)
+            await self._recalcular_cupos_pg(conn)
+            await self._registrar_cambio_pg(conn, 'eliminar', [(fila, None) for fila in antes], usuario)
+            return antes
+        
+        return self._en_transaccion(eliminar)
+    
+    def eliminar_registro(self, registro_id, usuario=None):
+        """Marca un registro como eliminado (se puede deshacer)"""
+        eliminados = self._eliminar_pg('id = $2', (registro_id,), usuario)
+        self._invalidar_filas(eliminados)
+        return len(eliminados) > 0
+    
+    def eliminar_registros_por_bono(self, bono, usuario=None):
+        """Marca como eliminados todos los registros de un tipo de bono"""
+        eliminados = self._eliminar_pg('bono_id IN (SELECT id FROM bonos WHERE nombre = $2)', (bono,), usuario)
+        self._invalidar_filas(eliminados, bono)
+        return len(eliminados)
+    
+    def limpiar_registros(self, usuario=None):
+        """Marca como eliminados todos los registros del evento"""
+        eliminados = self._eliminar_pg('TRUE', (), usuario)
+        self._invalidar_filas(eliminados)
+        return len(eliminados)
+    
+    def obtener_estadisticas(self):
+        """Obtiene estadísticas de los registros"""
+        async def leer(conn):
+            totales = await conn.fetchrow(
+                'SELECT COUNT(*), SUM(asistentes) FROM registros WHERE evento_id = $1 AND eliminado_en IS NULL',
+                self.evento_id
+            )
+            por_bono = await conn.fetch('''
+                SELECT bono, COUNT(*), SUM(asistentes), SUM(monto)
+                FROM registros_bono
+                WHERE evento_id = $1 AND eliminado_en IS NULL
+                GROUP BY bono_id, bono
+            ''', self.evento_id)
+            return totales, por_bono
+        
+        totales, por_bono = self._en_transaccion(leer)
+        return {
+            'total_registros': totales[0] or 0,
+            'total_asistentes': totales[1] or 0,
+            'por_bono': [tuple(fila) for fila in por_bono]
+        }
+    
+    def obtener_registros_por_dia(self):
+        """Obtiene registros, asistentes y monto agrupados por día de creación"""
+        filas = self._consultar('fetch', '''
+            SELECT to_char(fecha_creacion, 'YYYY-MM-DD') AS dia, COUNT(*), SUM(asistentes), SUM(monto)
+            FROM registros
+            WHERE evento_id = $1 AND eliminado_en IS NULL
+            GROUP BY dia
+            ORDER BY dia
+        ''', self.evento_id)
+        return [tuple(fila) for fila in filas]
+    
+    def obtener_nombres_capturados(self):
+        """Obtiene cada par (grupo, guía) activo con cuántos registros lo usan, en todos los eventos"""
+        filas = self._consultar('fetch', '''
+            SELECT grupo, guia, COUNT(*)
+            FROM registros
+            WHERE eliminado_en IS NULL
+            GROUP BY grupo, guia
+        ''')
+        return [tuple(fila) for fila in filas]
+    
+    def _consultar_cupos(self):
+        """Consulta los cupos del evento"""
+        filas = self._consultar('fetch', '''
+            SELECT b.nombre, c.capacidad, c.disponibles
+            FROM cupos c JOIN bonos b ON b.id = c.bono_id
+            WHERE c.evento_id = $1
+            ORDER BY b.nombre
+        ''', self.evento_id)
+        return {fila[0]: (fila[1], fila[2]) for fila in filas}
+    
+    def fijar_cupo(self, bono, capacidad):
+        """Fija la capacidad de un bono en el evento (None la quita) y devuelve (bono, disponibles)"""
+        async def fijar(conn):
+            await self._bloquear_cupos_pg(conn)
+            bono_id, nombre, bono_nuevo = await self._id_bono_pg(conn, bono)
+            if capacidad is None:
+                await conn.execute('DELETE FROM cupos WHERE evento_id = $1 AND bono_id = $2', self.evento_id, bono_id)
+                return nombre, None, bono_nuevo
+            
+            await conn.execute('''
+                INSERT INTO cupos (evento_id, bono_id, capacidad, disponibles) VALUES ($1, $2, $3, $3)
+                ON CONFLICT (evento_id, bono_id) DO UPDATE SET capacidad = excluded.capacidad
+            ''', self.evento_id, bono_id, int(capacidad))
+            await self._recalcular_cupos_pg(conn)
+            disponibles = await conn.fetchval(
+                'SELECT disponibles FROM cupos WHERE evento_id = $1 AND bono_id = $2', self.evento_id, bono_id
+            )
+            return nombre, disponibles, bono_nuevo
+        
+        nombre, disponibles, bono_nuevo = self._en_transaccion(fijar)
+        self.cache.invalidar([('cupos', self.evento_id)] + ([CLAVE_INDICE_BONOS] if bono_nuevo else []))
+        return nombre, disponibles
+    
+    def buscar_registros_por_grupo(self, grupo):
+        """Busca registros por nombre de grupo (sin distinguir mayúsculas)"""
+        filas = self._consultar('fetch', f'''
+            SELECT {SELECCION_REGISTRO}
+            FROM registros_bono
+            WHERE evento_id = $1 AND grupo ILIKE $2 AND eliminado_en IS NULL
+            ORDER BY fecha_creacion DESC
+        ''', self.evento_id, f'%{grupo}%')
+        return [Registro.desde_fila(None, fila) for fila in filas]
+    
+    def deshacer_eliminacion(self, minutos=MINUTOS_DESHACER, usuario=None):
+        """Restaura la última eliminación del usuario si sigue dentro de la ventana de deshacer"""
+        async def restaurar(conn):
+            lote = await conn.fetchval(f'''
+                SELECT MAX(lote_eliminacion)
+                FROM registros
+                WHERE evento_id = $1 AND eliminado_en IS NOT NULL
+                    AND eliminado_en >= {AHORA} - make_interval(mins => $2)
+                    AND eliminado_por IS NOT DISTINCT FROM $3
+            ''', self.evento_id, int(minutos), usuario)
+            if lote is None:
+                return []
+            
+            condicion = 'lote_eliminacion = $1 AND eliminado_en IS NOT NULL'
+            await self._bloquear_cupos_pg(conn)
+            restaurados = await self._leer_filas_pg(conn, f'{condicion} FOR UPDATE', lote)
+            await conn.execute(f'''
+                UPDATE registros
+                SET eliminado_en = NULL, lote_eliminacion = NULL, eliminado_por = NULL
+                WHERE {condicion}
+            ''', lote)
+            await self._recalcular_cupos_pg(conn)
+            await self._registrar_cambio_pg(conn, 'restaurar', [(None, fila) for fila in restaurados], usuario)
+            return restaurados
+        
+        restaurados = self._en_transaccion(restaurar)
+        self._invalidar_filas(restaurados)
+        return len(restaurados)
+    
+    def compactar(self, minutos=MINUTOS_DESHACER):
+        """Purga las eliminaciones fuera de la ventana de deshacer (el autovacuum libera el espacio)"""
+        resultado = self._consultar('execute', f'''
+            DELETE FROM registros
+            WHERE eliminado_en IS NOT NULL AND eliminado_en < {AHORA} - make_interval(mins => $1)
+        ''', int(minutos))
+        return int(resultado.split()[-1])
+    
+    def ultimo_cambio(self):
+        """Devuelve el número de secuencia del último cambio registrado"""
+        return self._consultar('fetchval', 'SELECT COALESCE(MAX(seq), 0) FROM cambios')
+    
+    def cambios_desde(self, seq=0, lote=500):
+        """Itera en orden los cambios del evento posteriores a la secuencia, con un cursor del servidor"""
+        for seq_cambio, fecha, usuario, operacion, registro_id, antes, despues in self._iterar('''
+            SELECT seq, to_char(fecha, 'YYYY-MM-DD HH24:MI:SS'), usuario, operacion, registro_id, antes, despues
+            FROM cambios
+            WHERE evento_id = $1 AND seq > $2
+            ORDER BY seq
+        ''', (self.evento_id, seq), lote):
+            yield {
+                'seq': seq_cambio,
+                'fecha': fecha,
+                'usuario': usuario,
+                'operacion': operacion,
+                'registro_id': registro_id,
+                'antes': json.loads(antes) if antes else None,
+                'despues': json.loads(despues) if despues else None
+            }
+    
+    # ================= BOLETOS =================
+    def emitir_boleto(self, registro_id, nonce):
+        """Guarda el boleto de un registro y devuelve su nonce (el ya guardado si existía)"""
+        return self._consultar('fetchval', '''
+            WITH nuevo AS (
+                INSERT INTO boletos (registro_id, nonce) VALUES ($1, $2)
+                ON CONFLICT (registro_id) DO NOTHING RETURNING nonce
+            )
+            SELECT nonce FROM nuevo UNION ALL SELECT nonce FROM boletos WHERE registro_id = $1
+            LIMIT 1
+        ''', registro_id, nonce)
+    
+    def obtener_boletos(self):
+        """Boletos de registros activos de todos los eventos
+
+        Lista de (registro_id, evento_id, nonce, grupo, asistentes, ingreso_en).
+        """
+        filas = self._consultar('fetch', '''
+            SELECT b.registro_id, r.evento_id, b.nonce, r.grupo, r.asistentes, b.ingreso_en
+            FROM boletos b JOIN registros r ON r.id = b.registro_id
+            WHERE r.eliminado_en IS NULL
+        ''')
+        return [tuple(fila) for fila in filas]
+    
+    def registrar_ingresos(self, ingresos):
+        """Anota con una sola sentencia una lista de (registro_id, fecha, usuario)
+
+        Devuelve los registro_id que ya tenían ingreso (se conserva el primero).
+        """
+        ids, fechas, usuarios = (list(columna) for columna in zip(*ingresos))
+        anotados = self._consultar('fetch', '''
+            UPDATE boletos b SET ingreso_en = v.fecha, ingreso_por = v.usuario
+            FROM unnest($1::bigint[], $2::timestamp[], $3::bigint[]) AS v(registro_id, fecha, usuario)
+            WHERE b.registro_id = v.registro_id AND b.ingreso_en IS NULL
+            RETURNING b.registro_id
+        ''', ids, fechas, usuarios)
+        anotados = {fila[0] for fila in anotados}
+        return [registro_id for registro_id in ids if registro_id not in anotados]
+    
+    # ================= EVENTOS =================
+    def obtener_eventos(self, incluir_archivados=False):
+        """Devuelve los eventos como lista de (id, nombre, archivo)"""
+        condicion = '' if incluir_archivados else 'WHERE archivo IS NULL'
+        filas = self._consultar('fetch', f'SELECT id, nombre, archivo FROM eventos {condicion} ORDER BY id')
+        return [tuple(fila) for fila in filas]
+    
+    def buscar_evento(self, nombre):
+        """Devuelve (id, nombre, archivo) del evento con ese nombre, sin distinguir mayúsculas"""
+        fila = self._consultar(
+            'fetchrow', 'SELECT id, nombre, archivo FROM eventos WHERE lower(nombre) = lower($1)', nombre.strip()
+        )
+        return tuple(fila) if fila else None
+    
+    def crear_evento(self, nombre):
+        """Crea un evento y devuelve su id"""
+        return self._consultar('fetchval', 'INSERT INTO eventos (nombre) VALUES ($1) RETURNING id', nombre.strip())
+    
+    def evento_del_chat(self, chat_id):
+        """Devuelve el evento activo de un chat (sin memorizar: otro proceso pudo cambiarlo)"""
+        evento_id = self._consultar('fetchval', 'SELECT evento_id FROM chats_evento WHERE chat_id = $1', chat_id)
+        return evento_id or EVENTO_POR_DEFECTO
+    
+    def asignar_evento_chat(self, chat_id, evento_id):
+        """Cambia el evento sobre el que trabaja un chat"""
+        self._consultar('execute', '''
+            INSERT INTO chats_evento (chat_id, evento_id) VALUES ($1, $2)
+            ON CONFLICT (chat_id) DO UPDATE SET evento_id = excluded.evento_id
+        ''', chat_id, evento_id)
+    
+    def archivar_evento(self, evento_id):
+        """Mueve los registros de un evento a la tabla registros_archivo
+
+        Devuelve (tabla_de_archivo, registros_movidos).
+        """
+        if evento_id == EVENTO_POR_DEFECTO:
+            raise ValueError('El evento por defecto no se puede archivar')
+        
+        async def archivar(conn):
+            resultado = await conn.execute(f'''
+                WITH movidos AS (DELETE FROM registros WHERE evento_id = $1 RETURNING *)
+                INSERT INTO registros_archivo ({COLUMNAS_TABLA}) SELECT {COLUMNAS_TABLA} FROM movidos
+            ''', evento_id)
+            await conn.execute("UPDATE eventos SET archivo = 'registros_archivo' WHERE id = $1", evento_id)
+            await conn.execute('DELETE FROM chats_evento WHERE evento_id = $1', evento_id)
+            return int(resultado.split()[-1])
+        
+        registros_movidos = self._en_transaccion(archivar)
+        self.cache.invalidar()
+        return 'registros_archivo', registros_movidos
+    
+    # ================= MARCAS, ROLES Y SUSCRIPCIONES =================
+    def obtener_marca_exportacion(self, nombre):
+        """Devuelve la última secuencia exportada para una exportación, o None"""
+        return self._consultar('fetchval', 'SELECT ultimo_seq FROM exportaciones WHERE nombre = $1', nombre)
+    
+    def guardar_marca_exportacion(self, nombre, seq):
+        """Guarda la última secuencia exportada para una exportación"""
+        self._consultar('execute', f'''
+            INSERT INTO exportaciones (nombre, ultimo_seq, fecha)
+            VALUES ($1, $2, {AHORA})
+            ON CONFLICT (nombre) DO UPDATE SET ultimo_seq = excluded.ultimo_seq, fecha = excluded.fecha
+        ''', nombre, seq)
+    
+    def obtener_roles(self):
+        """Devuelve un diccionario usuario_id -> rol"""
+        return dict(tuple(fila) for fila in self._consultar('fetch', 'SELECT usuario_id, rol FROM roles'))
+    
+    def guardar_rol(self, usuario_id, rol, otorgado_por=None):
+        """Asigna un rol a un usuario, o se lo quita si rol es None"""
+        if rol is None:
+            self._consultar('execute', 'DELETE FROM roles WHERE usuario_id = $1', usuario_id)
+            return
+        
+        self._consultar('execute', f'''
+            INSERT INTO roles (usuario_id, rol, otorgado_por, fecha)
+            VALUES ($1, $2, $3, {AHORA})
+            ON CONFLICT (usuario_id) DO UPDATE SET
+                rol = excluded.rol, otorgado_por = excluded.otorgado_por, fecha = excluded.fecha
+        ''', usuario_id, rol, otorgado_por)
+    
+    def obtener_suscripciones(self):
+        """Devuelve las suscripciones a resúmenes como lista de (chat_id, frecuencia)"""
+        return [tuple(fila) for fila in self._consultar('fetch', 'SELECT chat_id, frecuencia FROM suscripciones')]
+    
+    def guardar_suscripcion(self, chat_id, frecuencia, activa, usuario_id=None):
+        """Suscribe un chat a un resumen, o lo da de baja si activa es False"""
+        if not activa:
+            self._consultar('execute', 'DELETE FROM suscripciones WHERE chat_id = $1 AND frecuencia = $2', chat_id, frecuencia)
+            return
+        
+        self._consultar('execute', f'''
+            INSERT INTO suscripciones (chat_id, frecuencia, usuario_id, fecha)
+            VALUES ($1, $2, $3, {AHORA})
+            ON CONFLICT (chat_id, frecuencia) DO UPDATE SET usuario_id = excluded.usuario_id, fecha = excluded.fecha
+        ''', chat_id, frecuencia, usuario_id)
@@ -0,0 +1,99 @@
+import logging
+from collections import Counter
+
+from bonos import clave_bono
+
+logger = logging.getLogger(__name__)
+
+# Sugerencias por consulta inline (Telegram admite hasta 50)
+MAXIMO_RESULTADOS = 10
+
+# Clave de un nodo del trie con sus mejores nombres (ninguna letra es la cadena vacía)
+MEJORES = ''
+
+class TriePrefijos:
+    """Nombres distintos de un campo, buscables por el inicio de cualquiera de sus palabras
+
+    Cada nombre se guarda por su clave normalizada (la misma que usan los bonos),
+    insertada una vez por cada palabra en que empieza: "juv" y "san" encuentran
+    "Juventud San José". Cada nodo guarda ya ordenados los ``tamano`` nombres más
+    usados bajo él; como los usos solo crecen, basta reacomodar los nodos del
+    camino al agregar, y buscar cuesta lo que mide el prefijo. Se muestra la
+    forma escrita más usada de cada nombre.
+    """
+    
+    def __init__(self, tamano=MAXIMO_RESULTADOS):
+        self.tamano = tamano
+        self._raiz = {}
+        self._formas = {}
+        self._usos = {}
+    
+    def _subir(self, nodo, clave):
+        """Acomoda la clave entre los mejores del nodo tras aumentar sus usos"""
+        mejores = nodo.setdefault(MEJORES, [])
+        if clave not in mejores:
+            mejores.append(clave)
+        mejores.sort(key=lambda c: (-self._usos[c], c))
+        del mejores[self.tamano:]
+    
+    def agregar(self, nombre, veces=1):
+        """Suma ``veces`` usos del nombre y actualiza los nodos de sus palabras"""
+        nombre = ' '.join(str(nombre).split())
+        clave = clave_bono(nombre)
+        if not clave:
+            return
+        
+        self._formas.setdefault(clave, Counter())[nombre] += veces
+        self._usos[clave] = self._usos.get(clave, 0) + veces
+        
+        self._subir(self._raiz, clave)
+        palabras = clave.split(' ')
+        for inicio in range(len(palabras)):
+            nodo = self._raiz
+            for letra in ' '.join(palabras[inicio:]):
+                nodo = nodo.setdefault(letra, {})
+                self._subir(nodo, clave)
+    
+    def buscar(self, prefijo, limite=MAXIMO_RESULTADOS):
+        """Lista de (nombre, usos) cuyo nombre tiene una palabra que empieza con el prefijo"""
+        nodo = self._raiz
+        for letra in clave_bono(prefijo):
+            nodo = nodo.get(letra)
+            if nodo is None:
+                return []
+        
+        return [
+            (self._formas[clave].most_common(1)[0][0], self._usos[clave])
+            for clave in nodo.get(MEJORES, [])[:limite]
+        ]
+    
+    def __len__(self):
+        return len(self._formas)
+
+class Directorio:
+    """Grupos y guías ya capturados, en memoria, para autocompletar con consultas inline
+
+    Se carga una vez desde la base de datos y se actualiza con cada registro
+    nuevo; los nombres de registros eliminados se siguen sugiriendo.
+    """
+    
+    def __init__(self):
+        self.campos = {'grupo': TriePrefijos(), 'guia': TriePrefijos()}
+    
+    def cargar(self, db):
+        """Llena el directorio con los nombres capturados en todos los eventos"""
+        for grupo, guia, veces in db.obtener_nombres_capturados():
+            self.agregar(grupo, guia, veces)
+        logger.info(
+            f"Directorio: {len(self.campos['grupo'])} grupos y {len(self.campos['guia'])} guías"
+        )
+        return self
+    
+    def agregar(self, grupo, guia, veces=1):
+        """Anota los nombres de un registro recién guardado"""
+        self.campos['grupo'].agregar(grupo, veces)
+        self.campos['guia'].agregar(guia, veces)
+    
+    def buscar(self, campo, prefijo, limite=MAXIMO_RESULTADOS):
+        """Sugerencias de ``campo`` ('grupo' o 'guia') para lo que se lleva escrito"""
+        return self.campos[campo].buscar(prefijo, limite)
@@ -0,0 +1,76 @@
+import csv
+import logging
+
+from database import COLUMNAS_REGISTRO
+
+logger = logging.getLogger(__name__)
+
+ENCABEZADOS_CSV = ['ID', 'GRUPO', 'GUIA', 'BONO', 'MONTO', 'ASISTENTES', 'FECHA']
+
+def exportar_delta_csv(db, filename, nombre):
+    """Escribe solo los registros nuevos, modificados o eliminados desde la última exportación
+
+    La primera vez (sin marca de agua) se exporta la tabla completa como línea base.
+    Devuelve el número de filas escritas.
+    """
+    ultimo_seq = db.obtener_marca_exportacion(nombre)
+    
+    if ultimo_seq is None:
+        # Línea base: se toma la secuencia antes de leer para no perder cambios concurrentes
+        seq_actual = db.ultimo_cambio()
+        filas = [registro.fila() + ('alta',) for registro in db.obtener_todos_registros()]
+    else:
+        # Solo interesa el último estado de cada registro tocado desde la marca
+        seq_actual = ultimo_seq
+        ultimo_estado = {}
+        for cambio in db.cambios_desde(ultimo_seq):
+            seq_actual = cambio['seq']
+            if cambio['operacion'] == 'eliminar':
+                ultimo_estado[cambio['registro_id']] = (cambio['antes'], 'baja')
+            elif cambio['operacion'] == 'actualizar':
+                ultimo_estado[cambio['registro_id']] = (cambio['despues'], 'modificacion')
+            else:
+                ultimo_estado[cambio['registro_id']] = (cambio['despues'], 'alta')
+        
+        filas = [
+            tuple(fila[columna] for columna in COLUMNAS_REGISTRO) + (operacion,)
+            for fila, operacion in ultimo_estado.values()
+        ]
+    
+    with open(filename, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(ENCABEZADOS_CSV + ['OPERACION'])
+        writer.writerows(filas)
+    
+    db.guardar_marca_exportacion(nombre, seq_actual)
+    return len(filas)
+
+def exportar_columnar(db, filename, formato='parquet'):
+    """Escribe una instantánea columnar (Parquet o Arrow) de los registros activos"""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError('pyarrow no está instalado; no se pueden generar archivos Parquet/Arrow')
+    
+    registros = db.obtener_todos_registros()
+    columnas = list(zip(*(registro.fila() for registro in registros))) if registros else [()] * len(COLUMNAS_REGISTRO)
+    
+    tabla = pa.table({
+        'id': pa.array(columnas[0], type=pa.int64()),
+        'grupo': pa.array(columnas[1], type=pa.string()),
+        'guia': pa.array(columnas[2], type=pa.string()),
+        'bono': pa.array(columnas[3], type=pa.string()),
+        'monto': pa.array(columnas[4], type=pa.float64()),
+        'asistentes': pa.array(columnas[5], type=pa.int64()),
+        'fecha_creacion': pa.array(columnas[6], type=pa.string()),
+    })
+    
+    if formato == 'parquet':
+        pq.write_table(tabla, filename)
+    else:
+        with pa.OSFile(filename, 'wb') as sink:
+            with pa.ipc.new_file(sink, tabla.schema) as writer:
+                writer.write_table(tabla)
+    
+    return tabla.num_rows
@@ -0,0 +1,53 @@
+import io
+import asyncio
+import logging
+
+from procesos import obtener_pool
+
+logger = logging.getLogger(__name__)
+
+def renderizar_graficas(por_dia, por_bono):
+    """Dibuja registros por día y monto por bono y devuelve el PNG en bytes
+
+    Se ejecuta en un proceso aparte, así que solo recibe y devuelve datos simples.
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    
+    fig, (ax_dia, ax_bono) = plt.subplots(1, 2, figsize=(12, 5))
+    
+    dias = [dia for dia, _, _, _ in por_dia]
+    registros = [cantidad for _, cantidad, _, _ in por_dia]
+    ax_dia.bar(dias, registros, color='#4a90d9')
+    ax_dia.plot(dias, [sum(registros[:i + 1]) for i in range(len(registros))], color='#d94a4a', marker='o', label='Acumulado')
+    ax_dia.set_title('Registros por día')
+    ax_dia.legend()
+    ax_dia.tick_params(axis='x', rotation=45)
+    
+    bonos = [bono for bono, _, _, _ in por_bono]
+    montos = [float(monto or 0) for _, _, _, monto in por_bono]
+    ax_bono.barh(bonos, montos, color='#5cb85c')
+    ax_bono.set_title('Monto por bono')
+    ax_bono.xaxis.set_major_formatter(matplotlib.ticker.StrMethodFormatter('${x:,.0f}'))
+    
+    fig.suptitle('Congreso 2026')
+    fig.tight_layout()
+    
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='png', dpi=100)
+    plt.close(fig)
+    return buffer.getvalue()
+
+async def generar_grafica(db):
+    """Renderiza la gráfica en el pool de procesos sin bloquear el event loop
+
+    Devuelve None si no hay registros.
+    """
+    stats = db.obtener_estadisticas()
+    if not stats['total_registros']:
+        return None
+    por_dia = db.obtener_registros_por_dia()
+    
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(obtener_pool(), renderizar_graficas, por_dia, stats['por_bono'])
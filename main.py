@@ -1,215 +1,299 @@
 import os
-import csv
+import asyncio
 import logging
 import threading
-import sqlite3
-from datetime import datetime
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Application, CommandHandler, MessageHandler, ConversationHandler, ContextTypes, CallbackQueryHandler
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InlineQueryResultArticle, InputTextMessageContent
+from telegram.ext import Application, CommandHandler, MessageHandler, ConversationHandler, ContextTypes, CallbackQueryHandler, TypeHandler, InlineQueryHandler
 from telegram.ext import filters
+from telegram.constants import ParseMode
+from telegram.error import Forbidden, TelegramError
 from flask import Flask
 
+from database import abrir_base_datos, CupoAgotado, DATABASE_URL, MINUTOS_DESHACER, clave_idempotencia
+from exportar import exportar_delta_csv, exportar_columnar
+from reportes import ESCRITORES, generar_reporte as construir_reporte
+from analisis import Analitica, DIMENSIONES
+from graficas import generar_grafica
+from cache_archivos import CacheArchivos
+from permisos import Permisos, NIVELES
+from antiabuso import Antiabuso
+from replica import Replica
+from respaldos import Respaldos, TAMANO_MAXIMO_ENVIO
+from modelo import formatear_monto, formatear_cupo
+from concurrencia import ProcesadorOrdenado, por_chat
+from mensajes import Plantilla, responder, dividir
+from directorio import Directorio
+from resumenes import Resumenes, FRECUENCIAS, HORA_RESUMEN_DIARIO, segundos_para_la_hora
+from bitacora import configurar_logging
+from boletos import Boletos, generar_qr, decodificar_qr, VALIDO, USADO, OTRO_EVENTO, NO_VIGENTE, INVALIDO
+
 # ================= CONFIGURACIÓN =================
 GRUPO, GUIA, BONO, MONTO, ASISTENTES = range(5)
 CORREGIR_BONO, NUEVO_BONO, ELIMINAR_BONO = range(5, 8)
 
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+# Logging en JSON a través de una cola: los handlers nunca esperan a que se escriba
+configurar_logging()
 logger = logging.getLogger(__name__)
 
-# ================= BASE DE DATOS =================
-class Database:
-    def __init__(self, db_name="congreso.db"):
-        self.db_name = db_name
-        self.init_db()
-    
-    def init_db(self):
-        """Inicializa la base de datos y crea la tabla si no existe"""
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS registros (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                grupo TEXT NOT NULL,
-                guia TEXT NOT NULL,
-                bono TEXT NOT NULL,
-                monto REAL NOT NULL,
-                asistentes INTEGER NOT NULL,
-                fecha_creacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        conn.commit()
-        conn.close()
-        print("✅ Base de datos inicializada")
-    
-    def agregar_registro(self, grupo, guia, bono, monto, asistentes):
-        """Agrega un nuevo registro a la base de datos"""
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO registros (grupo, guia, bono, monto, asistentes)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (grupo, guia, bono, float(monto), int(asistentes)))
-        
-        conn.commit()
-        registro_id = cursor.lastrowid
-        conn.close()
-        
-        return registro_id
-    
-    def obtener_todos_registros(self):
-        """Obtiene todos los registros de la base de datos"""
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT id, grupo, guia, bono, monto, asistentes, fecha_creacion 
-            FROM registros 
-            ORDER BY fecha_creacion DESC
-        ''')
-        
-        registros = cursor.fetchall()
-        conn.close()
-        
-        return registros
-    
-    def obtener_registros_por_bono(self, bono):
-        """Obtiene registros por tipo de bono"""
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT id, grupo, guia, bono, monto, asistentes, fecha_creacion 
-            FROM registros 
-            WHERE bono = ?
-            ORDER BY fecha_creacion DESC
-        ''', (bono,))
-        
-        registros = cursor.fetchall()
-        conn.close()
-        
-        return registros
-    
-    def obtener_tipos_bono(self):
-        """Obtiene todos los tipos de bono únicos"""
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT DISTINCT bono FROM registros ORDER BY bono')
-        bonos = [row[0] for row in cursor.fetchall()]
-        
-        conn.close()
-        return bonos
-    
-    def obtener_registro_por_id(self, registro_id):
-        """Obtiene un registro específico por ID"""
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT id, grupo, guia, bono, monto, asistentes, fecha_creacion 
-            FROM registros 
-            WHERE id = ?
-        ''', (registro_id,))
-        
-        registro = cursor.fetchone()
-        conn.close()
-        
-        return registro
-    
-    def actualizar_bono(self, registro_id, nuevo_bono):
-        """Actualiza el tipo de bono de un registro"""
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            UPDATE registros 
-            SET bono = ? 
-            WHERE id = ?
-        ''', (nuevo_bono, registro_id))
-        
-        conn.commit()
-        filas_afectadas = cursor.rowcount
-        conn.close()
-        
-        return filas_afectadas > 0
-    
-    def eliminar_registro(self, registro_id):
-        """Elimina un registro por ID"""
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-        
-        cursor.execute('DELETE FROM registros WHERE id = ?', (registro_id,))
-        
-        conn.commit()
-        filas_afectadas = cursor.rowcount
-        conn.close()
-        
-        return filas_afectadas > 0
-    
-    def eliminar_registros_por_bono(self, bono):
-        """Elimina todos los registros de un tipo de bono"""
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-        
-        cursor.execute('DELETE FROM registros WHERE bono = ?', (bono,))
-        
-        conn.commit()
-        filas_afectadas = cursor.rowcount
-        conn.close()
-        
-        return filas_afectadas
-    
-    def obtener_estadisticas(self):
-        """Obtiene estadísticas de los registros"""
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT COUNT(*), SUM(asistentes) FROM registros')
-        total_registros, total_asistentes = cursor.fetchone()
-        
-        cursor.execute('''
-            SELECT bono, COUNT(*), SUM(asistentes), SUM(monto)
-            FROM registros 
-            GROUP BY bono
-        ''')
-        
-        estadisticas_bono = cursor.fetchall()
-        conn.close()
-        
-        return {
-            'total_registros': total_registros or 0,
-            'total_asistentes': total_asistentes or 0,
-            'por_bono': estadisticas_bono
-        }
+# ================= PLANTILLAS =================
+INICIO = Plantilla(
+    '¡Hola! 🤖\n'
+    'Vamos a capturar datos para el Congreso 2026.\n\n'
+    'Por favor, ingresa el **NOMBRE DEL GRUPO**:'
+)
+CAMPO_GUARDADO = Plantilla('✅ {campo} guardado. {indicacion} **{siguiente}**:')
+BONO_SUGERENCIAS = Plantilla('🤔 El bono {bono} no está en el catálogo. ¿Quisiste decir alguno de estos?')
+REGISTRO_COMPLETADO = Plantilla(
+    '🎉 **REGISTRO #{registro_id} COMPLETADO!**\n\n'
+    '📋 Resumen:\n'
+    '• 🏷️ Grupo: {grupo}\n'
+    '• 👤 Guía: {guia}\n'
+    '• 🎫 Bono: {bono}\n'
+    '• 💰 Monto: {monto}\n'
+    '• 👥 Asistentes: {asistentes}\n\n'
+    '💾 **Guardado en base de datos**\n\n'
+    'Usa /nuevo para otro registro o /corregir para editar bonos'
+)
+MENU_ELIMINAR = Plantilla(
+    '🗑️ **ELIMINACIÓN DE BONOS**\n\n'
+    'Selecciona el tipo de bono que quieres eliminar:\n\n'
+    '⚠️ **ADVERTENCIA:** Esto eliminará TODOS los registros del bono seleccionado.'
+)
+BUSCAR_POR_ID = Plantilla(
+    '🔍 **BUSCAR REGISTRO POR ID**\n\n'
+    'Por favor, ingresa el **ID del registro** que quieres eliminar:'
+)
+CONFIRMAR_ELIMINAR_BONO = Plantilla(
+    '⚠️ **ELIMINAR TODOS los registros de: {bono}**\n\n'
+    '📋 **Registros encontrados:** {cantidad}\n\n'
+    '• 👥 Total asistentes: {asistentes}\n'
+    '• 💰 Total monto: {monto}\n\n'
+    '¿Estás seguro de que quieres eliminar TODOS estos registros?'
+)
+BONO_ELIMINADO = Plantilla(
+    '✅ **ELIMINACIÓN COMPLETADA**\n\n'
+    '• 🎫 Bono eliminado: `{bono}`\n'
+    '• 📊 Registros eliminados: {cantidad}\n\n'
+    '↩️ Usa /deshacer en los próximos {minutos} minutos para restaurarlos.'
+)
+REGISTRO_ENCONTRADO = Plantilla(
+    '🔍 **REGISTRO ENCONTRADO**\n\n'
+    '• 🆔 ID: {registro.id}\n'
+    '• 🏷️ Grupo: {registro.grupo}\n'
+    '• 👤 Guía: {registro.guia}\n'
+    '• 🎫 Bono: {registro.bono}\n'
+    '• 💰 Monto: {registro.monto_texto}\n'
+    '• 👥 Asistentes: {registro.asistentes}\n'
+    '• 📅 Fecha: {registro.dia}\n\n'
+    '¿Estás seguro de que quieres eliminar este registro?'
+)
+REGISTRO_ELIMINADO = Plantilla(
+    '✅ **REGISTRO ELIMINADO**\n\n'
+    '• 🆔 ID: {registro.id}\n'
+    '• 🏷️ Grupo: {registro.grupo}\n'
+    '• 🎫 Bono: {registro.bono}\n'
+    '• 💰 Monto: {registro.monto_texto}\n\n'
+    '↩️ Usa /deshacer en los próximos {minutos} minutos para restaurarlo.'
+)
+ELIMINACION_DESHECHA = Plantilla('↩️ **ELIMINACIÓN DESHECHA**\n\n• 📊 Registros restaurados: {cantidad}')
+DUPLICADOS_CABECERA = Plantilla('🔁 **POSIBLES DUPLICADOS: {cantidad} grupos**\n\n')
+DUPLICADOS_GRUPO = Plantilla('🏷️ {primero.grupo} | 👤 {primero.guia} | 🎫 {primero.bono}\n   🆔 {ids}\n\n')
+DUPLICADOS_PIE = Plantilla('💡 Usa /eliminar para borrar los que sobren.')
+OTORGAR_USO = Plantilla(
+    '🔐 **OTORGAR ROL**\n\n'
+    'Uso: /otorgar <id_usuario> <{roles}>\n\n'
+    'Ejemplo: /otorgar 123456789 guia'
+)
+CUPO_USO = Plantilla(
+    '🪑 **CUPOS POR BONO**\n\n'
+    'Uso: /cupo <bono> <capacidad|libre>\n\n'
+    'Ejemplo: /cupo VIP 50'
+)
+CUPOS_CABECERA = Plantilla('🪑 **CUPOS DEL EVENTO**\n\n')
+CUPO_FIJADO = Plantilla('🪑 Cupo de {bono}: {estado}')
+CUPO_QUITADO = Plantilla('🪑 {bono} ya no tiene límite de lugares')
+BONO_AGOTADO = Plantilla('❌ El bono {bono} está {estado}. Ingresa otro **BONO**:')
+SIN_CUPO = Plantilla('❌ No hay cupo suficiente en {bono}: pides {solicitados} y quedan {disponibles}')
+SIN_CUPO_REINTENTAR = Plantilla('\n\nIngresa menos **ASISTENTES** o usa /cancel')
+SIN_CUPO_OTRO_BONO = Plantilla('\n\nUsa /nuevo para elegir otro bono')
+BOLETO = Plantilla('🎟️ **Boleto del registro #{registro_id}**\n\nMuéstralo en la entrada\n`{codigo}`')
+BOLETOS_NO_DISPONIBLES = Plantilla('🎟️ Los boletos no están disponibles: falta configurar SECRETO_BOLETOS o BOT_TOKEN')
+CHECKIN_ACTIVO = Plantilla(
+    '🚪 **MODO PUERTA ACTIVO**\n\n'
+    '📊 Ingresos: {ingresados} de {vigentes} boletos\n\n'
+    'Envía la foto del QR o el código de cada boleto\n'
+    'Usa /checkin otra vez para salir'
+)
+CHECKIN_TERMINADO = Plantilla('🚪 Modo puerta terminado. Ingresos: {ingresados} de {vigentes} boletos')
+INGRESOS = {
+    VALIDO: Plantilla('✅ **#{d[registro_id]} {d[grupo]}** · 👥 {d[asistentes]}'),
+    USADO: Plantilla('⚠️ **#{d[registro_id]} {d[grupo]}** ya ingresó a las {d[ingreso]:%H:%M} (UTC)'),
+    OTRO_EVENTO: Plantilla('❌ El boleto #{d[registro_id]} es de otro evento'),
+    NO_VIGENTE: Plantilla('❌ Boleto no vigente: el registro se eliminó'),
+    INVALIDO: Plantilla('❌ Código de boleto no válido'),
+}
+SIN_QR = Plantilla('❌ No se encontró un código QR en la foto')
+RESUMENES_USO = Plantilla(
+    '📬 **RESÚMENES PROGRAMADOS**\n\n'
+    'Uso: /suscribir [hora|dia] · /desuscribir [hora|dia]\n\n'
+    'Este chat recibe: {actuales}'
+)
+SUSCRITO = Plantilla('📬 Este chat recibirá el resumen {frecuencias}')
+DESUSCRITO = Plantilla('📭 Este chat ya no recibirá el resumen {frecuencias}')
+RESUMEN_CABECERA = Plantilla('📬 **RESUMEN {periodo}: {evento}**\n\n')
+RESUMEN_CAMBIOS = Plantilla('🆕 Desde el resumen anterior: {registros:+d} registros, {asistentes:+d} asistentes\n\n')
+RESUMEN_TOTALES = Plantilla(
+    '📈 Total registros: {stats[total_registros]}\n'
+    '👥 Total asistentes: {stats[total_asistentes]}\n\n'
+)
+RESUMEN_INGRESOS = Plantilla('\n🚪 Ingresos: {ingresados} de {vigentes} boletos\n')
+EVENTOS_CABECERA = Plantilla('🗓️ **EVENTOS**\n\n')
+EVENTO_FILA = Plantilla('{marca} {nombre}\n')
+EVENTOS_PIE = Plantilla('\nUso: /evento <nombre>')
+EVENTO_ARCHIVADO = Plantilla(
+    '🗄️ **EVENTO ARCHIVADO**\n\n'
+    '🗓️ Evento: {evento}\n'
+    '📦 Registros movidos: {cantidad}\n'
+    '💾 Archivo: {archivo}'
+)
+MENU_CORREGIR = Plantilla(
+    '🔧 **CORRECCIÓN DE BONOS**\n\n'
+    'Selecciona el tipo de bono que quieres corregir:'
+)
+REGISTROS_BONO_CABECERA = Plantilla('📋 **Registros con bono: {bono}**\n\n')
+REGISTRO_BONO_FILA = Plantilla(
+    '{i}. #{registro.id} - {registro.grupo} ({registro.guia})\n'
+    '   👥{registro.asistentes} 💰{registro.monto_texto} 📅{registro.dia}\n\n'
+)
+PREGUNTA_ACCION = Plantilla('¿Qué acción deseas realizar?')
+CAMBIAR_BONO = Plantilla(
+    '✏️ **CAMBIAR BONO: {bono}**\n\n'
+    'Vas a cambiar TODOS los registros con bono "{bono}"\n\n'
+    'Por favor, escribe el **NUEVO NOMBRE** para este bono:'
+)
+CORRECCION_COMPLETADA = Plantilla(
+    '✅ **CORRECCIÓN COMPLETADA**\n\n'
+    '• Bono anterior: `{anterior}`\n'
+    '• Bono nuevo: `{nuevo}`\n'
+    '• Registros actualizados: {cantidad}\n\n'
+    '📊 Los cambios se han aplicado a todos los registros.'
+)
+ESTADISTICAS_CABECERA = Plantilla(
+    '📊 **ESTADÍSTICAS DEL CONGRESO**\n\n'
+    '📈 Total registros: {stats[total_registros]}\n'
+    '👥 Total asistentes: {stats[total_asistentes]}\n\n'
+)
+ESTADISTICAS_POR_BONO = Plantilla('🎫 **Por tipo de bono:**\n')
+ESTADISTICAS_BONO = Plantilla('• {bono}: {cantidad} reg, {asistentes} asis, ${monto:,.2f}\n')
+ESTADISTICAS_CUPOS = Plantilla('\n🪑 **Cupos:**\n')
+CUPO_FILA = Plantilla('• {bono}: {estado}\n')
+LEYENDA = Plantilla('\n{leyenda}')
+ANALISIS_RESUMEN = Plantilla(
+    '🔬 **ANÁLISIS DEL CONGRESO**\n\n'
+    '📈 Registros: {r[registros]} | 👥 Asistentes: {r[asistentes]} | 💰 ${r[monto]:,.2f}\n'
+    '💰 Monto promedio: ${r[monto_promedio]:,.2f} '
+    '(p50 ${m[p50]:,.2f}, p90 ${m[p90]:,.2f}, p99 ${m[p99]:,.2f})\n'
+    '👥 Asistentes promedio: {r[asistentes_promedio]:.1f} '
+    '(p50 {a[p50]:g}, p90 {a[p90]:g}, p99 {a[p99]:g})\n'
+)
+ANALISIS_TITULO = Plantilla('\n**{titulo}:**\n')
+ANALISIS_GRUPO = Plantilla(
+    '• {g[etiqueta]}: {g[registros]} reg, {g[asistentes]} asis, '
+    '${g[monto]:,.2f} (prom ${g[monto_promedio]:,.2f})\n'
+)
+AYUDA = Plantilla(
+    "🤖 **COMANDOS DISPONIBLES:**\n\n"
+    "🚀 /start - Iniciar captura de datos\n"
+    "📝 /nuevo - Nuevo registro\n"
+    "🔧 /corregir - Corregir tipos de bono\n"
+    "🗑️ /eliminar - Eliminar registros\n"
+    "↩️ /deshacer - Deshacer tu última eliminación\n"
+    "🔁 /duplicados - Buscar registros duplicados\n"
+    "🔐 /otorgar - Asignar roles (solo administradores)\n"
+    "🪑 /cupo - Ver o fijar los lugares de cada bono\n"
+    "🚪 /checkin - Modo puerta: validar boletos QR\n"
+    "📬 /suscribir [hora|dia] - Recibir resúmenes programados en este chat\n"
+    "📭 /desuscribir [hora|dia] - Dejar de recibirlos\n"
+    "🗓️ /evento - Ver o cambiar el evento del chat\n"
+    "🗄️ /archivar - Archivar un evento terminado\n"
+    "💾 /respaldo - Respaldo completo de la base de datos\n"
+    "🔎 @bot texto - Autocompletar grupo o guía durante la captura\n"
+    "📊 /reporte - Generar CSV desde BD\n"
+    "📑 /reporte xlsx | pdf | zip - Excel por bono, resumen PDF o ZIP por bono\n"
+    "🔁 /reporte delta - Solo cambios desde el último delta\n"
+    "🗂️ /reporte parquet | arrow - Instantánea columnar\n"
+    "📈 /estadisticas - Ver estadísticas\n"
+    "🔬 /analisis - Promedios, percentiles y top por guía/bono/día/hora\n"
+    "📉 /grafica - Gráfica de registros y monto por bono\n"
+    "🧹 /limpiar - Limpiar base de datos\n"
+    "ℹ️ /ayuda - Mostrar esta ayuda\n\n"
+    "💾 **Sistema con corrección y eliminación de bonos**"
+)
+
+# ================= INICIALIZAR DB =================
+db = abrir_base_datos("congreso.db")
+analiticas = {}
+cache_archivos = CacheArchivos()
+permisos = Permisos(db)
+antiabuso = Antiabuso()
+replica = Replica(db)
+respaldos = Respaldos(db.db_name)
+directorio = Directorio().cargar(db)
+try:
+    boletos = Boletos(db)
+except RuntimeError as e:
+    # Sin secreto los boletos serían falsificables: se desactivan y el resto del bot sigue
+    logger.warning(f"Boletos desactivados: {e}")
+    boletos = None
+resumenes = Resumenes(db, replica, boletos)
+
+async def db_del_chat(update):
+    """Base de datos limitada al evento en el que trabaja el chat"""
+    return db.del_evento(await db.asincrona.evento_del_chat(update.effective_chat.id))
+
+def etiqueta_bono(bono, cupos):
+    """Nombre del bono para un botón, con sus lugares libres si tiene cupo"""
+    if bono not in cupos:
+        return bono
+    return f"{bono} · {formatear_cupo(*cupos[bono])}"
+
+async def enviar_boleto(update, db_evento, registro_id, grupo, asistentes):
+    """Emite el boleto del registro y lo envía como QR (solo el código si no se puede dibujar)"""
+    if boletos is None:
+        await responder(update, BOLETOS_NO_DISPONIBLES.render())
+        return
     
-    def limpiar_registros(self):
-        """Elimina todos los registros"""
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-        
-        cursor.execute('DELETE FROM registros')
-        registros_eliminados = cursor.rowcount
-        
-        conn.commit()
-        conn.close()
+    try:
+        loop = asyncio.get_running_loop()
+        codigo = await loop.run_in_executor(None, boletos.emitir, db_evento, registro_id, grupo, asistentes)
+        caption = BOLETO.render(registro_id=registro_id, codigo=codigo)
+        try:
+            png = await generar_qr(codigo)
+        except Exception as e:
+            logger.error(f"Error dibujando el QR del registro #{registro_id}: {e}")
+            await responder(update, caption)
+            return
+        await update.message.reply_photo(png, caption=caption, parse_mode=ParseMode.HTML)
         
-        return registros_eliminados
+    except Exception as e:
+        logger.error(f"Error emitiendo boleto del registro #{registro_id}: {e}")
+        await update.message.reply_text('❌ No se pudo emitir el boleto. El registro sí quedó guardado')
 
-# ================= INICIALIZAR DB =================
-db = Database()
+def analitica_del_evento(db_evento):
+    """Analítica del evento (cada evento conserva sus propios arreglos en caché)"""
+    analitica = analiticas.get(db_evento.evento_id)
+    if analitica is None:
+        analitica = analiticas[db_evento.evento_id] = Analitica(db_evento)
+    return analitica
 
 # ================= SERVICIO WEB =================
 app = Flask(__name__)
 
 @app.route('/')
 def home():
-    stats = db.obtener_estadisticas()
+    lectura = replica.lectura(db)
+    stats = lectura.obtener_estadisticas()
+    cache = db.cache.estadisticas()
     return f"""
     <html>
         <head>
@@ -226,42 +310,100 @@ def home():
                 <p class="success">✅ Sistema con Corrección y Eliminación de Bonos</p>
                 <p><strong>Total registros:</strong> {stats['total_registros']}</p>
                 <p><strong>Total asistentes:</strong> {stats['total_asistentes']}</p>
-                <p><strong>Tipos de bono:</strong> {len(db.obtener_tipos_bono())}</p>
+                <p><strong>Tipos de bono:</strong> {len(lectura.obtener_tipos_bono())}</p>
+                <p><strong>Caché de lecturas:</strong> {cache['tasa_aciertos']:.0%} aciertos ({cache['entradas']} entradas)</p>
+                <p><strong>Datos:</strong> {replica.leyenda()}</p>
             </div>
         </body>
     </html>
     """
 
 # ================= FUNCIONES PRINCIPALES DEL BOT =================
+@permisos.requiere('guia')
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    await update.message.reply_text(
-        '¡Hola! 🤖\n'
-        'Vamos a capturar datos para el Congreso 2026.\n\n'
-        'Por favor, ingresa el **NOMBRE DEL GRUPO**:'
-    )
+    context.user_data['campo_directorio'] = 'grupo'
+    await responder(update, INICIO.render())
     return GRUPO
 
+@permisos.requiere('guia')
 async def capturar_grupo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     context.user_data['grupo'] = update.message.text
-    await update.message.reply_text('✅ GRUPO guardado. Ahora ingresa el **GUÍA**:')
+    context.user_data['campo_directorio'] = 'guia'
+    await responder(update, CAMPO_GUARDADO.render(campo='GRUPO', indicacion='Ahora ingresa el', siguiente='GUÍA'))
     return GUIA
 
+@permisos.requiere('guia')
 async def capturar_guia(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     context.user_data['guia'] = update.message.text
-    await update.message.reply_text('✅ GUÍA guardado. Ahora ingresa el **BONO**:')
+    context.user_data.pop('campo_directorio', None)
+    await responder(update, CAMPO_GUARDADO.render(campo='GUÍA', indicacion='Ahora ingresa el', siguiente='BONO'))
     return BONO
 
+@permisos.requiere('guia')
 async def capturar_bono(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    context.user_data['bono'] = update.message.text
-    await update.message.reply_text('✅ BONO guardado. Ahora ingresa el **MONTO**:')
+    texto = update.message.text
+    indice = await db.asincrona.obtener_indice_bonos()
+    encontrado = indice.buscar(texto)
+    db_evento = await db_del_chat(update)
+    cupos = await db_evento.asincrona.obtener_cupos()
+    
+    # Lo que no coincide con ningún alias pero se parece a alguno se ofrece como botones
+    if encontrado is None:
+        sugerencias = indice.sugerir(texto)
+        if sugerencias:
+            context.user_data['bono_escrito'] = texto
+            context.user_data['bonos_sugeridos'] = dict(sugerencias)
+            keyboard = [
+                [InlineKeyboardButton(f"🎫 {etiqueta_bono(nombre, cupos)}", callback_data=f"bono_sugerido_{bono_id}")]
+                for bono_id, nombre in sugerencias
+            ]
+            keyboard.append([InlineKeyboardButton(f"➕ Usar \"{texto[:40]}\" como bono nuevo", callback_data="bono_nuevo")])
+            await responder(update, BONO_SUGERENCIAS.render(bono=texto), reply_markup=InlineKeyboardMarkup(keyboard))
+            return BONO
+    
+    # Un bono sin lugares se rechaza aquí; la reserva al guardar es la que decide
+    if encontrado and encontrado[1] in cupos and cupos[encontrado[1]][1] <= 0:
+        await responder(update, BONO_AGOTADO.render(bono=encontrado[1], estado=formatear_cupo(*cupos[encontrado[1]])))
+        return BONO
+    
+    context.user_data['bono'] = encontrado[1] if encontrado else texto
+    await responder(update, CAMPO_GUARDADO.render(campo='BONO', indicacion='Ahora ingresa el', siguiente='MONTO'))
     return MONTO
 
+@permisos.requiere('guia')
+async def elegir_bono(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    query = update.callback_query
+    await query.answer()
+    
+    texto = context.user_data.pop('bono_escrito', None)
+    sugeridos = context.user_data.pop('bonos_sugeridos', {})
+    bono_id = None if query.data == 'bono_nuevo' else int(query.data.replace('bono_sugerido_', ''))
+    
+    # Botones de una sugerencia anterior a la última respuesta
+    if texto is None or (bono_id is not None and bono_id not in sugeridos):
+        await query.edit_message_text('❌ Esa sugerencia ya no está vigente, escribe el BONO de nuevo')
+        return BONO
+    
+    if bono_id is None:
+        context.user_data['bono'] = texto
+    else:
+        # Lo escrito queda como alias del bono elegido: la próxima vez coincide directo
+        await db.asincrona.agregar_alias_bono(texto, bono_id)
+        context.user_data['bono'] = sugeridos[bono_id]
+    
+    await responder(update, CAMPO_GUARDADO.render(campo='BONO', indicacion='Ahora ingresa el', siguiente='MONTO'))
+    return MONTO
+
+@permisos.requiere('guia')
 async def capturar_monto(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     context.user_data['monto'] = update.message.text
-    await update.message.reply_text('✅ MONTO guardado. Ingresa los **ASISTENTES**:')
+    await responder(update, CAMPO_GUARDADO.render(campo='MONTO', indicacion='Ingresa los', siguiente='ASISTENTES'))
     return ASISTENTES
 
+@permisos.requiere('guia')
+@por_chat
 async def capturar_asistentes(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    db_evento = await db_del_chat(update)
     try:
         grupo = context.user_data['grupo']
         guia = context.user_data['guia']
@@ -269,20 +411,29 @@ async def capturar_asistentes(update: Update, context: ContextTypes.DEFAULT_TYPE
         monto = context.user_data['monto']
         asistentes = update.message.text
         
-        # Guardar en base de datos
-        registro_id = db.agregar_registro(grupo, guia, bono, monto, asistentes)
-        
-        await update.message.reply_text(
-            f'🎉 **REGISTRO #{registro_id} COMPLETADO!**\n\n'
-            f'📋 Resumen:\n'
-            f'• 🏷️ Grupo: {grupo}\n'
-            f'• 👤 Guía: {guia}\n'
-            f'• 🎫 Bono: {bono}\n'
-            f'• 💰 Monto: {monto}\n'
-            f'• 👥 Asistentes: {asistentes}\n\n'
-            '💾 **Guardado en base de datos**\n\n'
-            'Usa /nuevo para otro registro o /corregir para editar bonos'
+        # Guardar en base de datos (un reintento del mismo mensaje devuelve el registro original)
+        clave = clave_idempotencia(
+            update.effective_chat.id, update.message.message_id, grupo, guia, bono, monto, asistentes
         )
+        registro_id, nuevo = await db_evento.asincrona.agregar_registro(
+            grupo, guia, bono, monto, asistentes, usuario=update.effective_user.id, clave=clave
+        )
+        # Un reintento no vuelve a sumar el uso del grupo y el guía en el autocompletado
+        if nuevo:
+            directorio.agregar(grupo, guia)
+        
+        await responder(update, REGISTRO_COMPLETADO.render(
+            registro_id=registro_id, grupo=grupo, guia=guia, bono=bono, monto=monto, asistentes=asistentes
+        ))
+        await enviar_boleto(update, db_evento, registro_id, grupo, asistentes)
+        return ConversationHandler.END
+        
+    except CupoAgotado as e:
+        mensaje = SIN_CUPO.render(bono=e.bono, solicitados=e.solicitados, disponibles=max(e.disponibles, 0))
+        if e.disponibles > 0:
+            await responder(update, [mensaje, SIN_CUPO_REINTENTAR.render()])
+            return ASISTENTES
+        await responder(update, [mensaje, SIN_CUPO_OTRO_BONO.render()])
         return ConversationHandler.END
         
     except Exception as e:
@@ -290,34 +441,54 @@ async def capturar_asistentes(update: Update, context: ContextTypes.DEFAULT_TYPE
         await update.message.reply_text('❌ Error al guardar el registro')
         return ConversationHandler.END
 
+# ================= AUTOCOMPLETADO =================
+@permisos.requiere('guia')
+async def autocompletar(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    consulta = update.inline_query
+    # El paso de /nuevo en que está el usuario decide qué se sugiere; fuera de la captura, grupos
+    campo = context.user_data.get('campo_directorio', 'grupo')
+    etiqueta = 'Grupo' if campo == 'grupo' else 'Guía'
+    
+    resultados = [
+        InlineQueryResultArticle(
+            id=str(i),
+            title=nombre,
+            description=f'{etiqueta} · {veces} registros',
+            input_message_content=InputTextMessageContent(nombre)
+        )
+        for i, (nombre, veces) in enumerate(directorio.buscar(campo, consulta.query))
+    ]
+    # Sin caché en Telegram: la misma consulta cambia de grupo a guía según el paso
+    await consulta.answer(resultados, cache_time=0, is_personal=True)
+
 # ================= SISTEMA DE ELIMINACIÓN DE BONOS =================
+@permisos.requiere('admin')
 async def eliminar_bono(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Muestra los tipos de bono disponibles para eliminar"""
-    bonos = db.obtener_tipos_bono()
+    db_evento = await db_del_chat(update)
+    bonos = await db_evento.asincrona.obtener_tipos_bono()
     
     if not bonos:
         await update.message.reply_text('📭 No hay registros con tipos de bono para eliminar')
         return
     
     # Crear teclado inline con los bonos
+    cupos = await db_evento.asincrona.obtener_cupos()
     keyboard = []
     for bono in bonos:
-        keyboard.append([InlineKeyboardButton(f"🗑️ {bono}", callback_data=f"eliminar_{bono}")])
+        keyboard.append([InlineKeyboardButton(f"🗑️ {etiqueta_bono(bono, cupos)}", callback_data=f"eliminar_{bono}")])
     
     keyboard.append([InlineKeyboardButton("🔍 Buscar por ID", callback_data="buscar_id")])
     keyboard.append([InlineKeyboardButton("❌ Cancelar", callback_data="cancelar_eliminacion")])
     
     reply_markup = InlineKeyboardMarkup(keyboard)
     
-    await update.message.reply_text(
-        '🗑️ **ELIMINACIÓN DE BONOS**\n\n'
-        'Selecciona el tipo de bono que quieres eliminar:\n\n'
-        '⚠️ **ADVERTENCIA:** Esto eliminará TODOS los registros del bono seleccionado.',
-        reply_markup=reply_markup
-    )
+    await responder(update, MENU_ELIMINAR.render(), reply_markup=reply_markup)
 
+@permisos.requiere('admin')
 async def handle_eliminar_bono(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Maneja la selección de bono a eliminar"""
+    db_evento = await db_del_chat(update)
     query = update.callback_query
     await query.answer()
     
@@ -326,10 +497,7 @@ async def handle_eliminar_bono(update: Update, context: ContextTypes.DEFAULT_TYP
         return
     
     if query.data == "buscar_id":
-        await query.edit_message_text(
-            '🔍 **BUSCAR REGISTRO POR ID**\n\n'
-            'Por favor, ingresa el **ID del registro** que quieres eliminar:'
-        )
+        await responder(update, BUSCAR_POR_ID.render())
         return ELIMINAR_BONO
     
     if query.data.startswith("eliminar_"):
@@ -337,22 +505,19 @@ async def handle_eliminar_bono(update: Update, context: ContextTypes.DEFAULT_TYP
         context.user_data['bono_a_eliminar'] = bono_a_eliminar
         
         # Mostrar registros con este bono
-        registros = db.obtener_registros_por_bono(bono_a_eliminar)
+        registros = await db_evento.asincrona.obtener_registros_por_bono(bono_a_eliminar)
         
         if not registros:
             await query.edit_message_text(f'❌ No hay registros con bono: {bono_a_eliminar}')
             return
         
-        mensaje = f'⚠️ **ELIMINAR TODOS los registros de: {bono_a_eliminar}**\n\n'
-        mensaje += f'📋 **Registros encontrados:** {len(registros)}\n\n'
-        
         # Mostrar resumen de registros
-        total_asistentes = sum(registro[5] for registro in registros)
-        total_monto = sum(float(registro[4]) for registro in registros)
-        
-        mensaje += f'• 👥 Total asistentes: {total_asistentes}\n'
-        mensaje += f'• 💰 Total monto: ${total_monto:,.2f}\n\n'
-        mensaje += '¿Estás seguro de que quieres eliminar TODOS estos registros?'
+        mensaje = CONFIRMAR_ELIMINAR_BONO.render(
+            bono=bono_a_eliminar,
+            cantidad=len(registros),
+            asistentes=sum(registro.asistentes for registro in registros),
+            monto=formatear_monto(sum(registro.centavos for registro in registros))
+        )
         
         # Botones de confirmación
         keyboard = [
@@ -365,10 +530,13 @@ async def handle_eliminar_bono(update: Update, context: ContextTypes.DEFAULT_TYP
         
         reply_markup = InlineKeyboardMarkup(keyboard)
         
-        await query.edit_message_text(mensaje, reply_markup=reply_markup)
+        await responder(update, mensaje, reply_markup=reply_markup)
 
+@permisos.requiere('admin')
+@por_chat
 async def handle_confirmar_eliminar(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Confirma y ejecuta la eliminación de registros"""
+    db_evento = await db_del_chat(update)
     query = update.callback_query
     await query.answer()
     
@@ -376,17 +544,16 @@ async def handle_confirmar_eliminar(update: Update, context: ContextTypes.DEFAUL
         bono_a_eliminar = query.data.replace("confirmar_eliminar_", "")
         
         # Ejecutar eliminación
-        registros_eliminados = db.eliminar_registros_por_bono(bono_a_eliminar)
+        registros_eliminados = await db_evento.asincrona.eliminar_registros_por_bono(bono_a_eliminar, usuario=update.effective_user.id)
         
-        await query.edit_message_text(
-            f'✅ **ELIMINACIÓN COMPLETADA**\n\n'
-            f'• 🎫 Bono eliminado: `{bono_a_eliminar}`\n'
-            f'• 📊 Registros eliminados: {registros_eliminados}\n\n'
-            '🗑️ Todos los registros han sido eliminados permanentemente.'
-        )
+        await responder(update, BONO_ELIMINADO.render(
+            bono=bono_a_eliminar, cantidad=registros_eliminados, minutos=MINUTOS_DESHACER
+        ))
 
+@permisos.requiere('admin')
 async def handle_eliminar_por_id(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Maneja la eliminación por ID de registro"""
+    db_evento = await db_del_chat(update)
     try:
         registro_id_text = update.message.text.strip()
         
@@ -395,7 +562,7 @@ async def handle_eliminar_por_id(update: Update, context: ContextTypes.DEFAULT_T
             return ELIMINAR_BONO
         
         registro_id = int(registro_id_text)
-        registro = db.obtener_registro_por_id(registro_id)
+        registro = await db_evento.asincrona.obtener_registro_por_id(registro_id)
         
         if not registro:
             await update.message.reply_text(
@@ -404,20 +571,6 @@ async def handle_eliminar_por_id(update: Update, context: ContextTypes.DEFAULT_T
             )
             return ELIMINAR_BONO
         
-        # Mostrar información del registro
-        id_reg, grupo, guia, bono, monto, asistentes, fecha = registro
-        fecha_simple = fecha.split()[0] if isinstance(fecha, str) else str(fecha)[:10]
-        
-        mensaje = f'🔍 **REGISTRO ENCONTRADO**\n\n'
-        mensaje += f'• 🆔 ID: {id_reg}\n'
-        mensaje += f'• 🏷️ Grupo: {grupo}\n'
-        mensaje += f'• 👤 Guía: {guia}\n'
-        mensaje += f'• 🎫 Bono: {bono}\n'
-        mensaje += f'• 💰 Monto: ${float(monto):,.2f}\n'
-        mensaje += f'• 👥 Asistentes: {asistentes}\n'
-        mensaje += f'• 📅 Fecha: {fecha_simple}\n\n'
-        mensaje += '¿Estás seguro de que quieres eliminar este registro?'
-        
         # Guardar ID en contexto para confirmación
         context.user_data['registro_a_eliminar'] = registro_id
         
@@ -430,7 +583,8 @@ async def handle_eliminar_por_id(update: Update, context: ContextTypes.DEFAULT_T
         
         reply_markup = InlineKeyboardMarkup(keyboard)
         
-        await update.message.reply_text(mensaje, reply_markup=reply_markup)
+        # Mostrar información del registro
+        await responder(update, REGISTRO_ENCONTRADO.render(registro=registro), reply_markup=reply_markup)
         return ConversationHandler.END
         
     except Exception as e:
@@ -438,8 +592,11 @@ async def handle_eliminar_por_id(update: Update, context: ContextTypes.DEFAULT_T
         await update.message.reply_text('❌ Error al buscar el registro. Intenta nuevamente:')
         return ELIMINAR_BONO
 
+@permisos.requiere('admin')
+@por_chat
 async def handle_confirmar_eliminar_id(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Confirma y ejecuta la eliminación por ID"""
+    db_evento = await db_del_chat(update)
     query = update.callback_query
     await query.answer()
     
@@ -450,34 +607,28 @@ async def handle_confirmar_eliminar_id(update: Update, context: ContextTypes.DEF
         return
     
     # Obtener información del registro antes de eliminar
-    registro = db.obtener_registro_por_id(registro_id)
+    registro = await db_evento.asincrona.obtener_registro_por_id(registro_id)
     
     if not registro:
         await query.edit_message_text('❌ Error: El registro ya no existe')
         return
     
     # Ejecutar eliminación
-    eliminado = db.eliminar_registro(registro_id)
+    eliminado = await db_evento.asincrona.eliminar_registro(registro_id, usuario=update.effective_user.id)
     
     if eliminado:
-        id_reg, grupo, guia, bono, monto, asistentes, fecha = registro
-        await query.edit_message_text(
-            f'✅ **REGISTRO ELIMINADO**\n\n'
-            f'• 🆔 ID: {id_reg}\n'
-            f'• 🏷️ Grupo: {grupo}\n'
-            f'• 🎫 Bono: {bono}\n'
-            f'• 💰 Monto: ${float(monto):,.2f}\n\n'
-            '🗑️ El registro ha sido eliminado permanentemente.'
-        )
+        await responder(update, REGISTRO_ELIMINADO.render(registro=registro, minutos=MINUTOS_DESHACER))
     else:
         await query.edit_message_text('❌ Error: No se pudo eliminar el registro')
 
+@permisos.requiere('admin')
 async def handle_volver_eliminar_bonos(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Vuelve a la lista de bonos para eliminar"""
+    db_evento = await db_del_chat(update)
     query = update.callback_query
     await query.answer()
     
-    bonos = db.obtener_tipos_bono()
+    bonos = await db_evento.asincrona.obtener_tipos_bono()
     
     keyboard = []
     for bono in bonos:
@@ -488,39 +639,376 @@ async def handle_volver_eliminar_bonos(update: Update, context: ContextTypes.DEF
     
     reply_markup = InlineKeyboardMarkup(keyboard)
     
-    await query.edit_message_text(
-        '🗑️ **ELIMINACIÓN DE BONOS**\n\n'
-        'Selecciona el tipo de bono que quieres eliminar:\n\n'
-        '⚠️ **ADVERTENCIA:** Esto eliminará TODOS los registros del bono seleccionado.',
-        reply_markup=reply_markup
+    await responder(update, MENU_ELIMINAR.render(), reply_markup=reply_markup)
+
+@permisos.requiere('admin')
+@por_chat
+async def deshacer(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Restaura la última eliminación del usuario dentro de la ventana de deshacer"""
+    db_evento = await db_del_chat(update)
+    registros_restaurados = await db_evento.asincrona.deshacer_eliminacion(usuario=update.effective_user.id)
+    
+    if not registros_restaurados:
+        await update.message.reply_text(
+            f'❌ No tienes eliminaciones de los últimos {MINUTOS_DESHACER} minutos para deshacer'
+        )
+        return
+    
+    await responder(update, ELIMINACION_DESHECHA.render(cantidad=registros_restaurados))
+
+@permisos.requiere('admin')
+async def ver_duplicados(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Lista registros que probablemente están duplicados (mismo grupo, guía y bono)"""
+    db_evento = await db_del_chat(update)
+    try:
+        duplicados = await db_evento.asincrona.buscar_duplicados()
+        
+        if not duplicados:
+            await update.message.reply_text('✅ No se encontraron registros duplicados')
+            return
+        
+        bloques = [DUPLICADOS_CABECERA.render(cantidad=len(duplicados))]
+        for registros in duplicados:
+            ids = ', '.join(f'#{registro.id}' for registro in registros)
+            bloques.append(DUPLICADOS_GRUPO.render(primero=registros[0], ids=ids))
+        bloques.append(DUPLICADOS_PIE.render())
+        
+        await responder(update, bloques, archivo='duplicados.txt')
+        
+    except Exception as e:
+        logger.error(f"Error buscando duplicados: {e}")
+        await update.message.reply_text('❌ Error al buscar duplicados')
+
+@permisos.requiere('admin')
+async def otorgar(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Asigna o quita el rol de un usuario: /otorgar <id_usuario> <admin|guia|viewer|ninguno>"""
+    roles_validos = list(NIVELES) + ['ninguno']
+    
+    if len(context.args) != 2 or not context.args[0].isdigit() or context.args[1].lower() not in roles_validos:
+        await responder(update, OTORGAR_USO.render(roles='|'.join(roles_validos)))
+        return
+    
+    usuario_id = int(context.args[0])
+    rol = context.args[1].lower()
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(
+        None, lambda: permisos.otorgar(usuario_id, None if rol == 'ninguno' else rol, otorgado_por=update.effective_user.id)
     )
+    
+    if rol == 'ninguno':
+        await update.message.reply_text(f'🔐 Se quitó el rol del usuario {usuario_id}')
+    else:
+        await update.message.reply_text(f'🔐 Usuario {usuario_id} ahora tiene el rol: {rol}')
+
+@permisos.requiere('admin')
+@por_chat
+async def cupo(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Muestra los cupos del evento o fija el de un bono: /cupo <bono> <capacidad|libre>"""
+    db_evento = await db_del_chat(update)
+    try:
+        if not context.args:
+            cupos = await db_evento.asincrona.obtener_cupos()
+            if not cupos:
+                await responder(update, CUPO_USO.render())
+                return
+            bloques = [CUPOS_CABECERA.render()]
+            for bono, (capacidad, disponibles) in cupos.items():
+                bloques.append(CUPO_FILA.render(bono=bono, estado=formatear_cupo(capacidad, disponibles)))
+            await responder(update, bloques)
+            return
+        
+        *palabras, valor = context.args
+        if not palabras or not (valor.isdigit() or valor.lower() == 'libre'):
+            await responder(update, CUPO_USO.render())
+            return
+        
+        capacidad = None if valor.lower() == 'libre' else int(valor)
+        bono, disponibles = await db_evento.asincrona.fijar_cupo(' '.join(palabras), capacidad)
+        if capacidad is None:
+            await responder(update, CUPO_QUITADO.render(bono=bono))
+        else:
+            await responder(update, CUPO_FIJADO.render(bono=bono, estado=formatear_cupo(capacidad, disponibles)))
+        
+    except Exception as e:
+        logger.error(f"Error fijando cupo: {e}")
+        await update.message.reply_text('❌ Error al fijar el cupo')
+
+# ================= INGRESO EN LA PUERTA =================
+@permisos.requiere('guia')
+async def modo_checkin(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Activa o desactiva el modo puerta: cada foto o código que llegue se valida como boleto"""
+    if boletos is None:
+        await responder(update, BOLETOS_NO_DISPONIBLES.render())
+        return
+    
+    evento_id = context.user_data.pop('modo_checkin', None)
+    if evento_id is not None:
+        ingresados, vigentes = boletos.ingresados(evento_id)
+        await responder(update, CHECKIN_TERMINADO.render(ingresados=ingresados, vigentes=vigentes))
+        return
+    
+    # El evento se fija al entrar: validar no vuelve a consultar la base de datos
+    evento_id = context.user_data['modo_checkin'] = await db.asincrona.evento_del_chat(update.effective_chat.id)
+    ingresados, vigentes = boletos.ingresados(evento_id)
+    await responder(update, CHECKIN_ACTIVO.render(ingresados=ingresados, vigentes=vigentes))
+
+async def escanear_boleto(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Valida en memoria la foto del QR o el código de un boleto (solo en modo puerta)"""
+    evento_id = context.user_data.get('modo_checkin')
+    if evento_id is None:
+        return
+    # Sin decorador: fuera del modo puerta los mensajes sueltos no deben contestar "sin permiso"
+    if not permisos.tiene(update.effective_user.id, 'guia'):
+        context.user_data.pop('modo_checkin', None)
+        return
+    
+    try:
+        texto = update.message.text
+        if update.message.photo:
+            # La primera versión de al menos 800 px basta para leer el QR y se descarga antes
+            fotos = update.message.photo
+            foto = next((f for f in fotos if max(f.width, f.height) >= 800), fotos[-1])
+            archivo = await foto.get_file()
+            texto = await decodificar_qr(bytes(await archivo.download_as_bytearray()))
+            if texto is None:
+                await responder(update, SIN_QR.render())
+                return
+        
+        loop = asyncio.get_running_loop()
+        estado, datos = await loop.run_in_executor(None, boletos.validar, texto, evento_id, update.effective_user.id)
+        await responder(update, INGRESOS[estado].render(d=datos))
+        
+    except Exception as e:
+        logger.error(f"Error validando boleto: {e}")
+        await update.message.reply_text('❌ Error al validar el boleto')
+
+# ================= RESÚMENES PROGRAMADOS =================
+def describir_frecuencias(frecuencias):
+    """'cada hora y al cierre del día (05:00 UTC)' para los mensajes de suscripción"""
+    return ' y '.join(FRECUENCIAS[frecuencia] for frecuencia in frecuencias) or 'ningún resumen'
+
+@permisos.requiere('viewer')
+async def suscribir(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Suscribe el chat a los resúmenes programados: /suscribir [hora|dia] (sin argumento, a ambos)"""
+    chat_id = update.effective_chat.id
+    frecuencias = [arg.lower() for arg in context.args] or list(FRECUENCIAS)
+    try:
+        if any(frecuencia not in FRECUENCIAS for frecuencia in frecuencias):
+            await responder(update, RESUMENES_USO.render(actuales=describir_frecuencias(resumenes.del_chat(chat_id))))
+            return
+        
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, resumenes.suscribir, chat_id, frecuencias, update.effective_user.id)
+        await responder(update, SUSCRITO.render(frecuencias=describir_frecuencias(frecuencias)))
+        
+    except Exception as e:
+        logger.error(f"Error suscribiendo el chat {chat_id}: {e}")
+        await update.message.reply_text('❌ Error al suscribir el chat')
+
+@permisos.requiere('viewer')
+async def desuscribir(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Da de baja el chat de los resúmenes programados: /desuscribir [hora|dia] (sin argumento, de todos)"""
+    chat_id = update.effective_chat.id
+    frecuencias = [arg.lower() for arg in context.args] or resumenes.del_chat(chat_id)
+    try:
+        if not frecuencias or any(frecuencia not in FRECUENCIAS for frecuencia in frecuencias):
+            await responder(update, RESUMENES_USO.render(actuales=describir_frecuencias(resumenes.del_chat(chat_id))))
+            return
+        
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, resumenes.cancelar, chat_id, frecuencias)
+        await responder(update, DESUSCRITO.render(frecuencias=describir_frecuencias(frecuencias)))
+        
+    except Exception as e:
+        logger.error(f"Error dando de baja el chat {chat_id}: {e}")
+        await update.message.reply_text('❌ Error al dar de baja el chat')
+
+def bloques_resumen(evento, frecuencia, resumen):
+    """Bloques del mensaje de resumen de un evento, iguales para todos sus suscriptores"""
+    bloques = [RESUMEN_CABECERA.render(periodo='DE LA HORA' if frecuencia == 'hora' else 'DEL DÍA', evento=evento)]
+    if resumen['cambios'] is not None:
+        registros, asistentes = resumen['cambios']
+        bloques.append(RESUMEN_CAMBIOS.render(registros=registros, asistentes=asistentes))
+    bloques.append(RESUMEN_TOTALES.render(stats=resumen['stats']))
+    
+    if resumen['stats']['por_bono']:
+        bloques.append(ESTADISTICAS_POR_BONO.render())
+        for bono, cantidad, asistentes, monto in resumen['stats']['por_bono']:
+            bloques.append(ESTADISTICAS_BONO.render(bono=bono, cantidad=cantidad, asistentes=asistentes, monto=float(monto)))
+    
+    if resumen['cupos']:
+        bloques.append(ESTADISTICAS_CUPOS.render())
+        for bono, (capacidad, disponibles) in resumen['cupos'].items():
+            bloques.append(CUPO_FILA.render(bono=bono, estado=formatear_cupo(capacidad, disponibles)))
+    
+    if resumen['ingresos'] and resumen['ingresos'][1]:
+        ingresados, vigentes = resumen['ingresos']
+        bloques.append(RESUMEN_INGRESOS.render(ingresados=ingresados, vigentes=vigentes))
+    
+    bloques.append(LEYENDA.render(leyenda=replica.leyenda()))
+    return bloques
+
+async def enviar_resumenes(context: ContextTypes.DEFAULT_TYPE):
+    """Job del JobQueue: calcula una vez el resumen de cada evento y lo envía a todos sus chats suscritos"""
+    frecuencia = context.job.data
+    loop = asyncio.get_running_loop()
+    nombres = {evento_id: nombre for evento_id, nombre, _ in await db.asincrona.obtener_eventos(incluir_archivados=True)}
+    
+    por_evento = await loop.run_in_executor(None, resumenes.por_evento, frecuencia)
+    for evento_id, chats in por_evento.items():
+        try:
+            resumen = await loop.run_in_executor(None, resumenes.calcular, evento_id, frecuencia)
+        except Exception as e:
+            logger.error(f"Error calculando el resumen del evento {evento_id}: {e}")
+            continue
+        
+        # Una hora sin registros nuevos ni eliminados no amerita mensaje
+        if frecuencia == 'hora' and resumen['cambios'] == (0, 0):
+            continue
+        
+        mensajes = dividir(bloques_resumen(nombres.get(evento_id, evento_id), frecuencia, resumen))
+        for chat_id in chats:
+            try:
+                for texto in mensajes:
+                    await context.bot.send_message(chat_id, texto, parse_mode=ParseMode.HTML)
+            except Forbidden:
+                # El bot ya no está en el chat: se da de baja para no reintentar cada hora
+                logger.warning(f"Chat {chat_id} dado de baja de los resúmenes: el bot ya no tiene acceso")
+                await loop.run_in_executor(None, resumenes.cancelar, chat_id)
+            except TelegramError as e:
+                logger.error(f"Error enviando resumen al chat {chat_id}: {e}")
+
+def programar_resumenes(application):
+    """Programa en el JobQueue el resumen de cada hora en punto y el de cierre del día"""
+    if application.job_queue is None:
+        logger.warning("Sin JobQueue (falta python-telegram-bot[job-queue]): no habrá resúmenes programados")
+        return
+    
+    application.job_queue.run_repeating(
+        enviar_resumenes, interval=3600, first=segundos_para_la_hora(), data='hora', name='resumen_hora'
+    )
+    application.job_queue.run_daily(enviar_resumenes, HORA_RESUMEN_DIARIO, data='dia', name='resumen_dia')
+
+# ================= EVENTOS =================
+@permisos.requiere('viewer')
+@por_chat
+async def cambiar_evento(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Muestra o cambia el evento del chat: /evento [nombre]; crear uno nuevo requiere admin"""
+    evento_actual = await db.asincrona.evento_del_chat(update.effective_chat.id)
+    
+    if not context.args:
+        bloques = [EVENTOS_CABECERA.render()]
+        for evento_id, nombre, _ in await db.asincrona.obtener_eventos():
+            marca = '👉' if evento_id == evento_actual else '•'
+            bloques.append(EVENTO_FILA.render(marca=marca, nombre=nombre))
+        bloques.append(EVENTOS_PIE.render())
+        await responder(update, bloques)
+        return
+    
+    nombre = ' '.join(context.args)
+    try:
+        evento = await db.asincrona.buscar_evento(nombre)
+        
+        if evento and evento[2]:
+            await update.message.reply_text(f'❌ El evento {evento[1]} está archivado')
+            return
+        
+        if evento:
+            evento_id, nombre = evento[0], evento[1]
+        elif permisos.tiene(update.effective_user.id, 'admin'):
+            evento_id = await db.asincrona.crear_evento(nombre)
+        else:
+            await update.message.reply_text(f'❌ No existe el evento: {nombre}')
+            return
+        
+        await db.asincrona.asignar_evento_chat(update.effective_chat.id, evento_id)
+        await update.message.reply_text(f'🗓️ Este chat ahora trabaja en el evento: {nombre}')
+        
+    except Exception as e:
+        logger.error(f"Error cambiando de evento: {e}")
+        await update.message.reply_text('❌ Error al cambiar de evento')
+
+@permisos.requiere('admin')
+@por_chat
+async def archivar_evento(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Mueve los registros de un evento terminado a su propio archivo: /archivar <nombre>"""
+    if not context.args:
+        await update.message.reply_text('🗄️ Uso: /archivar <nombre del evento>')
+        return
+    
+    nombre = ' '.join(context.args)
+    try:
+        evento = await db.asincrona.buscar_evento(nombre)
+        
+        if not evento or evento[2]:
+            await update.message.reply_text(f'❌ No hay un evento activo llamado: {nombre}')
+            return
+        
+        ruta, registros_movidos = await db.asincrona.archivar_evento(evento[0])
+        analiticas.pop(evento[0], None)
+        
+        await responder(update, EVENTO_ARCHIVADO.render(
+            evento=evento[1], cantidad=registros_movidos, archivo=os.path.basename(ruta)
+        ))
+        
+    except ValueError as e:
+        await update.message.reply_text(f'❌ {e}')
+    except Exception as e:
+        logger.error(f"Error archivando evento: {e}")
+        await update.message.reply_text('❌ Error al archivar el evento')
+
+# ================= RESPALDOS =================
+@permisos.requiere('admin')
+async def respaldo(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Hace un respaldo completo en el momento y lo envía comprimido al chat"""
+    if DATABASE_URL:
+        await update.message.reply_text('❌ Con PostgreSQL los respaldos se hacen con las herramientas del servidor')
+        return
+    
+    try:
+        await update.message.reply_text('💾 Generando respaldo...')
+        loop = asyncio.get_running_loop()
+        ruta, tamano, seq = await loop.run_in_executor(None, respaldos.crear_respaldo)
+        caption = f'💾 Respaldo {os.path.basename(ruta)}\n📦 {tamano / 1024:,.0f} KB, hasta el cambio #{seq}'
+        
+        if tamano > TAMANO_MAXIMO_ENVIO:
+            await update.message.reply_text(f'{caption}\n⚠️ Es demasiado grande para Telegram; queda guardado en el servidor')
+            return
+        
+        with open(ruta, 'rb') as f:
+            await update.message.reply_document(f, filename=os.path.basename(ruta), caption=caption)
+        
+    except Exception as e:
+        logger.error(f"Error generando respaldo: {e}")
+        await update.message.reply_text('❌ Error al generar el respaldo')
 
 # ================= SISTEMA DE CORRECCIÓN DE BONOS (existente) =================
+@permisos.requiere('admin')
 async def corregir_bono(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Muestra los tipos de bono disponibles para corregir"""
-    bonos = db.obtener_tipos_bono()
+    db_evento = await db_del_chat(update)
+    bonos = await db_evento.asincrona.obtener_tipos_bono()
     
     if not bonos:
         await update.message.reply_text('📭 No hay registros con tipos de bono para corregir')
         return
     
     # Crear teclado inline con los bonos
+    cupos = await db_evento.asincrona.obtener_cupos()
     keyboard = []
     for bono in bonos:
-        keyboard.append([InlineKeyboardButton(f"🎫 {bono}", callback_data=f"corregir_{bono}")])
+        keyboard.append([InlineKeyboardButton(f"🎫 {etiqueta_bono(bono, cupos)}", callback_data=f"corregir_{bono}")])
     
     keyboard.append([InlineKeyboardButton("❌ Cancelar", callback_data="cancelar_correccion")])
     
     reply_markup = InlineKeyboardMarkup(keyboard)
     
-    await update.message.reply_text(
-        '🔧 **CORRECCIÓN DE BONOS**\n\n'
-        'Selecciona el tipo de bono que quieres corregir:',
-        reply_markup=reply_markup
-    )
+    await responder(update, MENU_CORREGIR.render(), reply_markup=reply_markup)
 
+@permisos.requiere('admin')
 async def handle_corregir_bono(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Maneja la selección de bono a corregir"""
+    db_evento = await db_del_chat(update)
     query = update.callback_query
     await query.answer()
     
@@ -533,17 +1021,15 @@ async def handle_corregir_bono(update: Update, context: ContextTypes.DEFAULT_TYP
         context.user_data['bono_a_corregir'] = bono_actual
         
         # Mostrar registros con este bono
-        registros = db.obtener_registros_por_bono(bono_actual)
+        registros = await db_evento.asincrona.obtener_registros_por_bono(bono_actual)
         
         if not registros:
             await query.edit_message_text(f'❌ No hay registros con bono: {bono_actual}')
             return
         
-        mensaje = f'📋 **Registros con bono: {bono_actual}**\n\n'
-        for i, (id_reg, grupo, guia, bono, monto, asistentes, fecha) in enumerate(registros[:10], 1):
-            fecha_simple = fecha.split()[0] if isinstance(fecha, str) else str(fecha)[:10]
-            mensaje += f"{i}. #{id_reg} - {grupo} ({guia})\n"
-            mensaje += f"   👥{asistentes} 💰${float(monto):,.2f} 📅{fecha_simple}\n\n"
+        bloques = [REGISTROS_BONO_CABECERA.render(bono=bono_actual)]
+        bloques.extend(REGISTRO_BONO_FILA.render(i=i, registro=registro) for i, registro in enumerate(registros[:10], 1))
+        bloques.append(PREGUNTA_ACCION.render())
         
         # Botones para este bono
         keyboard = [
@@ -554,11 +1040,9 @@ async def handle_corregir_bono(update: Update, context: ContextTypes.DEFAULT_TYP
         
         reply_markup = InlineKeyboardMarkup(keyboard)
         
-        await query.edit_message_text(
-            mensaje + '¿Qué acción deseas realizar?',
-            reply_markup=reply_markup
-        )
+        await responder(update, bloques, reply_markup=reply_markup)
 
+@permisos.requiere('admin')
 async def handle_cambiar_todos(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Maneja el cambio masivo de bonos"""
     query = update.callback_query
@@ -568,16 +1052,15 @@ async def handle_cambiar_todos(update: Update, context: ContextTypes.DEFAULT_TYP
         bono_actual = query.data.replace("cambiar_todos_", "")
         context.user_data['bono_a_corregir'] = bono_actual
         
-        await query.edit_message_text(
-            f'✏️ **CAMBIAR BONO: {bono_actual}**\n\n'
-            f'Vas a cambiar TODOS los registros con bono "{bono_actual}"\n\n'
-            'Por favor, escribe el **NUEVO NOMBRE** para este bono:'
-        )
+        await responder(update, CAMBIAR_BONO.render(bono=bono_actual))
         
         return NUEVO_BONO
 
+@permisos.requiere('admin')
+@por_chat
 async def capturar_nuevo_bono(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Captura el nuevo nombre del bono y realiza el cambio"""
+    db_evento = await db_del_chat(update)
     try:
         bono_actual = context.user_data.get('bono_a_corregir')
         nuevo_bono = update.message.text
@@ -586,29 +1069,16 @@ async def capturar_nuevo_bono(update: Update, context: ContextTypes.DEFAULT_TYPE
             await update.message.reply_text('❌ Error: No se encontró el bono a corregir')
             return ConversationHandler.END
         
-        # Obtener registros con el bono actual
-        registros = db.obtener_registros_por_bono(bono_actual)
+        # Actualizar todos los registros en una sola transacción (queda en el historial)
+        cambios_realizados = await db_evento.asincrona.renombrar_bono(bono_actual, nuevo_bono, usuario=update.effective_user.id)
         
-        if not registros:
+        if not cambios_realizados:
             await update.message.reply_text(f'❌ No hay registros con bono: {bono_actual}')
             return ConversationHandler.END
         
-        # Contador de cambios
-        cambios_realizados = 0
-        
-        # Actualizar cada registro
-        for registro in registros:
-            registro_id = registro[0]
-            if db.actualizar_bono(registro_id, nuevo_bono):
-                cambios_realizados += 1
-        
-        await update.message.reply_text(
-            f'✅ **CORRECCIÓN COMPLETADA**\n\n'
-            f'• Bono anterior: `{bono_actual}`\n'
-            f'• Bono nuevo: `{nuevo_bono}`\n'
-            f'• Registros actualizados: {cambios_realizados}\n\n'
-            '📊 Los cambios se han aplicado a todos los registros.'
-        )
+        await responder(update, CORRECCION_COMPLETADA.render(
+            anterior=bono_actual, nuevo=nuevo_bono, cantidad=cambios_realizados
+        ))
         
         return ConversationHandler.END
         
@@ -617,99 +1087,196 @@ async def capturar_nuevo_bono(update: Update, context: ContextTypes.DEFAULT_TYPE
         await update.message.reply_text('❌ Error al realizar la corrección')
         return ConversationHandler.END
 
+@permisos.requiere('admin')
 async def handle_volver_bonos(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Vuelve a la lista de bonos"""
+    db_evento = await db_del_chat(update)
     query = update.callback_query
     await query.answer()
     
-    bonos = db.obtener_tipos_bono()
+    bonos = await db_evento.asincrona.obtener_tipos_bono()
+    cupos = await db_evento.asincrona.obtener_cupos()
     
     keyboard = []
     for bono in bonos:
-        keyboard.append([InlineKeyboardButton(f"🎫 {bono}", callback_data=f"corregir_{bono}")])
+        keyboard.append([InlineKeyboardButton(f"🎫 {etiqueta_bono(bono, cupos)}", callback_data=f"corregir_{bono}")])
     
     keyboard.append([InlineKeyboardButton("❌ Cancelar", callback_data="cancelar_correccion")])
     
     reply_markup = InlineKeyboardMarkup(keyboard)
     
-    await query.edit_message_text(
-        '🔧 **CORRECCIÓN DE BONOS**\n\n'
-        'Selecciona el tipo de bono que quieres corregir:',
-        reply_markup=reply_markup
-    )
+    await responder(update, MENU_CORREGIR.render(), reply_markup=reply_markup)
 
 # ================= COMANDOS ADICIONALES =================
+@permisos.requiere('viewer')
 async def generar_reporte(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Genera el reporte: CSV, XLSX, PDF, ZIP por bono, incremental (delta) o columnar (parquet/arrow)"""
+    db_evento = await db_del_chat(update)
+    modo = context.args[0].lower() if context.args else 'csv'
+    if modo not in ESCRITORES and modo not in ('delta', 'parquet', 'arrow'):
+        modo = 'csv'
+    
     try:
-        registros = db.obtener_todos_registros()
+        # Los reportes completos salen de la copia de lectura y se reenvían por file_id mientras no cambie
+        lectura = db_evento if modo == 'delta' else replica.lectura(db_evento)
+        leyenda = '' if modo == 'delta' else f'\n{replica.leyenda()}'
+        version = await lectura.asincrona.ultimo_cambio()
+        if modo != 'delta':
+            file_id, caption = cache_archivos.obtener(f'reporte_{db_evento.evento_id}_{modo}', version)
+            if file_id:
+                await update.message.reply_document(file_id, caption=caption + leyenda)
+                return
+        
+        if modo in ESCRITORES:
+            # CSV/XLSX/PDF/ZIP: se construyen en memoria, los pesados en otro proceso
+            contenido, filas, filename = await construir_reporte(lectura, modo, version)
+            caption = f'📊 Reporte {modo.upper()} desde Base de Datos ({filas} registros)'
+        else:
+            # Se escribe fuera del event loop y con nombre propio de la actualización,
+            # así dos reportes simultáneos no se pisan el archivo
+            loop = asyncio.get_running_loop()
+            ruta_temporal = f'reporte_{update.update_id}.tmp'
+            if modo == 'delta':
+                filename = 'reporte_congreso_2026_delta.csv'
+                filas = await loop.run_in_executor(
+                    None, exportar_delta_csv, db_evento, ruta_temporal, f'chat_{update.effective_chat.id}_evento_{db_evento.evento_id}'
+                )
+                caption = f'📊 Cambios desde el último delta: {filas}'
+            else:
+                filename = f'reporte_congreso_2026.{modo}'
+                filas = await loop.run_in_executor(None, exportar_columnar, lectura, ruta_temporal, modo)
+                caption = f'📊 Instantánea {modo.capitalize()}: {filas} registros'
+            
+            with open(ruta_temporal, 'rb') as f:
+                contenido = f.read()
+            os.remove(ruta_temporal)
         
-        if not registros:
+        if not filas and modo != 'delta':
             await update.message.reply_text('📭 No hay datos en la base de datos')
             return
         
-        filename = 'reporte_congreso_2026.csv'
-        with open(filename, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            writer.writerow(['ID', 'GRUPO', 'GUIA', 'BONO', 'MONTO', 'ASISTENTES', 'FECHA'])
-            
-            for registro in registros:
-                writer.writerow(registro)
-        
-        with open(filename, 'rb') as f:
-            await update.message.reply_document(
-                f, 
-                filename=filename,
-                caption='📊 Reporte CSV desde Base de Datos'
-            )
+        mensaje = await update.message.reply_document(
+            contenido, 
+            filename=filename,
+            caption=caption + leyenda
+        )
+        
+        if modo != 'delta':
+            cache_archivos.guardar(f'reporte_{db_evento.evento_id}_{modo}', version, mensaje.document.file_id, caption)
             
     except Exception as e:
         logger.error(f"Error generando reporte: {e}")
         await update.message.reply_text('❌ Error al generar reporte')
 
+@permisos.requiere('viewer')
 async def ver_estadisticas(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    db_evento = await db_del_chat(update)
     try:
-        stats = db.obtener_estadisticas()
+        stats = await replica.lectura(db_evento).asincrona.obtener_estadisticas()
         
-        mensaje = "📊 **ESTADÍSTICAS DEL CONGRESO**\n\n"
-        mensaje += f"📈 Total registros: {stats['total_registros']}\n"
-        mensaje += f"👥 Total asistentes: {stats['total_asistentes']}\n\n"
+        bloques = [ESTADISTICAS_CABECERA.render(stats=stats)]
         
         if stats['por_bono']:
-            mensaje += "🎫 **Por tipo de bono:**\n"
+            bloques.append(ESTADISTICAS_POR_BONO.render())
             for bono, cantidad, asistentes, monto in stats['por_bono']:
-                mensaje += f"• {bono}: {cantidad} reg, {asistentes} asis, ${monto:,.2f}\n"
+                bloques.append(ESTADISTICAS_BONO.render(bono=bono, cantidad=cantidad, asistentes=asistentes, monto=float(monto)))
+        
+        cupos = await replica.lectura(db_evento).asincrona.obtener_cupos()
+        if cupos:
+            bloques.append(ESTADISTICAS_CUPOS.render())
+            for bono, (capacidad, disponibles) in cupos.items():
+                bloques.append(CUPO_FILA.render(bono=bono, estado=formatear_cupo(capacidad, disponibles)))
         
-        await update.message.reply_text(mensaje)
+        bloques.append(LEYENDA.render(leyenda=replica.leyenda()))
+        
+        await responder(update, bloques, archivo='estadisticas.txt')
         
     except Exception as e:
         logger.error(f"Error obteniendo estadísticas: {e}")
         await update.message.reply_text('❌ Error al obtener estadísticas')
 
+@permisos.requiere('viewer')
+async def ver_grafica(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Envía la gráfica de registros por día y monto por bono"""
+    db_evento = await db_del_chat(update)
+    try:
+        # Si los datos no cambiaron, se reenvía la imagen ya subida a Telegram
+        version = await db_evento.asincrona.ultimo_cambio()
+        file_id, _ = cache_archivos.obtener(f'grafica_{db_evento.evento_id}', version)
+        
+        if file_id:
+            await update.message.reply_photo(file_id, caption='📊 Registros por día y monto por bono')
+            return
+        
+        png = await generar_grafica(db_evento)
+        
+        if png is None:
+            await update.message.reply_text('📭 No hay datos en la base de datos')
+            return
+        
+        mensaje = await update.message.reply_photo(png, caption='📊 Registros por día y monto por bono')
+        cache_archivos.guardar(f'grafica_{db_evento.evento_id}', version, mensaje.photo[-1].file_id)
+        
+    except Exception as e:
+        logger.error(f"Error generando gráfica: {e}")
+        await update.message.reply_text('❌ Error al generar la gráfica')
+
+@permisos.requiere('viewer')
+async def ver_analisis(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Muestra promedios, percentiles y los principales grupos por guía, bono, día u hora"""
+    db_evento = await db_del_chat(update)
+    analitica = analitica_del_evento(db_evento)
+    try:
+        # Leer y agrupar consulta la base: se hace fuera del event loop
+        loop = asyncio.get_running_loop()
+        resumen = await loop.run_in_executor(None, analitica.resumen)
+        
+        if not resumen:
+            await update.message.reply_text('📭 No hay datos en la base de datos')
+            return
+        
+        dimensiones = [context.args[0].lower()] if context.args else ['guia', 'bono', 'dia', 'hora']
+        if dimensiones[0] not in DIMENSIONES:
+            await update.message.reply_text(f'❌ Usa /analisis [{" | ".join(DIMENSIONES)}]')
+            return
+        
+        bloques = [ANALISIS_RESUMEN.render(
+            r=resumen, m=resumen['monto_percentiles'], a=resumen['asistentes_percentiles']
+        )]
+        
+        titulos = {'guia': '👤 Por guía', 'bono': '🎫 Por bono', 'grupo': '🏷️ Por grupo',
+                   'dia': '📅 Por día', 'hora': '🕐 Por hora'}
+        for dimension in dimensiones:
+            # Días y horas se listan en orden cronológico; el resto, los 5 con más monto
+            if dimension in ('dia', 'hora'):
+                grupos = await loop.run_in_executor(None, lambda: analitica.agrupar(dimension, orden=None))
+            else:
+                grupos = await loop.run_in_executor(
+                    None, lambda: analitica.agrupar(dimension, top=5 if len(dimensiones) > 1 else 15)
+                )
+            bloques.append(ANALISIS_TITULO.render(titulo=titulos[dimension]))
+            bloques.extend(ANALISIS_GRUPO.lineas('g', grupos))
+        
+        await responder(update, bloques, archivo='analisis.txt')
+        
+    except Exception as e:
+        logger.error(f"Error en análisis: {e}")
+        await update.message.reply_text('❌ Error al calcular el análisis')
+
 async def ayuda(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text(
-        "🤖 **COMANDOS DISPONIBLES:**\n\n"
-        "🚀 /start - Iniciar captura de datos\n"
-        "📝 /nuevo - Nuevo registro\n"
-        "🔧 /corregir - Corregir tipos de bono\n"
-        "🗑️ /eliminar - Eliminar registros\n"
-        "📊 /reporte - Generar CSV desde BD\n"
-        "📈 /estadisticas - Ver estadísticas\n"
-        "🧹 /limpiar - Limpiar base de datos\n"
-        "ℹ️ /ayuda - Mostrar esta ayuda\n\n"
-        "💾 **Sistema con corrección y eliminación de bonos**"
-    )
+    await responder(update, AYUDA.render())
 
 # ================= INICIAR BOT =================
 def iniciar_bot():
     token = os.environ.get('BOT_TOKEN')
     
     if not token:
-        print("❌ ERROR: BOT_TOKEN no encontrado")
-        print("💡 Configura BOT_TOKEN en Secrets (🔒)")
+        logger.error("BOT_TOKEN no encontrado: configúralo en Secrets")
         return
     
     try:
-        application = Application.builder().token(token).build()
+        # Usuarios en paralelo con tope de trabajadores; cada usuario, en orden
+        application = Application.builder().token(token).concurrent_updates(ProcesadorOrdenado()).build()
         
         # Conversación principal para capturar datos
         conv_principal = ConversationHandler(
@@ -717,11 +1284,19 @@ def iniciar_bot():
             states={
                 GRUPO: [MessageHandler(filters.TEXT & ~filters.COMMAND, capturar_grupo)],
                 GUIA: [MessageHandler(filters.TEXT & ~filters.COMMAND, capturar_guia)],
-                BONO: [MessageHandler(filters.TEXT & ~filters.COMMAND, capturar_bono)],
+                BONO: [
+                    MessageHandler(filters.TEXT & ~filters.COMMAND, capturar_bono),
+                    CallbackQueryHandler(elegir_bono, pattern=r'^bono_(sugerido_\d+|nuevo)$'),
+                ],
                 MONTO: [MessageHandler(filters.TEXT & ~filters.COMMAND, capturar_monto)],
                 ASISTENTES: [MessageHandler(filters.TEXT & ~filters.COMMAND, capturar_asistentes)],
             },
-            fallbacks=[CommandHandler('cancel', lambda u,c: u.message.reply_text('❌ Cancelado'))]
+            fallbacks=[CommandHandler('cancel', lambda u,c: u.message.reply_text('❌ Cancelado'))],
+            # Estado por (chat, usuario); el orden de sus pasos lo garantiza ProcesadorOrdenado
+            per_chat=True,
+            per_user=True,
+            per_message=False,
+            block=True,
         )
         
         # Conversación para corrección de bonos
@@ -730,7 +1305,12 @@ def iniciar_bot():
             states={
                 NUEVO_BONO: [MessageHandler(filters.TEXT & ~filters.COMMAND, capturar_nuevo_bono)],
             },
-            fallbacks=[CommandHandler('cancel', lambda u,c: u.message.reply_text('❌ Corrección cancelada'))]
+            fallbacks=[CommandHandler('cancel', lambda u,c: u.message.reply_text('❌ Corrección cancelada'))],
+            # Estado por (chat, usuario); el orden de sus pasos lo garantiza ProcesadorOrdenado
+            per_chat=True,
+            per_user=True,
+            per_message=False,
+            block=True,
         )
         
         # Conversación para eliminación de bonos
@@ -739,18 +1319,40 @@ def iniciar_bot():
             states={
                 ELIMINAR_BONO: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_eliminar_por_id)],
             },
-            fallbacks=[CommandHandler('cancel', lambda u,c: u.message.reply_text('❌ Eliminación cancelada'))]
+            fallbacks=[CommandHandler('cancel', lambda u,c: u.message.reply_text('❌ Eliminación cancelada'))],
+            # Estado por (chat, usuario); el orden de sus pasos lo garantiza ProcesadorOrdenado
+            per_chat=True,
+            per_user=True,
+            per_message=False,
+            block=True,
         )
         
+        # Antes que cualquier otro handler: límite por usuario y descarte de duplicados
+        application.add_handler(TypeHandler(Update, antiabuso.filtrar), group=-1)
+        
         # Handlers principales
         application.add_handler(conv_principal)
         application.add_handler(conv_correccion)
         application.add_handler(conv_eliminacion)
         application.add_handler(CommandHandler("corregir", corregir_bono))
         application.add_handler(CommandHandler("eliminar", eliminar_bono))
+        application.add_handler(CommandHandler("deshacer", deshacer))
+        application.add_handler(CommandHandler("otorgar", otorgar))
+        application.add_handler(CommandHandler("cupo", cupo))
+        application.add_handler(CommandHandler("evento", cambiar_evento))
+        application.add_handler(CommandHandler("archivar", archivar_evento))
+        application.add_handler(CommandHandler("respaldo", respaldo))
+        application.add_handler(CommandHandler("duplicados", ver_duplicados))
         application.add_handler(CommandHandler("reporte", generar_reporte))
         application.add_handler(CommandHandler("estadisticas", ver_estadisticas))
+        application.add_handler(CommandHandler("analisis", ver_analisis))
+        application.add_handler(CommandHandler("grafica", ver_grafica))
         application.add_handler(CommandHandler("ayuda", ayuda))
+        application.add_handler(InlineQueryHandler(autocompletar))
+        application.add_handler(CommandHandler("checkin", modo_checkin))
+        application.add_handler(CommandHandler("suscribir", suscribir))
+        application.add_handler(CommandHandler("desuscribir", desuscribir))
+        application.add_handler(MessageHandler((filters.PHOTO | filters.TEXT) & ~filters.COMMAND, escanear_boleto))
         
         # Handlers para botones inline
         application.add_handler(CallbackQueryHandler(handle_corregir_bono, pattern='^corregir_'))
@@ -762,24 +1364,33 @@ def iniciar_bot():
         application.add_handler(CallbackQueryHandler(lambda u,c: u.callback_query.edit_message_text('❌ Corrección cancelada'), pattern='^cancelar_correccion$'))
         application.add_handler(CallbackQueryHandler(lambda u,c: u.callback_query.edit_message_text('❌ Eliminación cancelada'), pattern='^cancelar_eliminacion$'))
         
-        print("🤖 Bot con Corrección y Eliminación de Bonos iniciado correctamente")
-        print("✅ Envía /start a tu bot en Telegram")
+        # Resúmenes de cada hora y de cierre del día para los chats suscritos
+        programar_resumenes(application)
+        
+        logger.info("Bot con Corrección y Eliminación de Bonos iniciado", extra={'backend': 'postgresql' if DATABASE_URL else 'sqlite'})
         application.run_polling()
         
     except Exception as e:
-        print(f"❌ Error: {e}")
+        logger.error(f"Error al iniciar el bot: {e}", exc_info=True)
 
 # ================= INICIAR TODO =================
 def iniciar_servidor_web():
     app.run(host='0.0.0.0', port=8080)
 
 if __name__ == '__main__':
-    print("🚀 Iniciando Bot del Congreso 2026 con Corrección y Eliminación de Bonos...")
+    logger.info("Iniciando Bot del Congreso 2026", extra={'ruta': os.getcwd(), 'base_datos': db.descripcion()})
     
     # Iniciar bot en hilo separado
     bot_thread = threading.Thread(target=iniciar_bot)
     bot_thread.daemon = True
     bot_thread.start()
     
+    # Compactar eliminaciones vencidas en horas de baja actividad
+    db.iniciar_compactador()
+    replica.iniciar()
+    respaldos.iniciar()
+    if boletos is not None:
+        boletos.iniciar()
+    
     # Iniciar servidor web
     iniciar_servidor_web()
@@ -0,0 +1,149 @@
+import io
+import os
+import re
+import html
+import logging
+from string import Formatter
+
+from telegram.constants import ParseMode
+
+logger = logging.getLogger(__name__)
+
+# Límite de Telegram por mensaje, en unidades UTF-16 (los emoji cuentan doble)
+LIMITE_MENSAJE = 4096
+
+# Si una respuesta necesita más mensajes que esto, se envía como documento
+MAXIMO_MENSAJES = int(os.environ.get('MAXIMO_MENSAJES', '4'))
+
+_ABRE, _CIERRA, _ABRE_CODIGO, _CIERRA_CODIGO = '\x00', '\x01', '\x02', '\x03'
+_CARACTERES_MARKDOWN = re.compile(r'([_*\[\]()~`>#+\-=|{}.!\\])')
+_ETIQUETAS = re.compile(r'<[^>]+>')
+
+# Resuelve los campos ({registro.grupo}, {d[ingreso]}) y las conversiones (!r) igual que str.format
+_FORMATEADOR = Formatter()
+
+def escapar_html(valor):
+    """Escapa un valor para parse_mode HTML"""
+    return html.escape(str(valor), quote=False)
+
+def escapar_markdown(valor):
+    """Escapa un valor para parse_mode MarkdownV2"""
+    return _CARACTERES_MARKDOWN.sub(r'\\\1', str(valor))
+
+# parse_mode -> (escape, abre negrita, cierra negrita, abre código, cierra código)
+FORMATOS = {
+    ParseMode.HTML: (escapar_html, '<b>', '</b>', '<code>', '</code>'),
+    ParseMode.MARKDOWN_V2: (escapar_markdown, '*', '*', '`', '`'),
+}
+
+def longitud(texto):
+    """Longitud tal como la cuenta Telegram (unidades UTF-16)"""
+    return len(texto.encode('utf-16-le')) // 2
+
+def texto_plano(texto):
+    """Quita el marcado HTML para enviar el contenido como archivo de texto"""
+    return html.unescape(_ETIQUETAS.sub('', texto))
+
+class Plantilla:
+    """Mensaje compilado una sola vez al importar el módulo
+
+    Se escribe con **negrita**, `código` y campos como en str.format ({registro.grupo:>10}).
+    El texto fijo y cada valor se escapan para el parse_mode elegido, así los
+    nombres con <, & o * que escriben los usuarios no rompen el mensaje.
+    """
+    
+    __slots__ = ('parse_mode', '_partes')
+    
+    def __init__(self, texto, parse_mode=ParseMode.HTML):
+        escapar, *etiquetas = FORMATOS[parse_mode]
+        self.parse_mode = parse_mode
+        
+        # ** y ` se cambian por marcas que ni el escape ni el parser de campos tocan
+        marcado = re.sub(r'\*\*(.+?)\*\*', f'{_ABRE}\\1{_CIERRA}', texto, flags=re.S)
+        marcado = re.sub(r'`(.+?)`', f'{_ABRE_CODIGO}\\1{_CIERRA_CODIGO}', marcado, flags=re.S)
+        marcas = dict(zip((_ABRE, _CIERRA, _ABRE_CODIGO, _CIERRA_CODIGO), etiquetas))
+        
+        partes = []
+        for literal, campo, especificacion, conversion in _FORMATEADOR.parse(marcado):
+            if literal:
+                literal = escapar(literal)
+                for marca, etiqueta in marcas.items():
+                    literal = literal.replace(marca, etiqueta)
+                partes.append(literal)
+            if campo is not None:
+                partes.append((campo, especificacion or '', conversion))
+        self._partes = tuple(partes)
+    
+    def render(self, **valores):
+        """Devuelve el mensaje con los valores escapados"""
+        escapar = FORMATOS[self.parse_mode][0]
+        salida = []
+        for parte in self._partes:
+            if isinstance(parte, str):
+                salida.append(parte)
+                continue
+            campo, especificacion, conversion = parte
+            valor, _ = _FORMATEADOR.get_field(campo, (), valores)
+            valor = _FORMATEADOR.convert_field(valor, conversion)
+            salida.append(escapar(format(valor, especificacion)))
+        return ''.join(salida)
+    
+    def lineas(self, nombre, elementos, **valores):
+        """Renderiza la plantilla una vez por elemento (pasado como ``nombre``)"""
+        for elemento in elementos:
+            valores[nombre] = elemento
+            yield self.render(**valores)
+
+def dividir(bloques, limite=LIMITE_MENSAJE):
+    """Agrupa bloques ya renderizados en mensajes que no pasan del límite
+
+    Nunca parte un bloque (así no se corta una etiqueta a la mitad); un bloque
+    que por sí solo excede el límite se devuelve solo y el llamador decide.
+    """
+    mensajes = []
+    actual = []
+    tamano = 0
+    for bloque in bloques:
+        medida = longitud(bloque)
+        if actual and tamano + medida > limite:
+            mensajes.append(''.join(actual))
+            actual = []
+            tamano = 0
+        actual.append(bloque)
+        tamano += medida
+    if actual:
+        mensajes.append(''.join(actual))
+    return mensajes
+
+async def responder(update, bloques, reply_markup=None, archivo='mensaje.txt', parse_mode=ParseMode.HTML):
+    """Envía un mensaje renderizado, dividido en varios si pasa del límite de Telegram
+
+    ``bloques`` es un texto o una lista de textos renderizados. En un callback
+    el primer mensaje reemplaza al del botón. Si harían falta más de
+    MAXIMO_MENSAJES (o un bloque no cabe en uno), se envía como archivo.
+    """
+    if isinstance(bloques, str):
+        bloques = [bloques]
+    mensajes = dividir(bloques)
+    query = update.callback_query
+    
+    if len(mensajes) > MAXIMO_MENSAJES or any(longitud(m) > LIMITE_MENSAJE for m in mensajes):
+        contenido = texto_plano(''.join(mensajes)) if parse_mode == ParseMode.HTML else ''.join(mensajes)
+        documento = io.BytesIO(contenido.encode('utf-8'))
+        caption = f'📄 La respuesta es muy larga ({len(contenido):,} caracteres); va como archivo.'
+        logger.info(f"Respuesta de {len(mensajes)} mensajes enviada como archivo {archivo}")
+        if query:
+            await query.edit_message_text(caption, reply_markup=reply_markup)
+            return await query.message.reply_document(documento, filename=archivo)
+        return await update.effective_message.reply_document(
+            documento, filename=archivo, caption=caption, reply_markup=reply_markup
+        )
+    
+    enviado = None
+    for i, texto in enumerate(mensajes):
+        markup = reply_markup if i == len(mensajes) - 1 else None
+        if i == 0 and query:
+            enviado = await query.edit_message_text(texto, parse_mode=parse_mode, reply_markup=markup)
+        else:
+            enviado = await update.effective_message.reply_text(texto, parse_mode=parse_mode, reply_markup=markup)
+    return enviado
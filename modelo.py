@@ -0,0 +1,73 @@
+from datetime import datetime
+
+def a_centavos(monto):
+    """Convierte un monto en pesos (texto o número) a centavos enteros"""
+    return int(round(float(monto) * 100))
+
+def formatear_monto(centavos):
+    """$1,234.56 a partir de centavos"""
+    return f'${centavos / 100:,.2f}'
+
+def formatear_cupo(capacidad, disponibles):
+    """'12 de 50 libres', 'agotado' o 'sobrevendido por 3'"""
+    if disponibles > 0:
+        return f'{disponibles} de {capacidad} libres'
+    return 'agotado' if disponibles == 0 else f'sobrevendido por {-disponibles}'
+
+def formatear_fecha(fecha):
+    """Solo el día (AAAA-MM-DD) de una fecha de registro"""
+    return fecha.strftime('%Y-%m-%d') if fecha else ''
+
+class Registro:
+    """Un registro de asistencia tal como lo devuelve Database
+
+    La fecha se interpreta una sola vez al leer la fila y el monto se guarda en
+    centavos enteros; los handlers usan atributos en lugar de desempaquetar tuplas.
+    """
+    
+    __slots__ = ('id', 'grupo', 'guia', 'bono', 'centavos', 'asistentes', 'fecha')
+    
+    def __init__(self, id, grupo, guia, bono, centavos, asistentes, fecha):
+        self.id = id
+        self.grupo = grupo
+        self.guia = guia
+        self.bono = bono
+        self.centavos = centavos
+        self.asistentes = asistentes
+        self.fecha = fecha
+    
+    @classmethod
+    def desde_fila(cls, cursor, fila):
+        """Row factory de sqlite3 (también sirve para filas de asyncpg con cursor None)"""
+        id, grupo, guia, bono, monto, asistentes, fecha = fila
+        if isinstance(fecha, str):
+            fecha = datetime.fromisoformat(fecha)
+        return cls(id, grupo, guia, bono, a_centavos(monto), asistentes, fecha)
+    
+    @property
+    def monto(self):
+        """Monto en pesos"""
+        return self.centavos / 100
+    
+    @property
+    def monto_texto(self):
+        return formatear_monto(self.centavos)
+    
+    @property
+    def dia(self):
+        return formatear_fecha(self.fecha)
+    
+    def fila(self):
+        """Tupla para exportar: (id, grupo, guia, bono, monto, asistentes, fecha)"""
+        fecha = self.fecha.strftime('%Y-%m-%d %H:%M:%S') if self.fecha else None
+        return (self.id, self.grupo, self.guia, self.bono, self.monto, self.asistentes, fecha)
+    
+    def __eq__(self, otro):
+        return isinstance(otro, Registro) and self.fila() == otro.fila()
+    
+    def __hash__(self):
+        # Igual que __eq__: dos registros con los mismos datos caen en la misma entrada de un set o dict
+        return hash(self.fila())
+    
+    def __repr__(self):
+        return f'Registro(#{self.id} {self.grupo!r} {self.bono!r} {self.monto_texto} x{self.asistentes})'
@@ -0,0 +1,75 @@
+import os
+import logging
+import threading
+from functools import wraps
+
+from bitacora import anotar
+
+logger = logging.getLogger(__name__)
+
+# Cada rol incluye los permisos de los roles de menor nivel
+NIVELES = {'viewer': 1, 'guia': 2, 'admin': 3}
+
+# Usuarios que siempre son admin (IDs de Telegram separados por comas)
+ADMIN_IDS = [int(i) for i in os.environ.get('ADMIN_IDS', '').split(',') if i.strip()]
+
+# Rol de los usuarios sin rol asignado; vacío = sin acceso
+ROL_POR_DEFECTO = os.environ.get('ROL_POR_DEFECTO', '') or None
+
+class Permisos:
+    """Índice en memoria de los roles guardados en la base de datos
+
+    Se carga una vez al iniciar y se actualiza al otorgar roles, así que comprobar
+    un permiso es una búsqueda en un diccionario, sin consultas a la base de datos.
+    """
+    
+    def __init__(self, db, admin_ids=ADMIN_IDS, rol_por_defecto=ROL_POR_DEFECTO):
+        self.db = db
+        self.rol_por_defecto = rol_por_defecto
+        self._lock = threading.Lock()
+        self._roles = db.obtener_roles()
+        
+        for usuario_id in admin_ids:
+            if self._roles.get(usuario_id) != 'admin':
+                self.otorgar(usuario_id, 'admin')
+        
+        logger.info(f"Permisos: {len(self._roles)} usuarios con rol")
+    
+    def rol(self, usuario_id):
+        """Devuelve el rol del usuario (o el rol por defecto)"""
+        return self._roles.get(usuario_id, self.rol_por_defecto)
+    
+    def tiene(self, usuario_id, rol):
+        """Indica si el usuario tiene al menos el rol indicado"""
+        return NIVELES.get(self.rol(usuario_id), 0) >= NIVELES[rol]
+    
+    def otorgar(self, usuario_id, rol, otorgado_por=None):
+        """Asigna (o quita, con rol None) el rol de un usuario en la base de datos y en memoria"""
+        if rol is not None and rol not in NIVELES:
+            raise ValueError(f'Rol no válido: {rol}')
+        
+        with self._lock:
+            self.db.guardar_rol(usuario_id, rol, otorgado_por)
+            if rol is None:
+                self._roles.pop(usuario_id, None)
+            else:
+                self._roles[usuario_id] = rol
+    
+    def requiere(self, rol):
+        """Decorador de handlers: rechaza la actualización si el usuario no tiene el rol"""
+        def decorador(handler):
+            @wraps(handler)
+            async def envoltura(update, context):
+                anotar(handler=handler.__name__)
+                usuario = update.effective_user
+                if usuario is not None and self.tiene(usuario.id, rol):
+                    return await handler(update, context)
+                
+                logger.warning(f"Acceso denegado a {handler.__name__} para {usuario.id if usuario else None}")
+                if update.callback_query:
+                    await update.callback_query.answer('⛔ No tienes permiso para esta acción', show_alert=True)
+                elif update.effective_message:
+                    await update.effective_message.reply_text('⛔ No tienes permiso para esta acción')
+                return None
+            return envoltura
+        return decorador
@@ -0,0 +1,12 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+_pool = None
+
+def obtener_pool():
+    """Devuelve el pool de procesos compartido para trabajo pesado (gráficas, reportes)"""
+    global _pool
+    if _pool is None:
+        # spawn: el proceso hijo no hereda los hilos del bot ni del servidor web
+        _pool = ProcessPoolExecutor(max_workers=2, mp_context=multiprocessing.get_context('spawn'))
+    return _pool
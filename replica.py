@@ -0,0 +1,102 @@
+import os
+import time
+import sqlite3
+import logging
+import threading
+
+from database import DatabaseLectura, DATABASE_URL
+
+logger = logging.getLogger(__name__)
+
+# Antigüedad máxima (segundos) de la copia de lectura; 0 = leer siempre de la base principal
+SEGUNDOS_REPLICA = int(os.environ.get('SEGUNDOS_REPLICA', '60'))
+
+# Páginas copiadas por paso de backup; entre pasos la base principal queda libre para escribir
+PAGINAS_POR_PASO = int(os.environ.get('PAGINAS_POR_PASO', '256'))
+
+def copiar_en_linea(origen, destino, paginas=PAGINAS_POR_PASO, pausa=0.005):
+    """Copia una base SQLite abierta con la API de backup, por bloques de páginas
+
+    Entre bloque y bloque se suelta el bloqueo de lectura de ``origen``, así las
+    escrituras nunca esperan más que la copia de un bloque.
+    """
+    conn_origen = sqlite3.connect(origen)
+    conn_destino = sqlite3.connect(destino)
+    try:
+        conn_origen.backup(conn_destino, pages=paginas, sleep=pausa)
+    finally:
+        conn_destino.close()
+        conn_origen.close()
+
+class Replica:
+    """Copia de solo lectura de la base principal para reportes y estadísticas
+
+    Un hilo la refresca cada ``intervalo`` segundos. La copia nueva se escribe
+    aparte y se cambia por la anterior con un rename atómico, así las lecturas
+    en curso terminan sobre la copia vieja. Con PostgreSQL o con intervalo 0
+    las lecturas van directo a la base principal.
+    """
+    
+    def __init__(self, db, intervalo=SEGUNDOS_REPLICA):
+        self.db = db
+        self.intervalo = intervalo
+        self.activa = intervalo > 0 and not DATABASE_URL
+        self.actualizada = None
+        self._lock = threading.Lock()
+        self._lectura = None
+        
+        if self.activa:
+            base, _ = os.path.splitext(db.db_name)
+            self.ruta = f'{base}_lectura.db'
+            self.refrescar()
+    
+    def refrescar(self):
+        """Copia la base principal y reemplaza la copia de lectura"""
+        temporal = f'{self.ruta}.tmp'
+        inicio = time.monotonic()
+        
+        with self._lock:
+            copiar_en_linea(self.db.db_name, temporal)
+            os.replace(temporal, self.ruta)
+            if self._lectura is None:
+                self._lectura = DatabaseLectura(self.ruta)
+            else:
+                self._lectura.cache.invalidar()
+            self.actualizada = time.time()
+        
+        logger.info(f"Réplica de lectura actualizada en {time.monotonic() - inicio:.2f} s")
+    
+    def iniciar(self):
+        """Lanza el hilo que mantiene la copia al día"""
+        if not self.activa:
+            return None
+        
+        def refrescador():
+            while True:
+                time.sleep(self.intervalo)
+                try:
+                    self.refrescar()
+                except Exception as e:
+                    logger.error(f"Error actualizando la réplica de lectura: {e}")
+        
+        hilo = threading.Thread(target=refrescador, daemon=True)
+        hilo.start()
+        return hilo
+    
+    def lectura(self, db_evento):
+        """Devuelve la copia de lectura limitada al evento de ``db_evento``"""
+        if not self.activa:
+            return db_evento
+        return self._lectura.del_evento(db_evento.evento_id)
+    
+    def antiguedad(self):
+        """Segundos desde la última copia (0 si se lee de la base principal)"""
+        if not self.activa:
+            return 0
+        return int(time.time() - self.actualizada)
+    
+    def leyenda(self):
+        """Texto para captions indicando la antigüedad de los datos"""
+        if not self.activa:
+            return '🕒 Datos en tiempo real'
+        return f'🕒 Datos de hace {self.antiguedad()} s (se actualizan cada {self.intervalo} s)'
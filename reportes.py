@@ -0,0 +1,201 @@
+import io
+import re
+import csv
+import asyncio
+import logging
+import zipfile
+from datetime import datetime
+from itertools import groupby
+
+from database import abrir_lectura
+from exportar import ENCABEZADOS_CSV
+from procesos import obtener_pool
+
+logger = logging.getLogger(__name__)
+
+# formato -> (función escritora, extensión, se genera en un proceso aparte)
+ESCRITORES = {}
+
+# (evento, formato, versión) -> tarea en curso, para que pedidos simultáneos compartan una sola construcción
+_en_curso = {}
+
+def escritor(formato, extension, pesado=False):
+    """Registra una función que escribe un reporte en un archivo binario
+
+    La función recibe (db, salida) y devuelve el número de registros escritos.
+    """
+    def registrar(funcion):
+        ESCRITORES[formato] = (funcion, extension, pesado)
+        return funcion
+    return registrar
+
+def _nombre_seguro(texto, limite=31):
+    """Limpia un nombre de bono para usarlo como hoja de Excel o archivo"""
+    limpio = re.sub(r'[\[\]:*?/\\]', '_', str(texto)).strip() or 'sin_bono'
+    return limpio[:limite]
+
+# ================= ESCRITORES =================
+@escritor('csv', 'csv')
+def escribir_csv(db, salida):
+    """Todos los registros en un solo CSV"""
+    texto = io.TextIOWrapper(salida, encoding='utf-8', newline='')
+    writer = csv.writer(texto)
+    writer.writerow(ENCABEZADOS_CSV)
+    
+    total = 0
+    for registro in db.iterar_registros():
+        writer.writerow(registro.fila())
+        total += 1
+    
+    texto.flush()
+    texto.detach()
+    return total
+
+@escritor('xlsx', 'xlsx', pesado=True)
+def escribir_xlsx(db, salida):
+    """Una hoja por bono con fila de subtotal, más una hoja de resumen"""
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Font
+    
+    libro = Workbook(write_only=True)
+    resumen = libro.create_sheet('Resumen')
+    resumen.append(['BONO', 'REGISTROS', 'ASISTENTES', 'MONTO'])
+    negrita = Font(bold=True)
+    
+    def fila_negrita(hoja, valores):
+        celdas = []
+        for valor in valores:
+            celda = WriteOnlyCell(hoja, value=valor)
+            celda.font = negrita
+            celdas.append(celda)
+        hoja.append(celdas)
+    
+    total = total_asistentes = total_monto = 0
+    nombres_usados = set()
+    
+    for bono, registros in groupby(db.iterar_registros(por_bono=True), key=lambda r: r.bono):
+        nombre = _nombre_seguro(bono)
+        sufijo = 1
+        while nombre.lower() in nombres_usados:
+            sufijo += 1
+            nombre = f'{_nombre_seguro(bono, 28)}_{sufijo}'
+        nombres_usados.add(nombre.lower())
+        
+        hoja = libro.create_sheet(nombre)
+        hoja.append(ENCABEZADOS_CSV)
+        
+        cantidad = asistentes = centavos = 0
+        for registro in registros:
+            hoja.append(list(registro.fila()))
+            cantidad += 1
+            asistentes += registro.asistentes
+            centavos += registro.centavos
+        monto = centavos / 100
+        
+        fila_negrita(hoja, ['SUBTOTAL', '', '', bono, monto, asistentes, f'{cantidad} registros'])
+        resumen.append([bono, cantidad, asistentes, monto])
+        
+        total += cantidad
+        total_asistentes += asistentes
+        total_monto += monto
+    
+    fila_negrita(resumen, ['TOTAL', total, total_asistentes, total_monto])
+    libro.save(salida)
+    return total
+
+@escritor('pdf', 'pdf', pesado=True)
+def escribir_pdf(db, salida):
+    """Resumen en PDF con totales por bono"""
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import letter
+    from reportlab.lib.styles import getSampleStyleSheet
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
+    
+    stats = db.obtener_estadisticas()
+    estilos = getSampleStyleSheet()
+    
+    filas = [['Bono', 'Registros', 'Asistentes', 'Monto']]
+    total_monto = 0
+    for bono, cantidad, asistentes, monto in stats['por_bono']:
+        filas.append([bono, cantidad, asistentes, f'${float(monto):,.2f}'])
+        total_monto += float(monto)
+    filas.append(['TOTAL', stats['total_registros'], stats['total_asistentes'], f'${total_monto:,.2f}'])
+    
+    tabla = Table(filas, hAlign='LEFT')
+    tabla.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#4a90d9')),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
+        ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
+        ('ALIGN', (1, 0), (-1, -1), 'RIGHT'),
+    ]))
+    
+    documento = SimpleDocTemplate(salida, pagesize=letter, title='Reporte Congreso 2026')
+    documento.build([
+        Paragraph('Reporte del Congreso 2026', estilos['Title']),
+        Paragraph(f'Generado: {datetime.now():%Y-%m-%d %H:%M}', estilos['Normal']),
+        Spacer(1, 12),
+        tabla,
+    ])
+    return stats['total_registros']
+
+@escritor('zip', 'zip', pesado=True)
+def escribir_zip(db, salida):
+    """ZIP con un CSV por bono"""
+    total = 0
+    nombres_usados = set()
+    
+    with zipfile.ZipFile(salida, 'w', zipfile.ZIP_DEFLATED) as archivo_zip:
+        for bono, registros in groupby(db.iterar_registros(por_bono=True), key=lambda r: r.bono):
+            nombre = _nombre_seguro(bono, 80)
+            sufijo = 1
+            while nombre.lower() in nombres_usados:
+                sufijo += 1
+                nombre = f'{_nombre_seguro(bono, 76)}_{sufijo}'
+            nombres_usados.add(nombre.lower())
+            
+            with archivo_zip.open(f'{nombre}.csv', 'w') as binario:
+                texto = io.TextIOWrapper(binario, encoding='utf-8', newline='')
+                writer = csv.writer(texto)
+                writer.writerow(ENCABEZADOS_CSV)
+                for registro in registros:
+                    writer.writerow(registro.fila())
+                    total += 1
+                texto.flush()
+                texto.detach()
+    
+    return total
+
+# ================= CONSTRUCCIÓN =================
+def construir_reporte(db_name, formato, evento_id):
+    """Genera el reporte de un evento y devuelve (bytes, registros); se puede ejecutar en otro proceso"""
+    funcion, _, _ = ESCRITORES[formato]
+    salida = io.BytesIO()
+    registros = funcion(abrir_lectura(db_name, evento_id), salida)
+    return salida.getvalue(), registros
+
+async def generar_reporte(db, formato, version):
+    """Construye un reporte sin bloquear el event loop
+
+    Los formatos pesados van al pool de procesos y los ligeros a un hilo. Si ya hay
+    una construcción del mismo evento, formato y versión en curso, se espera esa misma.
+    Devuelve (bytes, registros, nombre_de_archivo).
+    """
+    _, extension, pesado = ESCRITORES[formato]
+    clave = (db.evento_id, formato, version)
+    
+    tarea = _en_curso.get(clave)
+    if tarea is None:
+        loop = asyncio.get_running_loop()
+        if pesado:
+            tarea = loop.run_in_executor(obtener_pool(), construir_reporte, db.db_name, formato, db.evento_id)
+        else:
+            tarea = loop.run_in_executor(None, construir_reporte, db.db_name, formato, db.evento_id)
+        tarea = asyncio.ensure_future(tarea)
+        _en_curso[clave] = tarea
+        tarea.add_done_callback(lambda _: _en_curso.pop(clave, None))
+    
+    contenido, registros = await asyncio.shield(tarea)
+    return contenido, registros, f'reporte_congreso_2026.{extension}'
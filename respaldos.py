@@ -0,0 +1,324 @@
+import os
+import re
+import gzip
+import json
+import time
+import shutil
+import sqlite3
+import logging
+import argparse
+import threading
+from datetime import datetime
+
+from database import Database, COLUMNAS_REGISTRO, DATABASE_URL
+from replica import copiar_en_linea
+
+logger = logging.getLogger(__name__)
+
+# Carpeta local de respaldos
+DIRECTORIO_RESPALDOS = os.environ.get('DIRECTORIO_RESPALDOS', 'respaldos')
+
+# Cada cuánto se hace una copia completa y cada cuánto se guardan los cambios nuevos
+HORAS_ENTRE_RESPALDOS = float(os.environ.get('HORAS_ENTRE_RESPALDOS', '6'))
+MINUTOS_ENTRE_INCREMENTALES = float(os.environ.get('MINUTOS_ENTRE_INCREMENTALES', '5'))
+
+# Copias completas que se conservan (las más recientes)
+RESPALDOS_CONSERVADOS = int(os.environ.get('RESPALDOS_CONSERVADOS', '10'))
+
+# Telegram no deja a los bots enviar documentos de más de 50 MB
+TAMANO_MAXIMO_ENVIO = 50 * 1024 * 1024
+
+FORMATO_FECHA = '%Y%m%dT%H%M%S'
+PATRON_COMPLETO = re.compile(r'^(?P<nombre>.+)_(?P<fecha>\d{8}T\d{6})_(?P<seq>\d+)\.db\.gz$')
+PATRON_INCREMENTAL = re.compile(r'^(?P<nombre>.+)_cambios_(?P<desde>\d+)_(?P<hasta>\d+)\.jsonl\.gz$')
+
+def _ultimo_seq(ruta):
+    """Última secuencia del historial de cambios de un archivo SQLite"""
+    conn = sqlite3.connect(ruta)
+    try:
+        return conn.execute('SELECT COALESCE(MAX(seq), 0) FROM cambios').fetchone()[0]
+    finally:
+        conn.close()
+
+def _leer_cambios(ruta, desde):
+    """Cambios (de todos los eventos) posteriores a la secuencia ``desde`` de un archivo SQLite"""
+    conn = sqlite3.connect(ruta)
+    try:
+        cursor = conn.execute('''
+            SELECT seq, fecha, evento_id, usuario, operacion, registro_id, antes, despues
+            FROM cambios
+            WHERE seq > ?
+            ORDER BY seq
+        ''', (desde,))
+        for seq, fecha, evento_id, usuario, operacion, registro_id, antes, despues in cursor:
+            yield {
+                'seq': seq,
+                'fecha': fecha,
+                'evento_id': evento_id,
+                'usuario': usuario,
+                'operacion': operacion,
+                'registro_id': registro_id,
+                'antes': json.loads(antes) if antes else None,
+                'despues': json.loads(despues) if despues else None
+            }
+    finally:
+        conn.close()
+
+class Respaldos:
+    """Respaldos en línea de la base SQLite: copias completas más incrementales del historial
+
+    La copia completa usa la API de backup por bloques de páginas (ver
+    replica.copiar_en_linea) y se guarda comprimida con la secuencia del historial
+    que contiene. Entre copias completas solo se guardan los cambios nuevos del
+    historial; con ambos se puede restaurar la base a cualquier momento.
+    """
+    
+    def __init__(self, db_name, directorio=DIRECTORIO_RESPALDOS, conservados=RESPALDOS_CONSERVADOS):
+        self.db_name = db_name
+        self.directorio = directorio
+        self.conservados = conservados
+        self.nombre = os.path.splitext(os.path.basename(db_name))[0]
+        self._lock = threading.Lock()
+        os.makedirs(directorio, exist_ok=True)
+    
+    def listar(self):
+        """Devuelve (completos, incrementales) ordenados del más antiguo al más reciente
+
+        completos: lista de (ruta, fecha, seq); incrementales: lista de (ruta, desde, hasta).
+        """
+        completos = []
+        incrementales = []
+        for archivo in os.listdir(self.directorio):
+            ruta = os.path.join(self.directorio, archivo)
+            coincidencia = PATRON_COMPLETO.match(archivo)
+            if coincidencia and coincidencia['nombre'] == self.nombre:
+                fecha = datetime.strptime(coincidencia['fecha'], FORMATO_FECHA)
+                completos.append((ruta, fecha, int(coincidencia['seq'])))
+                continue
+            coincidencia = PATRON_INCREMENTAL.match(archivo)
+            if coincidencia and coincidencia['nombre'] == self.nombre:
+                incrementales.append((ruta, int(coincidencia['desde']), int(coincidencia['hasta'])))
+        
+        completos.sort(key=lambda r: (r[2], r[1]))
+        incrementales.sort(key=lambda r: r[1])
+        return completos, incrementales
+    
+    def _ultimo_respaldado(self):
+        """Última secuencia que ya está en algún respaldo"""
+        completos, incrementales = self.listar()
+        return max([seq for _, _, seq in completos] + [hasta for _, _, hasta in incrementales] + [0])
+    
+    def crear_respaldo(self):
+        """Hace una copia completa comprimida y rota las antiguas
+
+        Devuelve (ruta, bytes, seq).
+        """
+        with self._lock:
+            temporal = os.path.join(self.directorio, f'.{self.nombre}.tmp')
+            
+            # La fecha se toma al terminar: la copia no contiene nada posterior a ella
+            copiar_en_linea(self.db_name, temporal)
+            fecha = datetime.utcnow()
+            seq = _ultimo_seq(temporal)
+            
+            ruta = os.path.join(self.directorio, f'{self.nombre}_{fecha.strftime(FORMATO_FECHA)}_{seq}.db.gz')
+            with open(temporal, 'rb') as origen, gzip.open(f'{ruta}.tmp', 'wb') as destino:
+                shutil.copyfileobj(origen, destino, 1024 * 1024)
+            os.replace(f'{ruta}.tmp', ruta)
+            os.remove(temporal)
+            
+            self._rotar()
+        
+        tamano = os.path.getsize(ruta)
+        logger.info(f"Respaldo completo {os.path.basename(ruta)} ({tamano} bytes, seq {seq})")
+        return ruta, tamano, seq
+    
+    def respaldar_cambios(self):
+        """Guarda comprimidos los cambios del historial que aún no están respaldados
+
+        Devuelve la ruta del incremental, o None si no hubo cambios nuevos.
+        """
+        with self._lock:
+            desde = self._ultimo_respaldado()
+            cambios = list(_leer_cambios(self.db_name, desde))
+            if not cambios:
+                return None
+            
+            hasta = cambios[-1]['seq']
+            ruta = os.path.join(self.directorio, f'{self.nombre}_cambios_{desde}_{hasta}.jsonl.gz')
+            with gzip.open(f'{ruta}.tmp', 'wt', encoding='utf-8') as salida:
+                for cambio in cambios:
+                    salida.write(json.dumps(cambio, ensure_ascii=False) + '\n')
+            os.replace(f'{ruta}.tmp', ruta)
+        
+        logger.info(f"Respaldo incremental {os.path.basename(ruta)} ({len(cambios)} cambios)")
+        return ruta
+    
+    def _rotar(self):
+        """Borra las copias completas sobrantes y los incrementales que ya no hacen falta"""
+        completos, incrementales = self.listar()
+        sobrantes = completos[:-self.conservados] if self.conservados else []
+        for ruta, _, _ in sobrantes:
+            os.remove(ruta)
+        
+        conservados = completos[len(sobrantes):]
+        if not conservados:
+            return
+        
+        # Un incremental solo sirve si continúa alguna copia completa conservada
+        seq_minimo = conservados[0][2]
+        for ruta, _, hasta in incrementales:
+            if hasta <= seq_minimo:
+                os.remove(ruta)
+    
+    def iniciar(self, horas=HORAS_ENTRE_RESPALDOS, minutos=MINUTOS_ENTRE_INCREMENTALES):
+        """Lanza el hilo que hace incrementales cada ``minutos`` y copias completas cada ``horas``"""
+        if DATABASE_URL:
+            logger.info("Respaldos automáticos desactivados: PostgreSQL usa sus propias herramientas")
+            return None
+        
+        def respaldador():
+            completos, _ = self.listar()
+            ultimo_completo = 0
+            if completos:
+                ultimo_completo = time.time() - (datetime.utcnow() - completos[-1][1]).total_seconds()
+            
+            while True:
+                try:
+                    if time.time() - ultimo_completo >= horas * 3600:
+                        self.crear_respaldo()
+                        ultimo_completo = time.time()
+                    else:
+                        self.respaldar_cambios()
+                except Exception as e:
+                    logger.error(f"Error respaldando base de datos: {e}")
+                time.sleep(minutos * 60)
+        
+        hilo = threading.Thread(target=respaldador, daemon=True)
+        hilo.start()
+        return hilo
+
+# ================= RESTAURACIÓN =================
+def _aplicar_cambio(db, cursor, cambio):
+    """Reaplica un cambio del historial sobre la tabla registros
+
+    El historial guarda el nombre del bono; en la tabla va su id del catálogo.
+    """
+    fila = cambio['despues'] or cambio['antes']
+    columnas = ['bono_id' if columna == 'bono' else columna for columna in COLUMNAS_REGISTRO]
+    
+    if cambio['operacion'] in ('insertar', 'actualizar', 'restaurar'):
+        bono_id, _, _ = db._id_bono(cursor, fila['bono'])
+        valores = [bono_id if columna == 'bono' else fila[columna] for columna in COLUMNAS_REGISTRO]
+        asignaciones = ', '.join(f'{columna} = excluded.{columna}' for columna in columnas[1:])
+        cursor.execute(f'''
+            INSERT INTO registros (evento_id, {', '.join(columnas)})
+            VALUES (?, {', '.join('?' for _ in columnas)})
+            ON CONFLICT(id) DO UPDATE SET {asignaciones}, eliminado_en = NULL, lote_eliminacion = NULL, eliminado_por = NULL
+        ''', [cambio['evento_id']] + valores)
+    elif cambio['operacion'] == 'eliminar':
+        cursor.execute(
+            'UPDATE registros SET eliminado_en = ? WHERE id = ?',
+            (cambio['fecha'], cambio['registro_id'])
+        )
+    
+    cursor.execute('''
+        INSERT OR IGNORE INTO cambios (seq, fecha, evento_id, usuario, operacion, registro_id, antes, despues)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (
+        cambio['seq'], cambio['fecha'], cambio['evento_id'], cambio['usuario'],
+        cambio['operacion'], cambio['registro_id'],
+        None if cambio['antes'] is None else json.dumps(cambio['antes'], ensure_ascii=False),
+        None if cambio['despues'] is None else json.dumps(cambio['despues'], ensure_ascii=False)
+    ))
+
+def restaurar(respaldos, destino, hasta=None, base_viva=None):
+    """Reconstruye la base en ``destino`` tal como estaba en ``hasta`` (UTC; None = lo más reciente)
+
+    Parte de la copia completa más reciente anterior a ``hasta`` y le reaplica, en
+    orden, los cambios de los incrementales y (si existe) del historial de la base
+    viva. Devuelve (copia_usada, cambios_aplicados, ultimo_seq).
+    """
+    completos, incrementales = respaldos.listar()
+    candidatos = [c for c in completos if hasta is None or c[1] <= hasta]
+    if not candidatos:
+        raise ValueError('No hay ninguna copia completa anterior a la fecha indicada')
+    ruta_completo, _, seq = candidatos[-1]
+    
+    with gzip.open(ruta_completo, 'rb') as origen, open(destino, 'wb') as salida:
+        shutil.copyfileobj(origen, salida, 1024 * 1024)
+    
+    def cambios_disponibles():
+        for ruta, _, fin in incrementales:
+            if fin <= seq:
+                continue
+            with gzip.open(ruta, 'rt', encoding='utf-8') as entrada:
+                for linea in entrada:
+                    yield json.loads(linea)
+        if base_viva and os.path.exists(base_viva):
+            yield from _leer_cambios(base_viva, seq)
+    
+    # Abrirla con Database pone la copia al día con el esquema actual (p. ej. el catálogo de bonos)
+    db = Database(destino)
+    conn = db._conectar()
+    cursor = conn.cursor()
+    aplicados = 0
+    
+    for cambio in cambios_disponibles():
+        if cambio['seq'] <= seq:
+            continue
+        if hasta is not None and datetime.strptime(cambio['fecha'], '%Y-%m-%d %H:%M:%S') > hasta:
+            break
+        _aplicar_cambio(db, cursor, cambio)
+        seq = cambio['seq']
+        aplicados += 1
+    
+    conn.commit()
+    conn.close()
+    return ruta_completo, aplicados, seq
+
+def main():
+    """CLI: python respaldos.py [listar | respaldar | restaurar --hasta 'AAAA-MM-DD HH:MM' --destino archivo.db]"""
+    parser = argparse.ArgumentParser(description='Respaldos de la base de datos del congreso')
+    parser.add_argument('accion', choices=['listar', 'respaldar', 'restaurar'])
+    parser.add_argument('--base', default=os.environ.get('DB_NAME', 'congreso.db'), help='base de datos viva')
+    parser.add_argument('--directorio', default=DIRECTORIO_RESPALDOS)
+    parser.add_argument('--hasta', help="momento a restaurar en UTC, 'AAAA-MM-DD HH:MM[:SS]'")
+    parser.add_argument('--destino', help='archivo donde se escribe la base restaurada')
+    parser.add_argument('--sin-base-viva', action='store_true', help='usar solo los respaldos, no el historial de la base viva')
+    args = parser.parse_args()
+    
+    respaldos = Respaldos(args.base, args.directorio)
+    
+    if args.accion == 'listar':
+        completos, incrementales = respaldos.listar()
+        for ruta, fecha, seq in completos:
+            print(f'📦 {fecha:%Y-%m-%d %H:%M:%S} seq {seq}  {os.path.basename(ruta)}')
+        for ruta, desde, fin in incrementales:
+            print(f'➕ seq {desde + 1}-{fin}  {os.path.basename(ruta)}')
+        return
+    
+    if args.accion == 'respaldar':
+        ruta, tamano, seq = respaldos.crear_respaldo()
+        print(f'✅ {ruta} ({tamano} bytes, seq {seq})')
+        return
+    
+    if not args.destino:
+        parser.error('restaurar requiere --destino')
+    if os.path.exists(args.destino) and os.path.abspath(args.destino) == os.path.abspath(args.base):
+        parser.error('--destino no puede ser la base viva')
+    
+    hasta = None
+    if args.hasta:
+        formato = '%Y-%m-%d %H:%M:%S' if args.hasta.count(':') == 2 else '%Y-%m-%d %H:%M'
+        hasta = datetime.strptime(args.hasta, formato)
+    
+    base_viva = None if args.sin_base_viva else args.base
+    try:
+        copia, aplicados, seq = restaurar(respaldos, args.destino, hasta, base_viva)
+    except ValueError as e:
+        parser.exit(1, f'❌ {e}\n')
+    print(f'✅ {args.destino} restaurada desde {os.path.basename(copia)} + {aplicados} cambios (seq {seq})')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+import os
+import logging
+import threading
+from datetime import datetime, time, timezone
+
+logger = logging.getLogger(__name__)
+
+# Hora (UTC) del resumen de cierre del día; las 05:00 UTC son las 23:00 en el centro de México
+HORA_RESUMEN_DIARIO = time(*map(int, os.environ.get('HORA_RESUMEN_DIARIO', '05:00').split(':')), tzinfo=timezone.utc)
+
+# Frecuencias de los resúmenes programados y cómo se nombran en los mensajes
+FRECUENCIAS = {'hora': 'cada hora', 'dia': f'al cierre del día ({HORA_RESUMEN_DIARIO:%H:%M} UTC)'}
+
+def segundos_para_la_hora(ahora=None):
+    """Segundos que faltan para la próxima hora en punto (primer resumen horario)"""
+    ahora = ahora or datetime.now(timezone.utc)
+    return 3600 - (ahora.minute * 60 + ahora.second)
+
+class Resumenes:
+    """Suscripciones de los chats a los resúmenes programados y su cálculo
+
+    Las suscripciones viven en memoria (se cargan una vez, como los roles). En
+    cada tick del JobQueue el resumen de cada evento se calcula una sola vez,
+    de la copia de lectura, y se envía igual a todos los chats suscritos: los
+    organizadores ya no necesitan pedir /estadisticas cada pocos minutos.
+    """
+    
+    def __init__(self, db, replica, boletos=None):
+        self.db = db
+        self.replica = replica
+        self.boletos = boletos
+        self._lock = threading.Lock()
+        self._chats = {frecuencia: set() for frecuencia in FRECUENCIAS}
+        self._anteriores = {}
+        
+        for chat_id, frecuencia in db.obtener_suscripciones():
+            self._chats[frecuencia].add(chat_id)
+        
+        logger.info(
+            "Resúmenes: " + ', '.join(f"{len(chats)} chats {frecuencia}" for frecuencia, chats in self._chats.items())
+        )
+    
+    def del_chat(self, chat_id):
+        """Frecuencias a las que está suscrito un chat"""
+        return [frecuencia for frecuencia, chats in self._chats.items() if chat_id in chats]
+    
+    def suscribir(self, chat_id, frecuencias, usuario_id=None):
+        """Suscribe el chat a las frecuencias indicadas, en la base de datos y en memoria"""
+        with self._lock:
+            for frecuencia in frecuencias:
+                self.db.guardar_suscripcion(chat_id, frecuencia, True, usuario_id)
+                self._chats[frecuencia].add(chat_id)
+    
+    def cancelar(self, chat_id, frecuencias=FRECUENCIAS):
+        """Quita las suscripciones del chat a las frecuencias indicadas (todas por defecto)"""
+        with self._lock:
+            for frecuencia in frecuencias:
+                self.db.guardar_suscripcion(chat_id, frecuencia, False)
+                self._chats[frecuencia].discard(chat_id)
+    
+    def por_evento(self, frecuencia):
+        """Chats suscritos a la frecuencia agrupados por el evento en que trabaja cada uno"""
+        with self._lock:
+            chats = list(self._chats[frecuencia])
+        
+        eventos = {}
+        for chat_id in chats:
+            eventos.setdefault(self.db.evento_del_chat(chat_id), []).append(chat_id)
+        return eventos
+    
+    def calcular(self, evento_id, frecuencia):
+        """Datos del resumen de un evento, leídos una vez para todos sus suscriptores
+
+        Devuelve un diccionario con stats, cupos, ingresos ((con ingreso,
+        vigentes) o None) y cambios: (registros, asistentes) desde el resumen
+        anterior de esa frecuencia, o None en el primero desde que arrancó el bot.
+        """
+        lectura = self.replica.lectura(self.db.del_evento(evento_id))
+        stats = lectura.obtener_estadisticas()
+        
+        total = (stats['total_registros'], stats['total_asistentes'])
+        with self._lock:
+            anterior = self._anteriores.get((frecuencia, evento_id))
+            self._anteriores[(frecuencia, evento_id)] = total
+        
+        return {
+            'stats': stats,
+            'cupos': lectura.obtener_cupos(),
+            'ingresos': self.boletos.ingresados(evento_id) if self.boletos else None,
+            'cambios': None if anterior is None else (total[0] - anterior[0], total[1] - anterior[1]),
+        }
@@ -0,0 +1,44 @@
+import os
+import sys
+import asyncio
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture(scope='session')
+def dsn_pruebas(tmp_path_factory):
+    """DSN de una base PostgreSQL desechable para las pruebas del backend asyncpg
+
+    Se toma de PRUEBAS_DATABASE_URL (la base se vacía en cada prueba: no
+    apuntarla a datos reales); si no está definida y pgserver está instalado,
+    se levanta un servidor temporal. Sin ninguno de los dos se omiten.
+    """
+    pytest.importorskip('asyncpg')
+    dsn = os.environ.get('PRUEBAS_DATABASE_URL')
+    if dsn:
+        yield dsn
+        return
+    
+    pgserver = pytest.importorskip('pgserver', reason='Define PRUEBAS_DATABASE_URL o instala pgserver')
+    servidor = pgserver.get_server(str(tmp_path_factory.mktemp('postgres')), cleanup_mode='delete')
+    yield servidor.get_uri()
+    servidor.cleanup()
+
+@pytest.fixture
+def db_pg(dsn_pruebas):
+    """DatabasePostgres sobre un esquema vacío"""
+    import asyncpg
+    from database_pg import DatabasePostgres, _obtener_bucle
+    
+    async def vaciar():
+        conn = await asyncpg.connect(dsn_pruebas)
+        try:
+            await conn.execute('DROP SCHEMA public CASCADE; CREATE SCHEMA public')
+        finally:
+            await conn.close()
+    
+    asyncio.run_coroutine_threadsafe(vaciar(), _obtener_bucle()).result()
+    db = DatabasePostgres(dsn_pruebas)
+    yield db
+    db.cerrar()
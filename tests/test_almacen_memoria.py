@@ -0,0 +1,36 @@
+from almacen_memoria import AlmacenMemoria
+
+def test_recupera_y_sigue_escribiendo_tras_una_linea_rota(tmp_path):
+    ruta = tmp_path / 'memoria.log'
+    almacen = AlmacenMemoria(str(ruta), cada=1000)
+    almacen.agregar('G1', 'Ana', 'VIP', '100', '2')
+    almacen._bitacora.close()
+    
+    # El proceso cayó a mitad de escribir un evento
+    with open(ruta, 'a', encoding='utf-8') as f:
+        f.write('{"n": 2, "op": "alta", "fila": ["G2", "Be')
+    
+    almacen = AlmacenMemoria(str(ruta), cada=1000)
+    assert len(almacen) == 1
+    almacen.agregar('G3', 'Carla', 'VIP', '50', '1')
+    almacen.agregar('G4', 'Dario', 'General', '30', '3')
+    almacen._bitacora.close()
+    
+    almacen = AlmacenMemoria(str(ruta), cada=1000)
+    assert [fila.GRUPO for fila in almacen.filas()] == ['G1', 'G3', 'G4']
+    assert almacen.estadisticas()['total_asistentes'] == 6
+
+def test_json_completo_sin_salto_de_linea_se_descarta(tmp_path):
+    ruta = tmp_path / 'memoria.log'
+    almacen = AlmacenMemoria(str(ruta), cada=1000)
+    almacen.agregar('G1', 'Ana', 'VIP', '100', '2')
+    almacen._bitacora.close()
+    
+    with open(ruta, 'a', encoding='utf-8') as f:
+        f.write('{"n": 2, "op": "alta", "fila": ["G2", "Beto", "VIP", "10", "1"]}')
+    
+    almacen = AlmacenMemoria(str(ruta), cada=1000)
+    almacen.agregar('G3', 'Carla', 'VIP', '50', '1')
+    almacen._bitacora.close()
+    
+    assert [fila.GRUPO for fila in AlmacenMemoria(str(ruta), cada=1000).filas()] == ['G1', 'G3']
@@ -0,0 +1,7 @@
+import pytest
+
+from boletos import Boletos
+
+def test_sin_secreto_no_se_pueden_emitir_boletos():
+    with pytest.raises(RuntimeError):
+        Boletos(None, secreto='')
@@ -0,0 +1,148 @@
+import random
+import asyncio
+
+from telegram import Bot, Update, User
+from telegram.ext import Application, CommandHandler, ConversationHandler, MessageHandler, filters
+
+from concurrencia import ProcesadorOrdenado
+from database import Database
+
+GRUPO, GUIA, BONO, MONTO, ASISTENTES = range(5)
+
+def crear_actualizacion(bot, update_id, usuario_id, texto):
+    mensaje = {
+        'message_id': update_id, 'date': 0, 'text': texto,
+        'chat': {'id': usuario_id, 'type': 'private'},
+        'from': {'id': usuario_id, 'is_bot': False, 'first_name': f'U{usuario_id}'},
+    }
+    if texto.startswith('/'):
+        mensaje['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(texto)}]
+    return Update.de_json({'update_id': update_id, 'message': mensaje}, bot)
+
+def crear_aplicacion(procesador, db, pasos):
+    """Aplicación con el mismo flujo de captura que el bot (un paso por mensaje) y pausas que intercalan usuarios"""
+    async def pausa():
+        await asyncio.sleep(random.random() * 0.002)
+    
+    async def iniciar(update, context):
+        await pausa()
+        context.user_data.clear()
+        pasos.setdefault(update.effective_user.id, []).append('nuevo')
+        return GRUPO
+    
+    def capturar(campo, siguiente):
+        async def handler(update, context):
+            await pausa()
+            context.user_data[campo] = update.message.text
+            pasos[update.effective_user.id].append(campo)
+            return siguiente
+        return handler
+    
+    async def guardar(update, context):
+        datos = context.user_data
+        await pausa()
+        await db.asincrona.agregar_registro(
+            datos['grupo'], datos['guia'], datos['bono'], datos['monto'], update.message.text,
+            usuario=update.effective_user.id
+        )
+        pasos[update.effective_user.id].append('asistentes')
+        return ConversationHandler.END
+    
+    texto = filters.TEXT & ~filters.COMMAND
+    aplicacion = Application.builder().token('123:abc').concurrent_updates(procesador).build()
+    # Sin red: se da por inicializada con el usuario del bot que devolvería get_me
+    aplicacion.bot._bot_user = User(999, 'congreso_bot', True, username='congreso_bot')
+    aplicacion._initialized = True
+    aplicacion.add_handler(ConversationHandler(
+        entry_points=[CommandHandler('nuevo', iniciar)],
+        states={
+            GRUPO: [MessageHandler(texto, capturar('grupo', GUIA))],
+            GUIA: [MessageHandler(texto, capturar('guia', BONO))],
+            BONO: [MessageHandler(texto, capturar('bono', MONTO))],
+            MONTO: [MessageHandler(texto, capturar('monto', ASISTENTES))],
+            ASISTENTES: [MessageHandler(texto, guardar)],
+        },
+        fallbacks=[],
+        per_chat=True,
+        per_user=True,
+        block=True,
+    ))
+    return aplicacion
+
+def test_quinientas_capturas_simultaneas_sin_cruces(tmp_path):
+    random.seed(2026)
+    usuarios = 500
+    db = Database(str(tmp_path / 'congreso.db'))
+    procesador = ProcesadorOrdenado(trabajadores=16)
+    pasos = {}
+    aplicacion = crear_aplicacion(procesador, db, pasos)
+    
+    # Los pasos de todos los usuarios llegan intercalados; los de cada usuario, en su orden
+    colas = {
+        usuario: ['/nuevo', f'G{usuario}', f'U{usuario}', f'B{usuario % 7}', f'{usuario}.25', str(usuario)]
+        for usuario in range(1, usuarios + 1)
+    }
+    actualizaciones = []
+    while colas:
+        usuario = random.choice(list(colas))
+        actualizaciones.append(crear_actualizacion(aplicacion.bot, len(actualizaciones) + 1, usuario, colas[usuario].pop(0)))
+        if not colas[usuario]:
+            del colas[usuario]
+    
+    async def procesar():
+        await procesador.initialize()
+        await asyncio.gather(*(
+            procesador.process_update(update, aplicacion.process_update(update)) for update in actualizaciones
+        ))
+    
+    asyncio.run(procesar())
+    
+    registros = db.obtener_todos_registros()
+    assert len(registros) == usuarios
+    for registro in registros:
+        usuario = registro.asistentes
+        assert (registro.grupo, registro.guia, registro.bono, registro.centavos) == (
+            f'G{usuario}', f'U{usuario}', f'B{usuario % 7}', usuario * 100 + 25
+        )
+    assert all(
+        recorrido == ['nuevo', 'grupo', 'guia', 'bono', 'monto', 'asistentes'] for recorrido in pasos.values()
+    )
+    assert len(pasos) == usuarios
+    assert len(procesador.candados) == 0
+
+def test_rafaga_de_un_usuario_no_acapara_los_lugares_en_vuelo():
+    bot = Bot('123:abc')
+    procesador = ProcesadorOrdenado(trabajadores=4, en_vuelo=16, por_usuario=5)
+    
+    async def probar():
+        soltar = asyncio.Event()
+        atendidas = []
+        
+        async def lenta(n):
+            await soltar.wait()
+            atendidas.append(n)
+        
+        async def rapida():
+            atendidas.append('otro')
+        
+        rafaga = [
+            asyncio.create_task(procesador.process_update(
+                crear_actualizacion(bot, n, 1, f'm{n}'), lenta(n)
+            ))
+            for n in range(30)
+        ]
+        await asyncio.sleep(0.05)
+        
+        # El otro usuario no espera a que termine la ráfaga
+        await asyncio.wait_for(
+            procesador.process_update(crear_actualizacion(bot, 100, 2, 'hola'), rapida()), timeout=1
+        )
+        assert atendidas == ['otro']
+        
+        soltar.set()
+        await asyncio.gather(*rafaga)
+        return atendidas
+    
+    atendidas = asyncio.run(probar())
+    assert atendidas == ['otro', 0, 1, 2, 3, 4]
+    assert procesador.descartadas == 25
@@ -0,0 +1,32 @@
+from database import Database
+
+def test_renombrar_solo_mayusculas_cambia_el_nombre(tmp_path):
+    db = Database(str(tmp_path / 'congreso.db'))
+    db.agregar_registro('G1', 'Ana', 'vip', 100, 2)
+    db.obtener_todos_registros()
+    
+    # 'VIP' tiene la misma clave que 'vip': no hay otro bono al cual pasar, se corrige el nombre
+    assert db.renombrar_bono('vip', 'VIP') == 1
+    assert [registro.bono for registro in db.obtener_todos_registros()] == ['VIP']
+    assert db.obtener_indice_bonos().buscar('vip')[1] == 'VIP'
+
+def test_actualizar_bono_cambia_la_fila_y_la_cache(tmp_path):
+    db = Database(str(tmp_path / 'congreso.db'))
+    registro_id, _ = db.agregar_registro('G1', 'Ana', 'VIP', 100, 2)
+    
+    # Se leen antes para que queden en caché
+    assert db.obtener_registro_por_id(registro_id).bono == 'VIP'
+    assert len(db.obtener_registros_por_bono('VIP')) == 1
+    
+    assert db.actualizar_bono(registro_id, 'Gold')
+    assert db.obtener_registro_por_id(registro_id).bono == 'Gold'
+    assert db.obtener_registros_por_bono('VIP') == []
+    assert [registro.id for registro in db.obtener_registros_por_bono('Gold')] == [registro_id]
+    assert db.obtener_indice_bonos().buscar('gold')[1] == 'Gold'
+
+def test_alta_repetida_devuelve_el_original_sin_marcarlo_nuevo(tmp_path):
+    db = Database(str(tmp_path / 'congreso.db'))
+    
+    assert db.agregar_registro('G1', 'Ana', 'VIP', 100, 2, clave='clave-1') == (1, True)
+    assert db.agregar_registro('G1', 'Ana', 'VIP', 100, 2, clave='clave-1') == (1, False)
+    assert len(db.obtener_todos_registros()) == 1
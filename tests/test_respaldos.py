@@ -0,0 +1,21 @@
+from database import Database
+from respaldos import Respaldos, restaurar
+
+def test_restaurar_reaplica_los_cambios_posteriores_al_respaldo(tmp_path):
+    db = Database(str(tmp_path / 'congreso.db'))
+    primero, _ = db.agregar_registro('G1', 'Ana', 'VIP', 100, 2)
+    segundo, _ = db.agregar_registro('G2', 'Luis', 'General', 50, 1)
+    respaldos = Respaldos(db.db_name, str(tmp_path / 'respaldos'))
+    respaldos.crear_respaldo()
+    
+    # Cambios que solo están en el historial: alta con un bono nuevo, cambio de bono y baja
+    db.agregar_registro('G3', 'Eva', 'Platino', 300, 4)
+    db.actualizar_bono(primero, 'General')
+    db.eliminar_registro(segundo)
+    respaldos.respaldar_cambios()
+    
+    destino = str(tmp_path / 'restaurada.db')
+    _, aplicados, _ = restaurar(respaldos, destino)
+    
+    assert aplicados == 3
+    assert Database(destino).obtener_todos_registros() == db.obtener_todos_registros()